@@ -0,0 +1,201 @@
+"""
+Appointment list queries for HealthAssist application
+
+Lists are read in (appointment_date, appointment_time, appointment_id)
+order and paged with a keyset cursor: each page continues from the last
+row of the previous one, so deep pages cost the same as the first.
+Exports stream the whole list through a server-side cursor instead.
+"""
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from models import Appointment, User
+
+# Appointments returned per page by default, and at most
+APPOINTMENTS_PAGE_SIZE = 100
+MAX_APPOINTMENTS_PAGE_SIZE = 1000
+
+# Rows fetched per round trip from the server-side cursor of an export
+EXPORT_BATCH_SIZE = 1000
+
+# Export formats and their content types
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Columns of an exported appointment, in CSV column order
+EXPORT_COLUMNS = ('appointment_id', 'user_id', 'user_name', 'checkup_id',
+                  'checkup_name', 'appointment_date', 'appointment_time',
+                  'status', 'price_paid', 'created_at')
+
+# Sort key of appointment lists; the cursor holds its values for the last row
+APPOINTMENT_ORDER = (Appointment.appointment_date, Appointment.appointment_time,
+                     Appointment.appointment_id)
+
+
+def encode_cursor(appointment_date, appointment_time, appointment_id):
+    """
+    Build the cursor continuing a list after an appointment
+
+    Args:
+        appointment_date: Date of the last appointment returned (date object)
+        appointment_time: Time of the last appointment returned (time object)
+        appointment_id: ID of the last appointment returned
+
+    Returns:
+        str: Opaque URL-safe cursor
+    """
+    payload = json.dumps([
+        appointment_date.isoformat(),
+        appointment_time.isoformat(), appointment_id
+    ])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor built by encode_cursor
+
+    Args:
+        cursor: Cursor from a previous page
+
+    Returns:
+        tuple: (date, time, appointment_id) of the last appointment returned
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_str, time_str, appointment_id = json.loads(payload)
+        return (datetime.strptime(date_str, "%Y-%m-%d").date(),
+                datetime.strptime(time_str, "%H:%M:%S").time(),
+                int(appointment_id))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def parse_appointment_filters(args):
+    """
+    Turn list query parameters into filter conditions
+
+    Supported parameters are start_date and end_date (inclusive,
+    YYYY-MM-DD), status, checkup_id and user_id.
+
+    Args:
+        args: Request query parameters
+
+    Returns:
+        list: SQLAlchemy conditions on Appointment
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    conditions = []
+    try:
+        if args.get('start_date'):
+            conditions.append(Appointment.appointment_date >= datetime.strptime(
+                args['start_date'], "%Y-%m-%d").date())
+        if args.get('end_date'):
+            conditions.append(Appointment.appointment_date <= datetime.strptime(
+                args['end_date'], "%Y-%m-%d").date())
+    except ValueError as e:
+        raise ValueError("Invalid date format") from e
+
+    if args.get('status'):
+        conditions.append(Appointment.status == args['status'])
+
+    for name, column in (('checkup_id', Appointment.checkup_id),
+                         ('user_id', Appointment.user_id)):
+        if args.get(name):
+            try:
+                conditions.append(column == int(args[name]))
+            except ValueError as e:
+                raise ValueError(f"Invalid {name}") from e
+
+    return conditions
+
+
+def page_appointments(query, cursor, limit):
+    """
+    Fetch one page of an appointment list
+
+    Args:
+        query: Query over Appointment with its filters applied
+        cursor: Cursor from the previous page, or None for the first page
+        limit: Maximum number of rows to return
+
+    Returns:
+        tuple: (rows, next cursor or None when this is the last page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if cursor:
+        query = query.filter(tuple_(*APPOINTMENT_ORDER) > decode_cursor(cursor))
+
+    rows = query.order_by(*APPOINTMENT_ORDER).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.appointment_date, last.appointment_time,
+                               last.appointment_id)
+
+
+def export_appointments(session_factory, conditions, export_format):
+    """
+    Stream matching appointments as NDJSON or CSV
+
+    Rows are read through a server-side cursor EXPORT_BATCH_SIZE at a
+    time and each batch is written out before the next is fetched, so
+    memory use does not grow with the table. The generator owns its
+    session, since it keeps running after the request has returned.
+
+    Args:
+        session_factory: Callable returning a new database session
+        conditions: Filter conditions from parse_appointment_filters
+        export_format: 'ndjson' or 'csv'
+
+    Yields:
+        str: Chunks of the export
+    """
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    query = select(
+        Appointment.appointment_id, Appointment.user_id, User.user_name,
+        Appointment.checkup_id, Appointment.checkup_name,
+        Appointment.appointment_date, Appointment.appointment_time,
+        Appointment.status, Appointment.price_paid,
+        Appointment.created_at).join(
+            User, Appointment.user_id == User.user_id).where(
+                *conditions).order_by(*APPOINTMENT_ORDER).execution_options(
+                    yield_per=EXPORT_BATCH_SIZE)
+
+    session = session_factory()
+    try:
+        for batch in session.execute(query).partitions():
+            rows = [(row.appointment_id, row.user_id, row.user_name,
+                     row.checkup_id, row.checkup_name,
+                     row.appointment_date.isoformat(),
+                     row.appointment_time.isoformat(), row.status,
+                     float(row.price_paid),
+                     row.created_at.isoformat() if row.created_at else None)
+                    for row in batch]
+
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield ''.join(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+                    for row in rows)
+    finally:
+        session.close()
@@ -0,0 +1,193 @@
+"""
+Day-before appointment reminders for HealthAssist application
+
+send_reminders (flask send-reminders, for running from cron once a day)
+emails everyone with a confirmed appointment on the given day, tomorrow
+by default. The appointments are read by one query over a partial index
+of confirmed appointments not yet reminded, streamed through a
+server-side cursor REMINDER_CHUNK_SIZE rows at a time. Each chunk is
+rendered from a template compiled once per run and sent as one batch
+over a pooled SMTP connection, a few chunks at a time.
+
+Appointments are marked with reminder_sent_at as their chunk completes,
+and marked ones drop out of the index, so a run that crashed or was
+stopped resumes where it left off: only chunks in flight at the time
+can be sent twice. Reminders the SMTP server refuses for now are saved
+to the emails/ spool for flask drain-emails to retry, and a chunk that
+fails altogether is logged and left for the next run.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, text, update
+from models import Appointment, User
+from email_service import (smtp_pool, build_message, save_email_to_file,
+                           compile_reminder_template,
+                           render_appointment_reminder, SendError,
+                           REMINDER_SUBJECT, SMTP_POOL_SIZE)
+
+# Key of the PostgreSQL advisory lock held while reminders are sent, so
+# overlapping cron runs do not send the same reminders twice
+REMINDER_LOCK_KEY = 0x52454d44  # "REMD"
+
+# Appointments fetched, rendered and sent as one batch
+REMINDER_CHUNK_SIZE = int(os.environ.get('REMINDER_CHUNK_SIZE', 100))
+
+# Batches sent at the same time; more than the SMTP pool only queue for a connection
+REMINDER_WORKERS = int(os.environ.get('REMINDER_WORKERS', SMTP_POOL_SIZE))
+
+
+def due_reminders_query(appointment_date):
+    """
+    Build the query for the confirmed appointments of a day still waiting for a reminder
+
+    Args:
+        appointment_date: Day of the appointments (date object)
+
+    Returns:
+        Select: Query served by idx_appointment_reminder_due, in time order
+    """
+    return select(
+        Appointment.appointment_id, Appointment.appointment_time,
+        Appointment.checkup_name, User.user_name, User.email).join(
+            User, Appointment.user_id == User.user_id).where(
+                Appointment.status == 'Confirmed',
+                Appointment.reminder_sent_at.is_(None),
+                Appointment.appointment_date == appointment_date).order_by(
+                    Appointment.appointment_time,
+                    Appointment.appointment_id).execution_options(
+                        yield_per=REMINDER_CHUNK_SIZE)
+
+
+def _send_chunk(template, rows):
+    """
+    Send the reminders of one chunk over a single SMTP connection
+
+    Reminders the server refuses for now are saved to the emails/ spool
+    instead; those it refuses for good are dropped. A reminder that cannot
+    be rendered is left for the next run without holding up the others.
+
+    Returns:
+        tuple: (IDs of the appointments handled, reminders sent, reminders saved)
+    """
+    contents = {}
+    messages = {}
+    errors = {}
+    for index, row in enumerate(rows):
+        try:
+            contents[index] = render_appointment_reminder(template, row.user_name,
+                                                          row.appointment_time,
+                                                          row.checkup_name)
+            messages[index] = build_message(row.email, REMINDER_SUBJECT, contents[index])
+        except Exception as e:
+            errors[index] = f"Cannot build reminder: {str(e)}"
+    ready = list(messages)
+    results = smtp_pool.send_batch([messages[index] for index in ready]) if ready else []
+    errors.update(zip(ready, results))
+
+    handled = []
+    sent = saved = 0
+    for index, row in enumerate(rows):
+        error = errors.get(index)
+        if error is None:
+            sent += 1
+        elif index not in contents:
+            print(f"Reminder for appointment {row.appointment_id} not sent: {error}")
+            continue
+        elif isinstance(error, SendError) and error.permanent:
+            # Sending it again cannot succeed, so it is not saved
+            print(f"Reminder for appointment {row.appointment_id} refused: {error}")
+        elif save_email_to_file(row.email, REMINDER_SUBJECT, contents[index]):
+            print(f"Reminder for appointment {row.appointment_id} saved "
+                  f"for later sending: {error}")
+            saved += 1
+        else:
+            # Neither sent nor saved: leave it for the next run
+            continue
+        handled.append(row.appointment_id)
+    return handled, sent, saved
+
+
+def _mark_reminded(session_factory, appointment_date, appointment_ids):
+    """Record that the given appointments of a day have had their reminder"""
+    if not appointment_ids:
+        return
+    session = session_factory()
+    try:
+        session.execute(
+            update(Appointment).where(
+                Appointment.appointment_date == appointment_date,
+                Appointment.appointment_id.in_(appointment_ids)).values(
+                    reminder_sent_at=datetime.now()).execution_options(
+                        synchronize_session=False))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def send_reminders(engine, session_factory, appointment_date=None,
+                   workers=REMINDER_WORKERS):
+    """
+    Send the reminders for one day's confirmed appointments
+
+    Args:
+        engine: SQLAlchemy engine, used for the advisory lock
+        session_factory: Callable returning a new database session
+        appointment_date: Day of the appointments (defaults to tomorrow)
+        workers: Chunks sent at the same time
+
+    Returns:
+        dict: Counts of reminders 'sent' and 'saved' for later sending, and
+            of chunks that failed ('errors'), or None if another run holds
+            the lock
+    """
+    appointment_date = appointment_date or date.today() + timedelta(days=1)
+    template = compile_reminder_template(appointment_date)
+    counts = {'sent': 0, 'saved': 0, 'errors': 0}
+
+    # Autocommit, so the connection holding the lock is not left idle in a
+    # transaction for the whole run
+    with engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as lock_connection:
+        if engine.dialect.name == 'postgresql':
+            locked = lock_connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {'key': REMINDER_LOCK_KEY}).scalar()
+            if not locked:
+                return None
+
+        def finish(future):
+            # A failed chunk stays unmarked for the next run; the rest go on
+            try:
+                handled, sent, saved = future.result()
+                _mark_reminded(session_factory, appointment_date, handled)
+            except Exception as e:
+                print(f"Error sending a chunk of reminders: {str(e)}")
+                counts['errors'] += 1
+                return
+            counts['sent'] += sent
+            counts['saved'] += saved
+
+        session = session_factory()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                # Submit chunks only as fast as they are sent, so the cursor
+                # is not read ahead into memory
+                in_flight = deque()
+                for rows in session.execute(
+                        due_reminders_query(appointment_date)).partitions():
+                    in_flight.append(executor.submit(_send_chunk, template, rows))
+                    if len(in_flight) >= max(1, workers):
+                        finish(in_flight.popleft())
+                while in_flight:
+                    finish(in_flight.popleft())
+        finally:
+            session.close()
+            if engine.dialect.name == 'postgresql':
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"),
+                                        {'key': REMINDER_LOCK_KEY})
+    return counts
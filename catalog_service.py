@@ -0,0 +1,221 @@
+"""
+Catalog caches for HealthAssist application
+
+The checkup types, specialists and health facts are tiny and change
+rarely, but are read on nearly every page load and booking request. Each
+worker process keeps an immutable snapshot of the checkup types and the
+serialized catalog listings, dropped after a change is committed in this
+process or announced by another one through PostgreSQL NOTIFY (see
+slot_events.py).
+"""
+import hashlib
+import os
+import threading
+import time as clock
+from sqlalchemy import func, select
+from models import CheckupType
+
+# PostgreSQL NOTIFY channel announcing catalog changes
+CATALOG_CHANNEL = 'catalog_changes'
+
+# Seconds a catalog snapshot is trusted if a change announcement is missed
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', 300))
+
+# Catalogs served as cached listings
+CHECKUP_TYPES = 'checkup_types'
+SPECIALISTS = 'specialists'
+HEALTH_FACTS = 'health_facts'
+CATALOGS = (CHECKUP_TYPES, SPECIALISTS, HEALTH_FACTS)
+
+
+class CheckupRecord:
+    """Read-only copy of a CheckupType row"""
+
+    __slots__ = ('checkup_id', 'name', 'description', 'price',
+                 'duration_minutes', 'max_slots_per_time', 'image_path',
+                 'is_active', 'created_at')
+
+    def __init__(self, checkup):
+        for field in self.__slots__:
+            object.__setattr__(self, field, getattr(checkup, field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CheckupRecord is read-only ({name})")
+
+    def __repr__(self):
+        return f"<CheckupRecord(checkup_id={self.checkup_id}, name={self.name}, price={self.price})>"
+
+
+class CheckupCatalog:
+    """
+    Versioned snapshot of every checkup type
+
+    The version is bumped on every invalidation. A snapshot loaded while
+    the version moved on is used for that request but not kept, so a
+    reload racing a change can never cache the old rows.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self._records = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _snapshot(self, session):
+        with self._lock:
+            if (self._records is not None
+                    and clock.monotonic() - self._loaded_at < self.ttl):
+                return self._records
+            version = self.version
+
+        records = {
+            checkup.checkup_id: CheckupRecord(checkup)
+            for checkup in session.query(CheckupType).order_by(
+                CheckupType.checkup_id)
+        }
+
+        with self._lock:
+            if self.version == version:
+                self._records = records
+                self._loaded_at = clock.monotonic()
+        return records
+
+    def get(self, session, checkup_id):
+        """
+        Get one checkup type
+
+        Args:
+            session: Database session, used only to reload the snapshot
+            checkup_id: ID of the checkup type
+
+        Returns:
+            CheckupRecord: The checkup type, or None if it does not exist
+        """
+        try:
+            checkup_id = int(checkup_id)
+        except (TypeError, ValueError):
+            return None
+        return self._snapshot(session).get(checkup_id)
+
+    def all(self, session, active_only=False):
+        """
+        Get every checkup type ordered by ID
+
+        Args:
+            session: Database session, used only to reload the snapshot
+            active_only: Only return active checkup types
+
+        Returns:
+            list: CheckupRecord objects
+        """
+        records = self._snapshot(session).values()
+        if active_only:
+            return [record for record in records if record.is_active == 1]
+        return list(records)
+
+    def invalidate(self):
+        """Drop the snapshot so the next lookup reloads it"""
+        with self._lock:
+            self.version += 1
+            self._records = None
+
+
+class Listing:
+    """Serialized catalog listing with its strong ETag"""
+
+    __slots__ = ('body', 'etag', 'loaded_at')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.loaded_at = clock.monotonic()
+
+
+class ListingCache:
+    """
+    Serialized catalog listings, one per catalog and field selection
+
+    The ETag is a digest of the listing itself, so every worker hands out
+    the same tag for the same content. Each catalog has a version counter
+    bumped on invalidation; a listing built from an older version is not
+    kept. Listings of a subset of fields are cached as variants of the
+    catalog and invalidated with it.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._listings = {}
+        self._versions = dict.fromkeys(CATALOGS, 0)
+        self._lock = threading.Lock()
+
+    def get(self, name, variant=None):
+        """Return the cached listing of a catalog, or None if missing or expired"""
+        with self._lock:
+            listing = self._listings.get((name, variant))
+            if listing is None:
+                return None
+            if clock.monotonic() - listing.loaded_at >= self.ttl:
+                del self._listings[(name, variant)]
+                return None
+            return listing
+
+    def version(self, name):
+        """Return the current version of a catalog, read before building a listing"""
+        with self._lock:
+            return self._versions[name]
+
+    def store(self, name, version, body, variant=None):
+        """
+        Cache a serialized listing built at the given catalog version
+
+        Args:
+            name: Catalog name
+            version: Value of version(name) before the rows were read
+            body: Serialized listing (bytes)
+            variant: Hashable key of the field selection, or None for all fields
+
+        Returns:
+            Listing: The listing, cached only if the catalog did not change meanwhile
+        """
+        listing = Listing(body)
+        with self._lock:
+            if self._versions[name] == version:
+                self._listings[(name, variant)] = listing
+        return listing
+
+    def invalidate(self, name):
+        """Drop every listing of a catalog"""
+        with self._lock:
+            self._versions[name] += 1
+            for key in [key for key in self._listings if key[0] == name]:
+                del self._listings[key]
+
+
+checkup_catalog = CheckupCatalog(CATALOG_TTL)
+catalog_listings = ListingCache(CATALOG_TTL)
+
+
+def invalidate_catalog(name=None):
+    """
+    Drop the cached copies of a catalog in this process
+
+    Args:
+        name: Catalog name, or None for every catalog
+    """
+    for catalog in CATALOGS if name is None else (name, ):
+        catalog_listings.invalidate(catalog)
+        if catalog == CHECKUP_TYPES:
+            checkup_catalog.invalidate()
+
+
+def publish_catalog_change(session, name):
+    """
+    Announce a catalog change to every worker when the transaction commits
+
+    Args:
+        session: Database session
+        name: Catalog name
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(select(func.pg_notify(CATALOG_CHANNEL, name)))
@@ -0,0 +1,223 @@
+"""
+Response compression for HealthAssist application
+
+Dynamic responses (JSON and rendered HTML) are compressed after the
+request, with brotli when it is installed (the "all" extra) and the
+client accepts it, and with gzip otherwise. Responses below a size
+threshold and streamed responses, such as appointment exports and slot
+availability streams, are sent as they are.
+
+Static HTML, CSS and JavaScript are compressed once, ahead of time, into
+.br and .gz files next to the originals. send_precompressed serves those
+to clients that accept them. They are built by the image build (see the
+Dockerfile), never by the application itself; run this module to build
+them elsewhere:
+
+    python compression.py
+"""
+import gzip
+import mimetypes
+import os
+import sys
+from flask import send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the installed extras
+    brotli = None
+
+# Responses smaller than this many bytes are not worth compressing
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+# Compression levels for dynamic responses, traded against CPU per request
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+# Content types compressed on the fly
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json', 'text/html', 'text/css', 'text/plain',
+    'application/javascript', 'text/javascript', 'image/svg+xml'
+})
+
+# Static files precompressed ahead of time, and where they live
+PRECOMPRESSED_EXTENSIONS = frozenset({'.html', '.css', '.js', '.svg'})
+STATIC_DIRS = ('.', 'css', 'js', 'assets')
+
+# File suffix of each precompressed encoding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def negotiate_encoding(accept_encodings):
+    """
+    Pick the content encoding to send a client
+
+    The encoding with the highest q-value wins, brotli on a tie. An
+    encoding with q=0 is never picked.
+
+    Args:
+        accept_encodings: Parsed Accept-Encoding header (request.accept_encodings)
+
+    Returns:
+        str: 'br' or 'gzip', or None to send the response uncompressed
+    """
+    best, best_quality = None, 0
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, static=False):
+    """
+    Compress a response body
+
+    Args:
+        data: Body to compress (bytes)
+        encoding: 'br' or 'gzip'
+        static: Use the slowest, smallest settings, for files compressed once
+
+    Returns:
+        bytes: Compressed body
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9 if static else GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encodings):
+    """
+    Compress a dynamic response if the client accepts it and it is worth it
+
+    File responses are left to send_precompressed and streamed responses
+    are never buffered. A strong ETag becomes weak on compression, since
+    the compressed body differs byte for byte; conditional requests still
+    match, as If-None-Match uses weak comparison.
+
+    Args:
+        response: Response about to be sent
+        accept_encodings: Parsed Accept-Encoding header (request.accept_encodings)
+
+    Returns:
+        Response: The same response, compressed in place when applicable
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < COMPRESSION_MIN_SIZE:
+        return response
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return response
+
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _is_fresh(source, compressed):
+    """Check a precompressed file exists and is not older than its source"""
+    try:
+        return os.path.getmtime(compressed) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def send_precompressed(directory, path, accept_encodings):
+    """
+    Send a static file, using its precompressed version when the client accepts it
+
+    Falls back to the original file when no up-to-date precompressed
+    version exists, so a missing build step only costs bandwidth.
+
+    Args:
+        directory: Directory to serve from
+        path: File path relative to the directory
+        accept_encodings: Parsed Accept-Encoding header (request.accept_encodings)
+
+    Returns:
+        Response: The file response
+    """
+    if os.path.splitext(path)[1] not in PRECOMPRESSED_EXTENSIONS:
+        return send_from_directory(directory, path)
+
+    source = safe_join(directory, path)
+    encoding = negotiate_encoding(accept_encodings)
+    if source is not None and encoding is not None:
+        suffix = ENCODING_SUFFIXES[encoding]
+        if _is_fresh(source, source + suffix):
+            response = send_from_directory(directory, path + suffix,
+                                           mimetype=mimetypes.guess_type(path)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+
+    response = send_from_directory(directory, path)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def precompress_static(root='.'):
+    """
+    Write .br and .gz versions of the static files that lack an up-to-date one
+
+    Files are written to a temporary name and renamed into place, so a
+    running application never serves a partial file.
+
+    Args:
+        root: Application directory containing STATIC_DIRS
+
+    Returns:
+        int: Number of compressed files written
+    """
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    written = 0
+    for static_dir in STATIC_DIRS:
+        directory = os.path.join(root, static_dir)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            source = os.path.join(directory, name)
+            if (os.path.splitext(name)[1] not in PRECOMPRESSED_EXTENSIONS
+                    or not os.path.isfile(source)
+                    or os.path.getsize(source) < COMPRESSION_MIN_SIZE):
+                continue
+
+            data = None
+            for encoding in encodings:
+                target = source + ENCODING_SUFFIXES[encoding]
+                if _is_fresh(source, target):
+                    continue
+                if data is None:
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                temp = f"{target}.{os.getpid()}.tmp"
+                try:
+                    with open(temp, 'wb') as f:
+                        f.write(compress(data, encoding, static=True))
+                    os.replace(temp, target)
+                    written += 1
+                except OSError as e:
+                    print(f"Error precompressing {source}: {str(e)}")
+                    if os.path.exists(temp):
+                        os.remove(temp)
+    return written
+
+
+if __name__ == '__main__':
+    count = precompress_static(sys.argv[1] if len(sys.argv) > 1 else '.')
+    print(f"Precompressed {count} static file(s)")
@@ -0,0 +1,101 @@
+"""
+Admin dashboard statistics for HealthAssist application
+
+The dashboard counts are computed with aggregate SQL in one round trip
+and shared by every admin in the worker process for a few seconds.
+"""
+import os
+import threading
+import time as clock
+from datetime import date
+from sqlalchemy import func, select
+from models import User, Appointment, Specialist
+
+# Seconds the dashboard statistics are reused before being recomputed
+DASHBOARD_STATS_TTL = float(os.environ.get('DASHBOARD_STATS_TTL', 5))
+
+# Appointments listed under recent activity
+RECENT_APPOINTMENTS_LIMIT = 5
+
+_cached_stats = None
+_cached_until = 0.0
+_stats_lock = threading.Lock()
+
+
+def compute_dashboard_stats(session):
+    """
+    Compute the admin dashboard statistics
+
+    Args:
+        session: Database session
+
+    Returns:
+        dict: User counts ('doctors' counts users of type Doctor),
+            'active_specialists', appointment counts and the most recent
+            appointments
+    """
+    today = date.today()
+
+    def count(model, *conditions):
+        return select(func.count()).select_from(model).where(
+            *conditions).scalar_subquery()
+
+    counts = session.execute(
+        select(
+            count(User).label('total_users'),
+            count(User, User.user_type == 'Normal').label('patients'),
+            count(User, User.user_type == 'Doctor').label('doctors'),
+            count(Specialist, Specialist.is_active == 1).label(
+                'active_specialists'),
+            count(Appointment).label('total_appointments'),
+            count(Appointment, Appointment.appointment_date == today).label(
+                'today_appointments'),
+            count(Appointment, Appointment.appointment_date > today).label(
+                'upcoming_appointments'))).one()
+
+    recent = session.execute(
+        select(Appointment.appointment_id, Appointment.user_id,
+               User.user_name, Appointment.checkup_name,
+               Appointment.appointment_date, Appointment.appointment_time,
+               Appointment.status).join(
+                   User, Appointment.user_id == User.user_id).order_by(
+                       Appointment.appointment_date.desc(),
+                       Appointment.appointment_time.desc(),
+                       Appointment.appointment_id.desc()).limit(
+                           RECENT_APPOINTMENTS_LIMIT)).all()
+
+    stats = dict(counts._mapping)
+    stats['recent_appointments'] = [{
+        'appointment_id': appt.appointment_id,
+        'user_id': appt.user_id,
+        'user_name': appt.user_name,
+        'checkup_name': appt.checkup_name,
+        'appointment_date': appt.appointment_date.isoformat(),
+        'appointment_time': appt.appointment_time.isoformat(),
+        'status': appt.status
+    } for appt in recent]
+    return stats
+
+
+def get_dashboard_stats(session, refresh=False):
+    """
+    Get the admin dashboard statistics, reusing recent results
+
+    Args:
+        session: Database session
+        refresh: Recompute even if cached statistics are still fresh
+
+    Returns:
+        dict: Statistics from compute_dashboard_stats
+    """
+    global _cached_stats, _cached_until
+    with _stats_lock:
+        if not refresh and _cached_stats is not None and clock.monotonic() < _cached_until:
+            return _cached_stats
+
+    stats = compute_dashboard_stats(session)
+
+    with _stats_lock:
+        _cached_stats = stats
+        _cached_until = clock.monotonic() + DASHBOARD_STATS_TTL
+    return stats
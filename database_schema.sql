@@ -14,6 +14,9 @@ CREATE TABLE users (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create an index for users by type
+CREATE INDEX idx_users_user_type ON users (user_type);
+
 -- Checkup Types Table
 CREATE TABLE checkup_types (
     checkup_id SERIAL PRIMARY KEY,
@@ -27,9 +30,10 @@ CREATE TABLE checkup_types (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Appointments Table
+-- Appointments Table, partitioned by month of appointment_date
+-- (monthly partitions are created by the application, see partitions.py)
 CREATE TABLE appointments (
-    appointment_id SERIAL PRIMARY KEY,
+    appointment_id SERIAL,
     user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE ON UPDATE CASCADE,
     checkup_id INTEGER NOT NULL REFERENCES checkup_types(checkup_id),
     checkup_name VARCHAR(100) NOT NULL,
@@ -37,12 +41,78 @@ CREATE TABLE appointments (
     appointment_time TIME NOT NULL,
     status VARCHAR(20) NOT NULL DEFAULT 'Confirmed',
     price_paid NUMERIC(10, 2) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    reminder_sent_at TIMESTAMP,
+    checkout_session_id VARCHAR(255),
+    PRIMARY KEY (appointment_id, appointment_date)
+) PARTITION BY RANGE (appointment_date);
+
+-- Appointments dated outside every monthly partition
+CREATE TABLE appointments_default PARTITION OF appointments DEFAULT;
 
 -- Create an index for appointment slots
 CREATE INDEX idx_appointment_slot ON appointments (appointment_date, appointment_time, checkup_id);
 
+-- Create an index for bookings overlapping a slot of one checkup type
+CREATE INDEX idx_appointment_checkup_day ON appointments (checkup_id, appointment_date, appointment_time);
+
+-- Create indexes for paging appointment lists, unfiltered or filtered by user or status
+CREATE INDEX idx_appointment_keyset ON appointments (appointment_date, appointment_time, appointment_id);
+CREATE INDEX idx_appointment_user_keyset ON appointments (user_id, appointment_date, appointment_time, appointment_id);
+CREATE INDEX idx_appointment_status_keyset ON appointments (status, appointment_date, appointment_time, appointment_id);
+
+-- Book each Stripe checkout session at most once
+CREATE UNIQUE INDEX uq_appointment_checkout_session ON appointments (checkout_session_id, appointment_date);
+
+-- Create an index for confirmed appointments still waiting for their day-before reminder
+CREATE INDEX idx_appointment_reminder_due ON appointments (appointment_date, appointment_time, appointment_id)
+    WHERE status = 'Confirmed' AND reminder_sent_at IS NULL;
+
+-- Slot Capacity Ledger (one row per date/time/checkup, places taken)
+CREATE TABLE slot_capacity (
+    slot_date DATE NOT NULL,
+    slot_time TIME NOT NULL,
+    checkup_id INTEGER NOT NULL REFERENCES checkup_types(checkup_id) ON DELETE CASCADE,
+    booked INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (slot_date, slot_time, checkup_id)
+);
+
+-- Slot Holds Table (places held during Stripe checkout)
+CREATE TABLE slot_holds (
+    hold_id SERIAL PRIMARY KEY,
+    hold_token VARCHAR(36) NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE ON UPDATE CASCADE,
+    checkup_id INTEGER NOT NULL REFERENCES checkup_types(checkup_id) ON DELETE CASCADE,
+    slot_date DATE NOT NULL,
+    slot_time TIME NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    appointment_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create an index for expiring slot holds
+CREATE INDEX idx_slot_hold_expiry ON slot_holds (expires_at);
+
+-- Create an index for a user's slot holds
+CREATE INDEX idx_slot_hold_user ON slot_holds (user_id);
+
+-- Email Outbox Table, written with the change each email reports
+CREATE TABLE email_outbox (
+    email_id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    recipient VARCHAR(100) NOT NULL,
+    payload JSON NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'Pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Create an index for pending emails by due time
+CREATE INDEX idx_email_outbox_due ON email_outbox (next_attempt_at) WHERE status = 'Pending';
+
 -- Specialists Table
 CREATE TABLE specialists (
     specialist_id SERIAL PRIMARY KEY,
@@ -0,0 +1,334 @@
+"""
+Transactional email outbox for HealthAssist application
+
+Routes do not send email themselves. They add an outbox row in the same
+transaction as the change the email reports, so the email exists exactly
+when the change commits, and the request returns without waiting on SMTP.
+A separate worker process (flask email-worker) delivers the outbox in
+batches over one pooled SMTP connection (see email_service.py):
+PostgreSQL NOTIFY wakes it as soon as an email is committed, and failed
+deliveries are retried with exponential backoff until EMAIL_MAX_ATTEMPTS,
+after which the email is saved to the emails/ folder like any other
+email that could not be sent. An email whose recipient the server
+refuses with a 5xx reply is marked Failed at once and not saved.
+
+Workers claim emails with a lease rather than holding row locks while
+talking to the SMTP server. An email whose worker died mid-delivery is
+picked up again once its lease runs out, so delivery is at least once.
+"""
+import os
+import random
+import select
+import time as clock
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, select as sql_select
+from models import EmailOutbox
+from email_service import (smtp_pool, build_message, save_email_to_file,
+                           render_appointment_confirmation,
+                           CONFIRMATION_SUBJECT, SendError)
+
+# PostgreSQL NOTIFY channel waking the email worker
+EMAIL_CHANNEL = 'email_outbox'
+
+# Emails claimed by a worker at a time
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 20))
+
+# Seconds a claimed email is reserved for its worker
+EMAIL_LEASE_SECONDS = int(os.environ.get('EMAIL_LEASE_SECONDS', 300))
+
+# Delivery attempts before an email is marked Failed
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 8))
+
+# Delay before the first retry, doubled on each further attempt up to the maximum
+EMAIL_RETRY_BASE_SECONDS = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 30))
+EMAIL_RETRY_MAX_SECONDS = int(os.environ.get('EMAIL_RETRY_MAX_SECONDS', 3600))
+
+# Seconds the worker sleeps between checks when no notification arrives
+EMAIL_POLL_SECONDS = 30
+
+# Kinds of email the outbox can deliver
+APPOINTMENT_CONFIRMATION = 'appointment_confirmation'
+
+
+def _render_appointment_confirmation(payload):
+    return CONFIRMATION_SUBJECT, render_appointment_confirmation(
+        user_name=payload['user_name'],
+        appointment_date=date.fromisoformat(payload['appointment_date']),
+        appointment_time=time.fromisoformat(payload['appointment_time']),
+        checkup_name=payload['checkup_name'])
+
+
+# Rendering function of each kind, taking the payload and returning the
+# subject and HTML content
+EMAIL_RENDERERS = {
+    APPOINTMENT_CONFIRMATION: _render_appointment_confirmation,
+}
+
+
+def enqueue_email(session, kind, recipient, payload):
+    """
+    Add an email to the outbox, to be delivered once the transaction commits
+
+    Args:
+        session: Database session of the change the email reports
+        kind: Kind of email, a key of EMAIL_RENDERERS
+        recipient: Recipient's email address
+        payload: JSON-serializable values the email is rendered from
+
+    Returns:
+        EmailOutbox: The outbox row (not yet committed)
+    """
+    email = EmailOutbox(kind=kind,
+                        recipient=recipient,
+                        payload=payload,
+                        status='Pending',
+                        attempts=0,
+                        next_attempt_at=datetime.now())
+    session.add(email)
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(sql_select(func.pg_notify(EMAIL_CHANNEL, kind)))
+    return email
+
+
+def enqueue_appointment_confirmation(session, user, appointment_date,
+                                     appointment_time, checkup_name):
+    """
+    Add an appointment confirmation email to the outbox
+
+    Args:
+        session: Database session of the booking
+        user: User who booked the appointment
+        appointment_date: Date of appointment (date object)
+        appointment_time: Time of appointment (time object)
+        checkup_name: Type of checkup
+
+    Returns:
+        EmailOutbox: The outbox row (not yet committed)
+    """
+    return enqueue_email(
+        session, APPOINTMENT_CONFIRMATION, user.email, {
+            'user_name': user.user_name,
+            'appointment_date': appointment_date.isoformat(),
+            'appointment_time': appointment_time.isoformat(),
+            'checkup_name': checkup_name
+        })
+
+
+def retry_delay(attempts):
+    """
+    Get the delay before retrying an email
+
+    Args:
+        attempts: Delivery attempts made so far
+
+    Returns:
+        timedelta: Exponential backoff with jitter, so failed emails do not retry in lockstep
+    """
+    delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0),
+                EMAIL_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def claim_due_emails(session, limit=EMAIL_BATCH_SIZE):
+    """
+    Claim pending emails that are due for delivery
+
+    Claimed emails count an attempt and are leased to the caller for
+    EMAIL_LEASE_SECONDS; rows other workers are claiming are skipped.
+
+    Args:
+        session: Database session, committed by this call
+        limit: Maximum number of emails to claim
+
+    Returns:
+        list: (email_id, kind, recipient, payload, attempts) of each claimed email
+    """
+    now = datetime.now()
+    emails = session.query(EmailOutbox).filter(
+        EmailOutbox.status == 'Pending',
+        EmailOutbox.next_attempt_at <= now).order_by(
+            EmailOutbox.next_attempt_at).limit(limit).with_for_update(
+                skip_locked=True).all()
+
+    claimed = []
+    for email in emails:
+        email.attempts += 1
+        email.next_attempt_at = now + timedelta(seconds=EMAIL_LEASE_SECONDS)
+        claimed.append((email.email_id, email.kind, email.recipient,
+                        email.payload, email.attempts))
+    session.commit()
+    return claimed
+
+
+def record_delivery(session, email_id, attempts, error=None, permanent=False):
+    """
+    Record the outcome of one delivery attempt
+
+    Args:
+        session: Database session, committed by this call
+        email_id: ID of the email
+        attempts: Attempts made, including this one
+        error: Why delivery failed, or None if it succeeded
+        permanent: Whether the failure cannot be retried, e.g. the server
+            refused the recipient with a 5xx reply
+
+    Returns:
+        str: The email's new status, or None if it no longer exists
+    """
+    email = session.get(EmailOutbox, email_id)
+    if email is None:
+        return None
+    if error is None:
+        email.status = 'Sent'
+        email.sent_at = datetime.now()
+        email.last_error = None
+    elif permanent or attempts >= EMAIL_MAX_ATTEMPTS:
+        email.status = 'Failed'
+        email.last_error = error
+    else:
+        email.next_attempt_at = datetime.now() + retry_delay(attempts)
+        email.last_error = error
+    session.commit()
+    return email.status
+
+
+def deliver_due_emails(session_factory, limit=EMAIL_BATCH_SIZE):
+    """
+    Claim and deliver one batch of due emails over a single SMTP connection
+
+    Args:
+        session_factory: Callable returning a new database session
+        limit: Maximum number of emails to deliver
+
+    Returns:
+        tuple: (emails delivered, emails that failed this attempt)
+    """
+    session = session_factory()
+    try:
+        claimed = claim_due_emails(session, limit)
+
+        rendered = {}
+        messages = {}
+        errors = {}
+        for email_id, kind, recipient, payload, attempts in claimed:
+            if kind not in EMAIL_RENDERERS:
+                errors[email_id] = f"Unknown email kind {kind}"
+                continue
+            try:
+                rendered[email_id] = EMAIL_RENDERERS[kind](payload)
+            except KeyError as e:
+                errors[email_id] = f"Cannot render {kind} email: missing {e}"
+                continue
+            except ValueError as e:
+                errors[email_id] = f"Cannot render {kind} email: {str(e)}"
+                continue
+            try:
+                messages[email_id] = build_message(recipient, *rendered[email_id])
+            except Exception as e:
+                errors[email_id] = f"Cannot build {kind} email: {str(e)}"
+
+        batch = [email_id for email_id, _, _, _, _ in claimed
+                 if email_id in messages]
+        results = smtp_pool.send_batch([
+            messages[email_id] for email_id in batch
+        ]) if batch else []
+        errors.update(zip(batch, results))
+
+        delivered = failed = 0
+        for email_id, kind, recipient, payload, attempts in claimed:
+            error = errors.get(email_id)
+            permanent = isinstance(error, SendError) and error.permanent
+            status = record_delivery(session, email_id, attempts, error, permanent)
+            if error is None:
+                delivered += 1
+                continue
+
+            failed += 1
+            print(f"Email {email_id} to {recipient} failed "
+                  f"(attempt {attempts}{', permanently' if permanent else ''}): {error}")
+            # Out of retries: keep a copy in the emails/ folder for later
+            # sending, unless the recipient was refused for good
+            if status == 'Failed' and not permanent and email_id in rendered:
+                save_email_to_file(recipient, *rendered[email_id])
+        return delivered, failed
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def next_due_in(session_factory):
+    """
+    Get the seconds until the next pending email is due
+
+    Args:
+        session_factory: Callable returning a new database session
+
+    Returns:
+        float: Seconds to wait (0 if one is already due), at most EMAIL_POLL_SECONDS
+    """
+    session = session_factory()
+    try:
+        due = session.query(func.min(EmailOutbox.next_attempt_at)).filter(
+            EmailOutbox.status == 'Pending').scalar()
+    finally:
+        session.close()
+    if due is None:
+        return EMAIL_POLL_SECONDS
+    return min(max((due - datetime.now()).total_seconds(), 0), EMAIL_POLL_SECONDS)
+
+
+def _listen(engine):
+    """Open a connection listening for new outbox emails, or None without PostgreSQL"""
+    if engine.dialect.name != 'postgresql':
+        return None
+    # Detach the connection so LISTEN does not tie up a pool slot
+    connection = engine.raw_connection()
+    listener = connection.driver_connection
+    connection.detach()
+    listener.autocommit = True
+    with listener.cursor() as cursor:
+        cursor.execute(f"LISTEN {EMAIL_CHANNEL}")
+    return listener
+
+
+def run_email_worker(engine, session_factory):
+    """
+    Deliver outbox emails until the process is stopped
+
+    Args:
+        engine: SQLAlchemy engine, used for the LISTEN connection
+        session_factory: Callable returning a new database session
+    """
+    listener = None
+    backoff = 1
+    while True:
+        try:
+            if listener is None:
+                listener = _listen(engine)
+
+            while True:
+                delivered, failed = deliver_due_emails(session_factory)
+                if delivered or failed:
+                    print(f"Delivered {delivered} email(s), {failed} failed")
+                if delivered + failed < EMAIL_BATCH_SIZE:
+                    break
+
+            wait = next_due_in(session_factory)
+            if listener is None:
+                clock.sleep(wait)
+            elif wait > 0 and select.select([listener], [], [], wait) != ([], [], []):
+                listener.poll()
+                listener.notifies.clear()
+            backoff = 1
+        except Exception as e:
+            print(f"Email worker error: {str(e)}")
+            if listener is not None:
+                try:
+                    listener.close()
+                except Exception:
+                    pass
+                listener = None
+            clock.sleep(backoff)
+            backoff = min(backoff * 2, 60)
@@ -0,0 +1,239 @@
+"""
+Append-only segment storage for saved emails in HealthAssist application
+
+Emails that could not be sent are appended to segment files in the
+emails/ folder instead of being written one file each. A segment is a
+.log file of records, each a zlib-compressed JSON email behind a small
+header (length and CRC32), and a .idx file holding the offset and length
+of every record. Once a segment reaches SPOOL_SEGMENT_BYTES, writers
+move on to a new one, so the folder holds a few large files however many
+emails are saved.
+
+Writers in every process append under one file lock, and a record is
+indexed only after it is fully written, so readers map a segment with
+mmap and use its index without coordinating with writers. A writer that
+died between the two writes is repaired by the next append. To list the
+emails in a folder:
+
+    python email_segments.py [folder]
+"""
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time as clock
+import zlib
+
+SEGMENT_LOG_SUFFIX = '.log'
+SEGMENT_INDEX_SUFFIX = '.idx'
+APPEND_LOCK_FILE = '.append.lock'
+
+# Segment files are named by sequence number, e.g. segment_00000001.log
+SEGMENT_NAME = re.compile(r'^(segment_(\d{8}))\.log$')
+
+# Size in bytes after which writers start a new segment
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024))
+
+# Flush each saved email to disk before reporting it saved
+SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', '1') != '0'
+
+# Record header (payload length, CRC32 of the payload) and index entry
+# (record offset, payload length)
+_RECORD_HEADER = struct.Struct('>II')
+_INDEX_ENTRY = struct.Struct('>QI')
+
+
+def segment_names(spool_dir):
+    """
+    List the segments in a folder
+
+    Args:
+        spool_dir: Folder holding the segments
+
+    Returns:
+        list: Segment names (without suffix), oldest first
+    """
+    try:
+        with os.scandir(spool_dir) as entries:
+            return sorted(match.group(1) for match in
+                          (SEGMENT_NAME.match(entry.name) for entry in entries)
+                          if match)
+    except FileNotFoundError:
+        return []
+
+
+def _next_segment(name):
+    return f"segment_{int(name.rsplit('_', 1)[1]) + 1:08d}" if name else 'segment_00000001'
+
+
+def _encode(record):
+    payload = zlib.compress(json.dumps(record).encode(), 9)
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(buffer, offset, length):
+    """Read the record at an offset, or None if it is torn or corrupt"""
+    start = offset + _RECORD_HEADER.size
+    if start + length > len(buffer):
+        return None
+    stored_length, crc = _RECORD_HEADER.unpack_from(buffer, offset)
+    payload = buffer[start:start + length]
+    if stored_length != length or zlib.crc32(payload) != crc:
+        return None
+    return json.loads(zlib.decompress(payload))
+
+
+def read_index(spool_dir, segment):
+    """
+    Read the index of a segment
+
+    Args:
+        spool_dir: Folder holding the segment
+        segment: Segment name
+
+    Returns:
+        list: (offset, length) of each indexed record, in append order
+    """
+    try:
+        with open(os.path.join(spool_dir, segment + SEGMENT_INDEX_SUFFIX), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % _INDEX_ENTRY.size
+    return list(_INDEX_ENTRY.iter_unpack(data[:usable]))
+
+
+def read_records(spool_dir, segment, offsets=None):
+    """
+    Read emails from a segment through a memory map
+
+    Args:
+        spool_dir: Folder holding the segment
+        segment: Segment name
+        offsets: Offsets of the records to read, or None for all of them
+
+    Yields:
+        tuple: (offset, email dict with 'to', 'subject', 'content', 'saved_at');
+            the email is None if its record is corrupt
+    """
+    entries = read_index(spool_dir, segment)
+    if offsets is not None:
+        wanted = set(offsets)
+        entries = [entry for entry in entries if entry[0] in wanted]
+    if not entries:
+        return
+
+    with open(os.path.join(spool_dir, segment + SEGMENT_LOG_SUFFIX), 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buffer:
+            for offset, length in entries:
+                try:
+                    record = _decode(buffer, offset, length)
+                except (ValueError, zlib.error):
+                    record = None
+                yield offset, record
+
+
+def _repair(log, index):
+    """
+    Make a segment's log and index agree, under the append lock
+
+    Records a writer appended but did not index are indexed, and a torn
+    record at the end of the log is cut off.
+    """
+    index_size = os.fstat(index.fileno()).st_size
+    if index_size % _INDEX_ENTRY.size:
+        index_size -= index_size % _INDEX_ENTRY.size
+        index.truncate(index_size)
+
+    end = 0
+    if index_size:
+        index.seek(index_size - _INDEX_ENTRY.size)
+        offset, length = _INDEX_ENTRY.unpack(index.read(_INDEX_ENTRY.size))
+        end = offset + _RECORD_HEADER.size + length
+
+    log_size = os.fstat(log.fileno()).st_size
+    if log_size < end:
+        # The index is ahead of the log; keep only entries the log holds
+        index.seek(0)
+        entries = [entry for entry in _INDEX_ENTRY.iter_unpack(index.read(index_size))
+                   if entry[0] + _RECORD_HEADER.size + entry[1] <= log_size]
+        index.truncate(len(entries) * _INDEX_ENTRY.size)
+        end = (entries[-1][0] + _RECORD_HEADER.size + entries[-1][1]) if entries else 0
+
+    log.seek(end)
+    tail = log.read()
+    position = 0
+    while position + _RECORD_HEADER.size <= len(tail):
+        length, _ = _RECORD_HEADER.unpack_from(tail, position)
+        try:
+            if _decode(tail, position, length) is None:
+                break
+        except (ValueError, zlib.error):
+            break
+        index.seek(0, os.SEEK_END)
+        index.write(_INDEX_ENTRY.pack(end + position, length))
+        position += _RECORD_HEADER.size + length
+    if end + position < log_size:
+        log.truncate(end + position)
+
+
+def append_email(spool_dir, recipient, subject, content, saved_at=None):
+    """
+    Append an email to the newest segment of a folder
+
+    Args:
+        spool_dir: Folder holding the segments (created if missing)
+        recipient: Recipient's email address
+        subject: Email subject
+        content: HTML content of the email
+        saved_at: When the email was first saved, as a Unix timestamp (defaults to now)
+
+    Returns:
+        tuple: (segment name, record offset)
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    data = _encode({'to': recipient,
+                    'subject': subject,
+                    'content': content,
+                    'saved_at': saved_at if saved_at is not None else clock.time()})
+
+    with open(os.path.join(spool_dir, APPEND_LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        names = segment_names(spool_dir)
+        segment = names[-1] if names else _next_segment(None)
+        log_path = os.path.join(spool_dir, segment + SEGMENT_LOG_SUFFIX)
+        if os.path.exists(log_path) and os.path.getsize(log_path) >= SPOOL_SEGMENT_BYTES:
+            segment = _next_segment(segment)
+            log_path = os.path.join(spool_dir, segment + SEGMENT_LOG_SUFFIX)
+
+        with open(log_path, 'a+b') as log, \
+                open(os.path.join(spool_dir, segment + SEGMENT_INDEX_SUFFIX), 'a+b') as index:
+            _repair(log, index)
+            offset = log.seek(0, os.SEEK_END)
+            log.write(data)
+            log.flush()
+            if SPOOL_FSYNC:
+                os.fsync(log.fileno())
+            index.seek(0, os.SEEK_END)
+            index.write(_INDEX_ENTRY.pack(offset, len(data) - _RECORD_HEADER.size))
+            index.flush()
+            if SPOOL_FSYNC:
+                os.fsync(index.fileno())
+    return segment, offset
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else 'emails'
+    for name in segment_names(folder):
+        for record_offset, email in read_records(folder, name):
+            if email is None:
+                print(f"{name}:{record_offset} (corrupt record)")
+                continue
+            saved = clock.strftime('%Y-%m-%d %H:%M:%S', clock.localtime(email['saved_at']))
+            print(f"{name}:{record_offset} {saved} To: {email['to']} Subject: {email['subject']}")
@@ -1,16 +1,47 @@
 import os
+import queue
 import smtplib
 import ssl
+import threading
+import time as clock
+from contextlib import contextmanager
+from html import escape
+from string import Template
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
 import logging
+from email_segments import append_email
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# SMTP server the Gmail account sends through
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 465))
+SMTP_TIMEOUT = 30
+
+# Connections kept open per process
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))
+
+# Messages sent per minute by a process, within the provider's sending limits
+SMTP_RATE_PER_MINUTE = float(os.environ.get('SMTP_RATE_PER_MINUTE', 60))
+
+# Messages sent over one connection before it is reopened; providers
+# close connections that carry too many
+SMTP_MESSAGES_PER_CONNECTION = int(os.environ.get('SMTP_MESSAGES_PER_CONNECTION', 100))
+
+# Seconds a connection may sit idle before it is reopened rather than reused,
+# since servers drop idle connections
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', 60))
+
+# Folder emails that could not be sent are saved to
+EMAIL_SPOOL_DIR = os.environ.get('EMAIL_SPOOL_DIR', 'emails')
+
+CONFIRMATION_SUBJECT = "HealthAssist: Your Appointment Confirmation"
+REMINDER_SUBJECT = "HealthAssist: Your Appointment Tomorrow"
+
 def format_date(date_obj):
     """Format date for email display"""
     return date_obj.strftime("%A, %B %d, %Y")
@@ -21,7 +52,10 @@ def format_time(time_obj):
 
 def save_email_to_file(user_email, subject, content):
     """
-    Save email content to a file as a fallback when SMTP fails
+    Save email content to the emails/ spool as a fallback when SMTP fails
+    
+    The email is appended to a compressed segment file (see
+    email_segments.py) and sent again later by flask drain-emails.
     
     Args:
         user_email: Recipient's email address
@@ -29,45 +63,13 @@ def save_email_to_file(user_email, subject, content):
         content: HTML content of the email
         
     Returns:
-        bool: True if file was saved successfully, False otherwise
+        bool: True if the email was saved successfully, False otherwise
     """
     try:
-        # Create emails directory if it doesn't exist
-        os.makedirs('emails', exist_ok=True)
-        
-        # Generate filename based on email and timestamp
-        filename = f"emails/email_{user_email.replace('@', '_at_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+        segment, offset = append_email(EMAIL_SPOOL_DIR, user_email, subject, content)
         
-        # Create a simple wrapper for the HTML content
-        wrapper = f"""
-        <html>
-        <head>
-            <title>{subject}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; padding: 20px; }}
-                .email-info {{ background-color: #f0f0f0; padding: 10px; margin-bottom: 20px; }}
-            </style>
-        </head>
-        <body>
-            <div class="email-info">
-                <p><strong>To:</strong> {user_email}</p>
-                <p><strong>Subject:</strong> {subject}</p>
-                <p><strong>Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p><strong>Note:</strong> This email was not sent due to SMTP issues. It is saved here for later sending.</p>
-            </div>
-            <div class="email-content">
-                {content}
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Write to file
-        with open(filename, 'w') as f:
-            f.write(wrapper)
-            
-        logger.info(f"Email saved to file: {filename}")
-        print(f"Email to {user_email} saved to file: {filename}")
+        logger.info(f"Email saved to spool: {segment}:{offset}")
+        print(f"Email to {user_email} saved to spool: {EMAIL_SPOOL_DIR}/{segment}:{offset}")
         return True
         
     except Exception as e:
@@ -75,6 +77,401 @@ def save_email_to_file(user_email, subject, content):
         print(f"Error saving email to file: {str(e)}")
         return False
 
+class SMTPNotConfigured(RuntimeError):
+    """Raised when the Gmail credentials are not set"""
+
+
+class SendError(str):
+    """
+    Why a message was not sent, as returned by SMTPPool.send_batch
+
+    permanent is True when the server refused every recipient with a 5xx
+    reply, so sending the message again cannot succeed.
+    """
+    permanent = False
+
+    @classmethod
+    def from_exception(cls, exception):
+        error = cls(str(exception) or type(exception).__name__)
+        if isinstance(exception, smtplib.SMTPRecipientsRefused):
+            error.permanent = all(code >= 500 for code, _ in
+                                  exception.recipients.values())
+        return error
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every SMTP connection in the process
+
+    Providers throttle or suspend accounts that send too fast, so sends
+    wait for a token instead of failing.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = clock.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a message may be sent"""
+        while True:
+            with self._lock:
+                now = clock.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            clock.sleep(wait)
+
+
+class SMTPTransport:
+    """
+    One authenticated SMTP connection, reused across messages
+
+    The connection is opened on first use and reopened after it has been
+    idle for SMTP_IDLE_SECONDS, after SMTP_MESSAGES_PER_CONNECTION
+    messages, or when the server drops it mid-send.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._server = None
+        self._sent = 0
+        self._last_used = 0.0
+
+    def _connect(self):
+        gmail_email = os.environ.get('GMAIL_EMAIL')
+        gmail_app_password = os.environ.get('GMAIL_APP_PASSWORD')
+        if not gmail_email or not gmail_app_password:
+            raise SMTPNotConfigured("Gmail credentials are not set in environment variables")
+
+        logger.info(f"Connecting to SMTP server {SMTP_HOST}...")
+        context = ssl.create_default_context()
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context,
+                                  timeout=SMTP_TIMEOUT)
+        try:
+            server.login(gmail_email, gmail_app_password)
+        except Exception:
+            server.close()
+            raise
+        logger.info(f"Connected to SMTP server as {gmail_email}")
+        self._server = server
+        self._sent = 0
+
+    def close(self):
+        """Close the connection, if open"""
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+    def send(self, message):
+        """
+        Send one message, reconnecting once if the connection was lost
+
+        Args:
+            message: email.message.Message to send
+
+        Raises:
+            SMTPNotConfigured: If the Gmail credentials are not set
+            smtplib.SMTPException, OSError: If the message could not be sent
+        """
+        self.limiter.acquire()
+        if (self._server is not None
+                and (self._sent >= SMTP_MESSAGES_PER_CONNECTION
+                     or clock.monotonic() - self._last_used > SMTP_IDLE_SECONDS)):
+            self.close()
+        if self._server is None:
+            self._connect()
+
+        try:
+            self._server.send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._connect()
+            self._server.send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                smtplib.SMTPDataError):
+            # The server refused this message; the connection is still usable
+            raise
+        except Exception:
+            self.close()
+            raise
+        self._sent += 1
+        self._last_used = clock.monotonic()
+
+
+class SMTPPool:
+    """Up to SMTP_POOL_SIZE SMTP connections shared by the threads of a process"""
+
+    def __init__(self, size, limiter):
+        self.limiter = limiter
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def transport(self):
+        """Borrow a connection, waiting for one if all are in use"""
+        self._slots.acquire()
+        try:
+            try:
+                transport = self._idle.get_nowait()
+            except queue.Empty:
+                transport = SMTPTransport(self.limiter)
+            try:
+                yield transport
+            finally:
+                self._idle.put(transport)
+        finally:
+            self._slots.release()
+
+    def send(self, message):
+        """
+        Send one message over a pooled connection
+
+        Raises:
+            SMTPNotConfigured: If the Gmail credentials are not set
+            smtplib.SMTPException, OSError: If the message could not be sent
+        """
+        with self.transport() as transport:
+            transport.send(message)
+
+    def send_batch(self, messages):
+        """
+        Send messages one after another over a single connection
+
+        A failure of one message, of any kind, does not stop the others,
+        except for missing credentials or a rejected login, which fail
+        every message.
+
+        Args:
+            messages: email.message.Message objects to send
+
+        Returns:
+            list: None for each message sent, or the SendError that stopped it
+        """
+        results = []
+        with self.transport() as transport:
+            for index, message in enumerate(messages):
+                try:
+                    transport.send(message)
+                    results.append(None)
+                except (SMTPNotConfigured, smtplib.SMTPAuthenticationError) as e:
+                    results.extend([SendError.from_exception(e)] * (len(messages) - index))
+                    break
+                except Exception as e:
+                    # Whatever stopped this message, e.g. an address that
+                    # cannot be encoded, must not lose the others' results
+                    results.append(SendError.from_exception(e))
+        return results
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+smtp_pool = SMTPPool(SMTP_POOL_SIZE, RateLimiter(SMTP_RATE_PER_MINUTE))
+
+
+def build_message(user_email, subject, html_content):
+    """
+    Build an HTML email from the HealthAssist Gmail account
+
+    Args:
+        user_email: Recipient's email address
+        subject: Email subject
+        html_content: HTML body
+
+    Returns:
+        MIMEMultipart: The message
+    """
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = os.environ.get('GMAIL_EMAIL')
+    message["To"] = user_email
+    message.attach(MIMEText(html_content, "html"))
+    return message
+
+
+def render_appointment_confirmation(user_name, appointment_date, appointment_time, checkup_name):
+    """
+    Render the appointment confirmation email
+
+    Args:
+        user_name: User's name
+        appointment_date: Date of appointment (date object)
+        appointment_time: Time of appointment (time object)
+        checkup_name: Type of checkup
+
+    Returns:
+        str: HTML content of the email
+    """
+    # Format date and time for display
+    formatted_date = format_date(appointment_date)
+    formatted_time = format_time(appointment_time)
+
+    # Create email content
+    html_content = f"""
+    <html>
+    <head>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                color: #333;
+            }}
+            .container {{
+                max-width: 600px;
+                margin: 0 auto;
+                padding: 20px;
+                border: 1px solid #ddd;
+                border-radius: 5px;
+            }}
+            .header {{
+                background-color: #b71c1c;
+                color: white;
+                padding: 10px 20px;
+                text-align: center;
+                border-radius: 5px 5px 0 0;
+            }}
+            .content {{
+                padding: 20px;
+            }}
+            .appointment-details {{
+                background-color: #f9f9f9;
+                padding: 15px;
+                border-left: 4px solid #b71c1c;
+                margin: 20px 0;
+            }}
+            .footer {{
+                text-align: center;
+                padding-top: 20px;
+                font-size: 0.8em;
+                color: #666;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>Appointment Confirmation</h1>
+            </div>
+            <div class="content">
+                <p>Dear {user_name},</p>
+                <p>Your appointment has been successfully scheduled at HealthAssist. Here are the details:</p>
+                
+                <div class="appointment-details">
+                    <p><strong>Appointment Type:</strong> {checkup_name}</p>
+                    <p><strong>Date:</strong> {formatted_date}</p>
+                    <p><strong>Time:</strong> {formatted_time}</p>
+                </div>
+                
+                <p>Please arrive 15 minutes before your scheduled time. If you need to reschedule or cancel your appointment, please contact us at least 24 hours in advance.</p>
+                
+                <p>Thank you for choosing HealthAssist for your healthcare needs.</p>
+                
+                <p>Best regards,<br>
+                HealthAssist Team</p>
+            </div>
+            <div class="footer">
+                <p>This is an automated email, please do not reply to this message.</p>
+                <p>&copy; 2025 HealthAssist. All rights reserved.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    
+    return html_content
+
+
+# Day-before reminder, compiled once; compile_reminder_template fills in
+# the day and render_appointment_reminder the per-appointment fields
+REMINDER_TEMPLATE = Template("""
+    <html>
+    <head>
+        <style>
+            body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+            .container { max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px; }
+            .header { background-color: #b71c1c; color: white; padding: 10px 20px; text-align: center; border-radius: 5px 5px 0 0; }
+            .content { padding: 20px; }
+            .appointment-details { background-color: #f9f9f9; padding: 15px; border-left: 4px solid #b71c1c; margin: 20px 0; }
+            .footer { text-align: center; padding-top: 20px; font-size: 0.8em; color: #666; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>Appointment Reminder</h1>
+            </div>
+            <div class="content">
+                <p>Dear $user_name,</p>
+                <p>This is a reminder of your appointment at HealthAssist tomorrow:</p>
+                
+                <div class="appointment-details">
+                    <p><strong>Appointment Type:</strong> $checkup_name</p>
+                    <p><strong>Date:</strong> $appointment_date</p>
+                    <p><strong>Time:</strong> $appointment_time</p>
+                </div>
+                
+                <p>Please arrive 15 minutes before your scheduled time. If you can no longer attend, please contact us as soon as possible.</p>
+                
+                <p>Best regards,<br>
+                HealthAssist Team</p>
+            </div>
+            <div class="footer">
+                <p>This is an automated email, please do not reply to this message.</p>
+                <p>&copy; 2025 HealthAssist. All rights reserved.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+
+def compile_reminder_template(appointment_date):
+    """
+    Fill the reminder template with the day every reminder of a run shares
+
+    Args:
+        appointment_date: Date of the appointments (date object)
+
+    Returns:
+        Template: Template left with the per-appointment fields
+    """
+    return Template(REMINDER_TEMPLATE.safe_substitute(
+        appointment_date=format_date(appointment_date)))
+
+
+def render_appointment_reminder(template, user_name, appointment_time, checkup_name):
+    """
+    Render a day-before reminder email
+
+    Args:
+        template: Template from compile_reminder_template
+        user_name: User's name
+        appointment_time: Time of appointment (time object)
+        checkup_name: Type of checkup
+
+    Returns:
+        str: HTML content of the email
+    """
+    return template.substitute(user_name=escape(user_name),
+                               checkup_name=escape(checkup_name),
+                               appointment_time=format_time(appointment_time))
+
+
 def send_appointment_confirmation(user_email, user_name, appointment_date, appointment_time, checkup_name):
     """
     Send appointment confirmation email to user using Gmail
@@ -102,114 +499,16 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
             print("Gmail credentials are not set in environment variables")
             return False
         
-        # Format date and time for display
-        formatted_date = format_date(appointment_date)
-        formatted_time = format_time(appointment_time)
-        
-        # Create email content
-        html_content = f"""
-        <html>
-        <head>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                }}
-                .container {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                    border: 1px solid #ddd;
-                    border-radius: 5px;
-                }}
-                .header {{
-                    background-color: #b71c1c;
-                    color: white;
-                    padding: 10px 20px;
-                    text-align: center;
-                    border-radius: 5px 5px 0 0;
-                }}
-                .content {{
-                    padding: 20px;
-                }}
-                .appointment-details {{
-                    background-color: #f9f9f9;
-                    padding: 15px;
-                    border-left: 4px solid #b71c1c;
-                    margin: 20px 0;
-                }}
-                .footer {{
-                    text-align: center;
-                    padding-top: 20px;
-                    font-size: 0.8em;
-                    color: #666;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Appointment Confirmation</h1>
-                </div>
-                <div class="content">
-                    <p>Dear {user_name},</p>
-                    <p>Your appointment has been successfully scheduled at HealthAssist. Here are the details:</p>
-                    
-                    <div class="appointment-details">
-                        <p><strong>Appointment Type:</strong> {checkup_name}</p>
-                        <p><strong>Date:</strong> {formatted_date}</p>
-                        <p><strong>Time:</strong> {formatted_time}</p>
-                    </div>
-                    
-                    <p>Please arrive 15 minutes before your scheduled time. If you need to reschedule or cancel your appointment, please contact us at least 24 hours in advance.</p>
-                    
-                    <p>Thank you for choosing HealthAssist for your healthcare needs.</p>
-                    
-                    <p>Best regards,<br>
-                    HealthAssist Team</p>
-                </div>
-                <div class="footer">
-                    <p>This is an automated email, please do not reply to this message.</p>
-                    <p>&copy; 2025 HealthAssist. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Create email message
-        message = MIMEMultipart("alternative")
-        message["Subject"] = "HealthAssist: Your Appointment Confirmation"
-        message["From"] = gmail_email
-        message["To"] = user_email
+        subject = CONFIRMATION_SUBJECT
+        html_content = render_appointment_confirmation(user_name, appointment_date,
+                                                       appointment_time, checkup_name)
+        message = build_message(user_email, subject, html_content)
         
-        # Create HTML part
-        html_part = MIMEText(html_content, "html")
-        message.attach(html_part)
-        
-        # Create SMTP session with enhanced error handling
+        # Send over a pooled connection with enhanced error handling
         try:
-            logger.info(f"Connecting to Gmail SMTP server...")
-            print(f"Connecting to Gmail SMTP server...")
-            
-            # Create a secure SSL context
-            context = ssl.create_default_context()
-            
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-                logger.info(f"Connected to SMTP server, attempting login with {gmail_email}")
-                print(f"Connected to SMTP server, attempting login with {gmail_email}")
-                
-                # Attempt login
-                server.login(gmail_email, gmail_app_password)
-                logger.info(f"Login successful, sending message...")
-                print(f"Login successful, sending message...")
-                
-                # Send the email
-                server.send_message(message)
-                logger.info(f"Email sent to {user_email} via Gmail successfully")
-                print(f"Email sent to {user_email} via Gmail successfully")
-            
+            smtp_pool.send(message)
+            logger.info(f"Email sent to {user_email} via Gmail successfully")
+            print(f"Email sent to {user_email} via Gmail successfully")
             return True
             
         except smtplib.SMTPAuthenticationError as auth_error:
@@ -218,7 +517,6 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
             print(f"This typically means the username or password is incorrect.")
             print(f"Make sure your Gmail App Password is correct and 2FA is enabled on your account.")
             print(f"Falling back to saving email as file...")
-            subject = "HealthAssist: Your Appointment Confirmation"
             return save_email_to_file(user_email, subject, html_content)
             
         except smtplib.SMTPRecipientsRefused as recipient_error:
@@ -226,7 +524,6 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
             print(f"SMTP Recipients Refused Error: {recipient_error}")
             print(f"This typically means the recipient email address is invalid.")
             print(f"Falling back to saving email as file...")
-            subject = "HealthAssist: Your Appointment Confirmation"
             return save_email_to_file(user_email, subject, html_content)
             
         except ssl.SSLError as ssl_error:
@@ -234,14 +531,12 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
             print(f"SSL Error: {ssl_error}")
             print(f"This typically means there's an issue with the SSL/TLS connection.")
             print(f"Falling back to saving email as file...")
-            subject = "HealthAssist: Your Appointment Confirmation"
             return save_email_to_file(user_email, subject, html_content)
             
         except smtplib.SMTPException as smtp_error:
             logger.error(f"SMTP Error: {smtp_error}")
             print(f"SMTP Error: {smtp_error}")
             print(f"Falling back to saving email as file...")
-            subject = "HealthAssist: Your Appointment Confirmation"
             return save_email_to_file(user_email, subject, html_content)
             
         except TimeoutError as timeout_error:
@@ -249,7 +544,6 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
             print(f"Timeout Error: {timeout_error}")
             print(f"Connection to the SMTP server timed out.")
             print(f"Falling back to saving email as file...")
-            subject = "HealthAssist: Your Appointment Confirmation"
             return save_email_to_file(user_email, subject, html_content)
         
     except Exception as e:
@@ -257,7 +551,7 @@ def send_appointment_confirmation(user_email, user_name, appointment_date, appoi
         try:
             # Try to save as a file as a last resort
             print("Attempting to save email as file after exception...")
-            subject = "HealthAssist: Your Appointment Confirmation"
+            subject = CONFIRMATION_SUBJECT
             formatted_date = format_date(appointment_date)
             formatted_time = format_time(appointment_time)
             
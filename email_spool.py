@@ -0,0 +1,283 @@
+"""
+Replay of emails saved to the emails/ folder for HealthAssist application
+
+When an email cannot be sent, save_email_to_file (email_service.py)
+appends it to a segment in the emails/ folder (see email_segments.py).
+drain_spool sends those emails again: batches of emails go out over
+pooled SMTP connections, a few batches at a time. An email that fails is
+retried with exponential backoff, and is copied to the emails/failed/
+segments after SPOOL_MAX_ATTEMPTS, or at once if the server refused it
+permanently. Once every email of a segment has
+been sent or given up, and writers have moved on to a newer one, the
+segment moves to emails/done/.
+
+Drain progress lives in a state file next to the segments, so a scan
+reads only the segment indexes and the emails that are due, however
+many are waiting for a retry. Only one drain runs at a time per folder.
+Files saved one per email by earlier versions are appended to the
+segments on the first drain.
+"""
+import fcntl
+import json
+import os
+import random
+import re
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from email_service import smtp_pool, build_message, SendError, EMAIL_SPOOL_DIR
+from email_segments import (append_email, read_index, read_records,
+                            segment_names, SEGMENT_INDEX_SUFFIX,
+                            SEGMENT_LOG_SUFFIX)
+
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+STATE_FILE = '.drain.json'
+LOCK_FILE = '.drain.lock'
+
+# Files written one per email by earlier versions of save_email_to_file
+LEGACY_FILE_PATTERN = re.compile(r'^email_.+\.html$')
+
+# Batches sent at the same time, and emails per batch (one SMTP connection each)
+SPOOL_DRAIN_WORKERS = int(os.environ.get('SPOOL_DRAIN_WORKERS', 2))
+SPOOL_BATCH_SIZE = int(os.environ.get('SPOOL_BATCH_SIZE', 20))
+
+# Send attempts before an email is moved to the failed segments
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('SPOOL_MAX_ATTEMPTS', 10))
+
+# Delay before the first retry, doubled on each further attempt up to the maximum
+SPOOL_RETRY_BASE_SECONDS = int(os.environ.get('SPOOL_RETRY_BASE_SECONDS', 60))
+SPOOL_RETRY_MAX_SECONDS = int(os.environ.get('SPOOL_RETRY_MAX_SECONDS', 6 * 3600))
+
+# Seconds between scans when draining continuously
+SPOOL_POLL_SECONDS = int(os.environ.get('SPOOL_POLL_SECONDS', 60))
+
+# Parts of the wrapper earlier versions of save_email_to_file put around the email
+_TO = re.compile(r'<p><strong>To:</strong> (.*?)</p>')
+_SUBJECT = re.compile(r'<p><strong>Subject:</strong> (.*?)</p>')
+_CONTENT_START = '<div class="email-content">'
+
+
+def parse_spool_file(text):
+    """
+    Recover the recipient, subject and content of an email saved as a file
+
+    Args:
+        text: Contents of a file written by an earlier save_email_to_file
+
+    Returns:
+        tuple: (recipient, subject, HTML content)
+
+    Raises:
+        ValueError: If the file is not in the saved email format
+    """
+    to = _TO.search(text)
+    subject = _SUBJECT.search(text)
+    start = text.find(_CONTENT_START)
+    end = text.rfind('</div>')
+    if not to or not subject or start < 0 or end < start:
+        raise ValueError("Not a saved email")
+    return (to.group(1).strip(), subject.group(1).strip(),
+            text[start + len(_CONTENT_START):end].strip())
+
+
+def retry_delay(attempts):
+    """
+    Get the seconds to wait before retrying an email
+
+    Args:
+        attempts: Send attempts made so far
+
+    Returns:
+        float: Exponential backoff with jitter
+    """
+    delay = min(SPOOL_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0),
+                SPOOL_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _load_state(spool_dir):
+    try:
+        with open(os.path.join(spool_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(spool_dir, state):
+    path = os.path.join(spool_dir, STATE_FILE)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp, path)
+
+
+def _move(spool_dir, name, area):
+    os.makedirs(os.path.join(spool_dir, area), exist_ok=True)
+    os.replace(os.path.join(spool_dir, name), os.path.join(spool_dir, area, name))
+
+
+def import_legacy_files(spool_dir):
+    """
+    Append emails saved one per file to the segments, removing the files
+
+    Files that cannot be read as a saved email move to the failed folder.
+
+    Args:
+        spool_dir: Folder holding the files
+
+    Returns:
+        int: Number of emails imported
+    """
+    with os.scandir(spool_dir) as entries:
+        names = sorted(entry.name for entry in entries
+                       if entry.is_file() and LEGACY_FILE_PATTERN.match(entry.name))
+
+    imported = 0
+    for name in names:
+        path = os.path.join(spool_dir, name)
+        try:
+            with open(path) as f:
+                recipient, subject, content = parse_spool_file(f.read())
+        except (OSError, ValueError) as e:
+            print(f"Cannot import saved email {name}: {str(e)}")
+            _move(spool_dir, name, FAILED_DIR)
+            continue
+        append_email(spool_dir, recipient, subject, content,
+                     saved_at=os.path.getmtime(path))
+        os.remove(path)
+        imported += 1
+    return imported
+
+
+def _send_batch(spool_dir, batch):
+    """
+    Send a batch of saved emails over one SMTP connection
+
+    Args:
+        spool_dir: Folder holding the segments
+        batch: (segment, offset) of each email
+
+    Returns:
+        list: (email, error) for each email; error is None if it was sent,
+            and email is None if its record could not be read
+    """
+    emails = {}
+    for segment in {segment for segment, _ in batch}:
+        offsets = [offset for name, offset in batch if name == segment]
+        for offset, email in read_records(spool_dir, segment, offsets):
+            emails[(segment, offset)] = email
+
+    messages = {}
+    errors = {}
+    for key in batch:
+        email = emails.get(key)
+        if email is None:
+            errors[key] = "Unreadable record"
+            continue
+        try:
+            messages[key] = build_message(email['to'], email['subject'], email['content'])
+        except Exception as e:
+            errors[key] = f"Cannot build email: {str(e)}"
+
+    ready = list(messages)
+    results = smtp_pool.send_batch([messages[key] for key in ready]) if ready else []
+    errors.update(zip(ready, results))
+    return [(emails.get(key), errors.get(key)) for key in batch]
+
+
+def _retire_segments(spool_dir, state, names):
+    """Move fully drained segments, except the newest one, to the done folder"""
+    for segment in names[:-1]:
+        entries = read_index(spool_dir, segment)
+        if len(state.get(segment, {}).get('done', ())) < len(entries):
+            continue
+        for suffix in (SEGMENT_LOG_SUFFIX, SEGMENT_INDEX_SUFFIX):
+            if os.path.exists(os.path.join(spool_dir, segment + suffix)):
+                _move(spool_dir, segment + suffix, DONE_DIR)
+        state.pop(segment, None)
+
+
+def drain_spool(spool_dir=EMAIL_SPOOL_DIR, workers=SPOOL_DRAIN_WORKERS, now=None):
+    """
+    Send the saved emails that are due
+
+    Args:
+        spool_dir: Folder save_email_to_file writes to
+        workers: Batches sent at the same time
+        now: Current time as a Unix timestamp (defaults to now)
+
+    Returns:
+        dict: Counts of emails 'sent', 'failed' (to be retried), 'given_up',
+            'waiting' (not yet due), or None if another drain holds the folder
+    """
+    counts = {'sent': 0, 'failed': 0, 'given_up': 0, 'waiting': 0}
+    if not os.path.isdir(spool_dir):
+        return counts
+
+    with open(os.path.join(spool_dir, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        now = now if now is not None else clock.time()
+        imported = import_legacy_files(spool_dir)
+        if imported:
+            print(f"Imported {imported} email(s) saved as files")
+
+        names = segment_names(spool_dir)
+        # Forget segments that were removed by hand
+        saved_state = _load_state(spool_dir)
+        state = {name: saved_state.get(name, {}) for name in names}
+
+        due = []
+        for segment in names:
+            progress = state[segment]
+            done = set(progress.get('done', ()))
+            retries = progress.get('retries', {})
+            for offset, _ in read_index(spool_dir, segment):
+                if offset in done:
+                    continue
+                if retries.get(str(offset), {}).get('next_attempt', 0) <= now:
+                    due.append((segment, offset))
+                else:
+                    counts['waiting'] += 1
+
+        batches = [due[i:i + SPOOL_BATCH_SIZE]
+                   for i in range(0, len(due), SPOOL_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            outcomes = executor.map(lambda batch: _send_batch(spool_dir, batch), batches)
+            for batch, results in zip(batches, outcomes):
+                for (segment, offset), (email, error) in zip(batch, results):
+                    progress = state[segment]
+                    retries = progress.setdefault('retries', {})
+                    if error is None:
+                        progress.setdefault('done', []).append(offset)
+                        retries.pop(str(offset), None)
+                        counts['sent'] += 1
+                        continue
+
+                    attempts = retries.get(str(offset), {}).get('attempts', 0) + 1
+                    permanent = isinstance(error, SendError) and error.permanent
+                    if email is None or permanent or attempts >= SPOOL_MAX_ATTEMPTS:
+                        if email is not None:
+                            append_email(os.path.join(spool_dir, FAILED_DIR),
+                                         email['to'], email['subject'],
+                                         email['content'], email['saved_at'])
+                        progress.setdefault('done', []).append(offset)
+                        retries.pop(str(offset), None)
+                        counts['given_up'] += 1
+                        print(f"Giving up on saved email {segment}:{offset}: {error}")
+                        continue
+
+                    retries[str(offset)] = {'attempts': attempts,
+                                            'next_attempt': now + retry_delay(attempts),
+                                            'last_error': error}
+                    counts['failed'] += 1
+                # Record progress after each batch, so a crashed drain re-sends only
+                # the batches in flight
+                _save_state(spool_dir, state)
+
+        _retire_segments(spool_dir, state, names)
+        _save_state(spool_dir, state)
+        return counts
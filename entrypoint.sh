@@ -7,6 +7,14 @@ while ! nc -z db 5432; do
 done
 echo "PostgreSQL started"
 
+# Apply schema migrations once per deploy, from the web service only
+if [ "${RUN_MIGRATIONS:-1}" = "1" ]; then
+  echo "Applying database migrations..."
+  flask migrate || exit 1
+  # Partitions for the booking window; also run daily from cron
+  flask maintain-partitions || exit 1
+fi
+
 # Initialize the database if needed
 echo "Initializing database if needed..."
 python -c "
@@ -15,6 +23,12 @@ with app.app_context():
     initialize_default_data()
 "
 
+# Make sure upcoming bookings are in the slot capacity ledger, once per deploy
+if [ "${RUN_MIGRATIONS:-1}" = "1" ]; then
+  echo "Backfilling the slot capacity ledger..."
+  flask backfill-ledger || exit 1
+fi
+
 # Start the application
 echo "Starting application..."
 exec "$@"
\ No newline at end of file
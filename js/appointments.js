@@ -10,31 +10,75 @@ document.addEventListener("DOMContentLoaded", function () {
         
         // Set up event listeners
         document.getElementById("search-appointments-input").addEventListener("input", filterAppointments);
-        document.getElementById("date-filter").addEventListener("change", filterAppointments);
+        document.getElementById("date-filter").addEventListener("change", () => loadAppointments());
+        document.getElementById("load-more-appointments").addEventListener("click", () => loadAppointments(window.appointmentsCursor));
         document.getElementById("add-appointment-btn").addEventListener("click", openAddAppointmentModal);
         document.getElementById("appointment-form").addEventListener("submit", handleAppointmentFormSubmit);
         document.getElementById("confirm-delete-appointment").addEventListener("click", confirmDeleteAppointment);
     }
     
     /**
-     * Load appointments data
+     * Build the server-side filters for the selected date range
+     * @returns {URLSearchParams} Query parameters for /api/appointments
      */
-    function loadAppointments() {
+    function appointmentQueryParams() {
+        const params = new URLSearchParams();
+        const dateFilter = document.getElementById("date-filter").value;
+        const today = new Date();
+        const isoDate = date => date.toISOString().split("T")[0];
+        
+        if (dateFilter === "today") {
+            params.set("start_date", isoDate(today));
+            params.set("end_date", isoDate(today));
+        } else if (dateFilter === "upcoming") {
+            const tomorrow = new Date(today);
+            tomorrow.setDate(today.getDate() + 1);
+            params.set("start_date", isoDate(tomorrow));
+        } else if (dateFilter === "past") {
+            const yesterday = new Date(today);
+            yesterday.setDate(today.getDate() - 1);
+            params.set("end_date", isoDate(yesterday));
+        }
+        
+        return params;
+    }
+    
+    /**
+     * Load a page of appointments data
+     * @param {string} [cursor] - Cursor of the next page; omit to start over
+     */
+    function loadAppointments(cursor) {
         const loadingIndicator = document.getElementById("appointments-loading");
         const errorMessage = document.getElementById("appointments-error");
+        const loadMoreButton = document.getElementById("load-more-appointments");
         
         if (loadingIndicator) loadingIndicator.style.display = "block";
         if (errorMessage) errorMessage.style.display = "none";
+        if (loadMoreButton) loadMoreButton.disabled = true;
+        
+        const params = appointmentQueryParams();
         
-        fetch("/api/appointments")
+        // Export the same date range that is being listed
+        const exportButton = document.getElementById("export-appointments-btn");
+        if (exportButton) exportButton.href = `/api/appointments/export?format=csv&${params}`;
+        
+        if (cursor) params.set("cursor", cursor);
+        
+        fetch(`/api/appointments?${params}`)
             .then(response => {
                 if (!response.ok) {
                     throw new Error("Failed to load appointments");
                 }
+                window.appointmentsCursor = response.headers.get("X-Next-Cursor");
                 return response.json();
             })
             .then(data => {
-                window.appointmentsData = data;
+                window.appointmentsData = cursor ? window.appointmentsData.concat(data) : data;
+                
+                if (loadMoreButton) {
+                    loadMoreButton.style.display = window.appointmentsCursor ? "inline-block" : "none";
+                    loadMoreButton.disabled = false;
+                }
                 
                 // Combine with patient data if available
                 if (window.patientsData) {
@@ -48,7 +92,7 @@ document.addEventListener("DOMContentLoaded", function () {
                     });
                 }
                 
-                renderAppointmentsTable();
+                filterAppointments();
                 
                 if (loadingIndicator) loadingIndicator.style.display = "none";
             })
@@ -141,30 +185,15 @@ document.addEventListener("DOMContentLoaded", function () {
     }
     
     /**
-     * Filter appointments based on search and dropdown filters
+     * Filter the loaded appointments based on the search box
      */
     function filterAppointments() {
         const searchTerm = document.getElementById("search-appointments-input").value.toLowerCase().trim();
-        const dateFilter = document.getElementById("date-filter").value;
         
         if (!window.appointmentsData) return;
         
-        // Apply filters
+        // Apply filters; the date filter is applied by the server
         const filteredAppointments = window.appointmentsData.filter(appointment => {
-            // Date filter
-            if (dateFilter) {
-                if (dateFilter === "today") {
-                    const today = new Date().toISOString().split("T")[0];
-                    if (appointment.appointment_date !== today) return false;
-                } else if (dateFilter === "upcoming") {
-                    const today = new Date().toISOString().split("T")[0];
-                    if (appointment.appointment_date <= today) return false;
-                } else if (dateFilter === "past") {
-                    const today = new Date().toISOString().split("T")[0];
-                    if (appointment.appointment_date >= today) return false;
-                }
-            }
-            
             // Search filter (check in patient name, appointment type, etc.)
             if (searchTerm) {
                 const matchesSearch = 
@@ -80,53 +80,23 @@ document.addEventListener("DOMContentLoaded", function() {
             </div>
         `;
 
-        // Fetch users count
-        fetch('/api/users')
+        // Counts and recent appointments are computed by the server
+        fetch('/api/admin/dashboard-stats')
             .then(response => {
                 if (!response.ok) {
-                    throw new Error('Failed to fetch users data');
+                    throw new Error('Failed to fetch dashboard statistics');
                 }
                 return response.json();
             })
-            .then(data => {
-                const users = data;
-                const totalUsers = users.length;
-                const doctors = users.filter(user => user.user_type === 'Doctor').length;
-                const patients = users.filter(user => user.user_type === 'Normal').length;
-
-                document.getElementById('total-users-value').textContent = totalUsers;
-                document.getElementById('doctors-count-value').textContent = doctors;
-                document.getElementById('patients-count-value').textContent = patients;
-
-                // After we have users data, fetch appointments
-                return fetch('/api/appointments');
-            })
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch appointments data');
-                }
-                return response.json();
-            })
-            .then(appointments => {
-                const totalAppointments = appointments.length;
-                
-                // Calculate today's appointments
-                const today = new Date().toISOString().slice(0, 10); // Format: YYYY-MM-DD
-                const todayAppointments = appointments.filter(appt => 
-                    appt.appointment_date === today
-                ).length;
-                
-                // Calculate upcoming appointments (future dates)
-                const upcomingAppointments = appointments.filter(appt => 
-                    appt.appointment_date > today
-                ).length;
-
-                document.getElementById('total-appointments-value').textContent = totalAppointments;
-                document.getElementById('today-appointments-value').textContent = todayAppointments;
-                document.getElementById('upcoming-appointments-value').textContent = upcomingAppointments;
-
-                // Now load recent activity with both user and appointment data
-                loadRecentActivity(appointments);
+            .then(stats => {
+                document.getElementById('total-users-value').textContent = stats.total_users;
+                document.getElementById('doctors-count-value').textContent = stats.doctors;
+                document.getElementById('patients-count-value').textContent = stats.patients;
+                document.getElementById('total-appointments-value').textContent = stats.total_appointments;
+                document.getElementById('today-appointments-value').textContent = stats.today_appointments;
+                document.getElementById('upcoming-appointments-value').textContent = stats.upcoming_appointments;
+
+                displayRecentActivity(stats.recent_appointments);
             })
             .catch(error => {
                 console.error('Error loading dashboard data:', error);
@@ -141,46 +111,11 @@ document.addEventListener("DOMContentLoaded", function() {
             });
     }
 
-    /**
-     * Load recent activity for the dashboard
-     */
-    function loadRecentActivity(appointments) {
-        // Fetch users to get user details for appointments
-        fetch('/api/users')
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch users data');
-                }
-                return response.json();
-            })
-            .then(users => {
-                displayRecentActivity(appointments, users);
-            })
-            .catch(error => {
-                console.error('Error loading recent activity:', error);
-                document.getElementById('recent-activity-list').innerHTML = `
-                    <div class="error-message">
-                        <i class="fas fa-exclamation-circle"></i> Failed to load recent activity.
-                    </div>
-                `;
-            });
-    }
-
     /**
      * Display recent activity items
-     * @param {Array} appointments - Recent appointments
-     * @param {Array} users - User data
+     * @param {Array} recentAppointments - Most recent appointments, newest first
      */
-    function displayRecentActivity(appointments, users) {
-        // Sort appointments by date and time, most recent first
-        const sortedAppointments = [...appointments].sort((a, b) => {
-            const dateA = new Date(`${a.appointment_date}T${a.appointment_time}`);
-            const dateB = new Date(`${b.appointment_date}T${b.appointment_time}`);
-            return dateB - dateA;
-        });
-
-        // Take the 5 most recent appointments
-        const recentAppointments = sortedAppointments.slice(0, 5);
+    function displayRecentActivity(recentAppointments) {
 
         if (recentAppointments.length === 0) {
             document.getElementById('recent-activity-list').innerHTML = `
@@ -194,9 +129,7 @@ document.addEventListener("DOMContentLoaded", function() {
         let html = '';
         
         recentAppointments.forEach(appointment => {
-            // Find the user associated with this appointment
-            const user = users.find(u => u.user_id === appointment.user_id);
-            const userName = user ? user.user_name : 'Unknown User';
+            const userName = appointment.user_name || 'Unknown User';
             
             // Format the date and time
             const date = new Date(`${appointment.appointment_date}T${appointment.appointment_time}`);
@@ -79,70 +79,23 @@ document.addEventListener("DOMContentLoaded", function() {
             '<i class="fas fa-spinner fa-spin"></i> Loading recent activity...' +
             '</div>';
 
-        // Fetch users count
-        fetch('/api/users')
+        // Counts and recent appointments are computed by the server
+        fetch('/api/admin/dashboard-stats')
             .then(function(response) {
                 if (!response.ok) {
-                    throw new Error('Failed to fetch users data');
+                    throw new Error('Failed to fetch dashboard statistics');
                 }
                 return response.json();
             })
-            .then(function(data) {
-                var users = data;
-                var totalUsers = users.length;
-                var patients = users.filter(function(user) { 
-                    return user.user_type === 'Normal';
-                }).length;
-
-                document.getElementById('total-users-value').textContent = totalUsers;
-                document.getElementById('patients-count-value').textContent = patients;
-                
-                // Fetch specialists to count doctors
-                return fetch('/api/specialists');
-            })
-            .then(function(response) {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch specialists data');
-                }
-                return response.json();
-            })
-            .then(function(specialists) {
-                // Count active specialists
-                var doctors = specialists.filter(function(specialist) {
-                    return specialist.is_active === 1;
-                }).length;
-                
-                document.getElementById('doctors-count-value').textContent = doctors;
-
-                // After we have users data, fetch appointments
-                return fetch('/api/appointments');
-            })
-            .then(function(response) {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch appointments data');
-                }
-                return response.json();
-            })
-            .then(function(appointments) {
-                var totalAppointments = appointments.length;
-                
-                // Calculate today's appointments
-                var today = new Date().toISOString().slice(0, 10); // Format: YYYY-MM-DD
-                var todayAppointments = appointments.filter(function(appt) { 
-                    return appt.appointment_date === today;
-                }).length;
-                
-                // Calculate upcoming appointments (future dates)
-                var upcomingAppointments = appointments.filter(function(appt) { 
-                    return appt.appointment_date > today;
-                }).length;
-
-                document.getElementById('total-appointments-value').textContent = totalAppointments;
-                document.getElementById('today-appointments-value').textContent = todayAppointments;
-                document.getElementById('upcoming-appointments-value').textContent = upcomingAppointments;
-
-                // Now load recent activity with both user and appointment data
-                loadRecentActivity(appointments);
+            .then(function(stats) {
+                document.getElementById('total-users-value').textContent = stats.total_users;
+                document.getElementById('patients-count-value').textContent = stats.patients;
+                document.getElementById('doctors-count-value').textContent = stats.active_specialists;
+                document.getElementById('total-appointments-value').textContent = stats.total_appointments;
+                document.getElementById('today-appointments-value').textContent = stats.today_appointments;
+                document.getElementById('upcoming-appointments-value').textContent = stats.upcoming_appointments;
+
+                displayRecentActivity(stats.recent_appointments);
             })
             .catch(function(error) {
                 console.error('Error loading dashboard data:', error);
@@ -156,45 +109,11 @@ document.addEventListener("DOMContentLoaded", function() {
             });
     }
 
-    /**
-     * Load recent activity for the dashboard
-     */
-    function loadRecentActivity(appointments) {
-        // Fetch users to get user details for appointments
-        fetch('/api/users')
-            .then(function(response) {
-                if (!response.ok) {
-                    throw new Error('Failed to fetch users data');
-                }
-                return response.json();
-            })
-            .then(function(users) {
-                displayRecentActivity(appointments, users);
-            })
-            .catch(function(error) {
-                console.error('Error loading recent activity:', error);
-                document.getElementById('recent-activity-list').innerHTML = 
-                    '<div class="error-message">' +
-                    '<i class="fas fa-exclamation-circle"></i> Failed to load recent activity.' +
-                    '</div>';
-            });
-    }
-
     /**
      * Display recent activity items
-     * @param {Array} appointments - Recent appointments
-     * @param {Array} users - User data
+     * @param {Array} recentAppointments - Most recent appointments, newest first
      */
-    function displayRecentActivity(appointments, users) {
-        // Sort appointments by date and time, most recent first
-        var sortedAppointments = appointments.slice().sort(function(a, b) {
-            var dateA = new Date(a.appointment_date + 'T' + a.appointment_time);
-            var dateB = new Date(b.appointment_date + 'T' + b.appointment_time);
-            return dateB - dateA;
-        });
-
-        // Take the 5 most recent appointments
-        var recentAppointments = sortedAppointments.slice(0, 5);
+    function displayRecentActivity(recentAppointments) {
 
         if (recentAppointments.length === 0) {
             document.getElementById('recent-activity-list').innerHTML = 
@@ -207,11 +126,7 @@ document.addEventListener("DOMContentLoaded", function() {
         var html = '';
         
         recentAppointments.forEach(function(appointment) {
-            // Find the user associated with this appointment
-            var user = users.find(function(u) { 
-                return u.user_id === appointment.user_id;
-            });
-            var userName = user ? user.user_name : 'Unknown User';
+            var userName = appointment.user_name || 'Unknown User';
             
             // Format the date and time
             var date = new Date(appointment.appointment_date + 'T' + appointment.appointment_time);
@@ -0,0 +1,65 @@
+"""
+JSON serialization for HealthAssist API responses
+
+Responses are encoded with orjson when it is installed (the "all" extra)
+and with the standard library otherwise. Both providers write date,
+time and datetime values in ISO format and Decimal values as numbers, so
+routes can hand them over without converting each field.
+"""
+from datetime import date, time
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the installed extras
+    orjson = None
+
+
+def _default(value):
+    """Encode the values neither JSON encoder handles on its own"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class StandardJSONProvider(DefaultJSONProvider):
+    """Standard library provider writing dates in ISO format rather than HTTP date format"""
+
+    default = staticmethod(_default)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson-backed provider; responses are encoded straight to bytes"""
+
+    def _options(self, pretty=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj,
+                            default=_default,
+                            option=self._options(
+                                pretty='indent' in kwargs)).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj,
+                            default=_default,
+                            option=self._options(pretty)
+                            | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+# Provider installed on the Flask app
+JSONProvider = OrjsonProvider if orjson is not None else StandardJSONProvider
@@ -1,22 +1,57 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, g, abort, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, send_from_directory, g, abort, redirect, url_for, flash, Response
 import os
 import json
+import click
 import stripe
 import uuid
+import queue
+import time as clock
 from datetime import datetime, date, time, timedelta
 from sqlalchemy import create_engine, func, text, and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, scoped_session
-from models import Base, User, Appointment, CheckupType, Specialist, HealthFact
+from models import Base, User, Appointment, CheckupType, Specialist, HealthFact, SlotHold
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
-from email_service import send_appointment_confirmation
+from email_outbox import enqueue_appointment_confirmation, run_email_worker
+from email_spool import drain_spool, SPOOL_DRAIN_WORKERS, SPOOL_POLL_SECONDS
+from appointment_reminders import send_reminders, REMINDER_WORKERS
+from slot_service import (TIME_SLOTS, MAX_MATRIX_DAYS, CHECKOUT_SESSION_MINUTES,
+                          get_availability_matrix, get_booked_count,
+                          invalidate_booked_count, reserve_slot, release_slot, move_slots,
+                          create_hold, release_hold, release_expired_holds,
+                          hold_sweep_due, backfill_slot_ledger,
+                          rebuild_slot_ledger, slot_cache,
+                          find_next_available_slots, NEXT_SLOTS_HORIZON_DAYS,
+                          MAX_NEXT_SLOTS_HORIZON_DAYS)
+from appointment_queries import (APPOINTMENTS_PAGE_SIZE,
+                                 MAX_APPOINTMENTS_PAGE_SIZE, EXPORT_FORMATS,
+                                 parse_appointment_filters, page_appointments,
+                                 export_appointments)
+from dashboard_stats import get_dashboard_stats
+from projections import (CHECKUP_TYPE_LIST, USER_LIST, APPOINTMENT_LIST,
+                         USER_APPOINTMENT_LIST, SPECIALIST_LIST,
+                         HEALTH_FACT_LIST)
+from json_provider import JSONProvider
+from migrations import run_migrations, pending_migrations, check_query_plans
+from partitions import maintain_partitions, archive_partitions, ARCHIVE_AFTER_MONTHS
+from compression import compress_response, send_precompressed
+from catalog_service import (checkup_catalog, catalog_listings,
+                             invalidate_catalog, publish_catalog_change,
+                             CHECKUP_TYPES, SPECIALISTS, HEALTH_FACTS)
+from user_cache import user_cache, publish_user_change
+from password_service import (hash_password, verify_password,
+                              needs_rehash, PasswordHashBusy,
+                              PASSWORD_HASH_RETRY_AFTER)
+from slot_events import (slot_events, STREAM_HEARTBEAT_SECONDS, STREAM_MAX_SECONDS,
+                         STREAM_RETRY_AFTER)
 
 # Configure Stripe
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
 DOMAIN = os.environ.get('REPLIT_DEV_DOMAIN', '34.143.166.2:5000')
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.secret_key = os.environ.get(
     "FLASK_SECRET_KEY") or "a_secure_secret_key_for_session"
 
@@ -47,6 +82,11 @@ Session = scoped_session(session_factory)
 # Ensure tables are created
 Base.metadata.create_all(engine)
 
+# Migrations run as a deploy step (flask migrate), not in every process
+pending = pending_migrations(engine)
+if pending:
+    print(f"Warning: {len(pending)} schema migration(s) pending, run 'flask migrate'")
+
 # Flask-Login configuration
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -55,10 +95,10 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
+    session = Session()
     try:
-        session = Session()
-        user = session.query(User).get(int(user_id))
-        return user
+        # Served from the per-process user cache; the database is only hit on a miss
+        return user_cache.get(session, user_id)
     except Exception as e:
         print(f"Error loading user: {str(e)}")
         return None
@@ -66,6 +106,23 @@ def load_user(user_id):
         session.close()
 
 
+@app.before_request
+def start_slot_events():
+    """Make sure this worker is listening for slot capacity changes."""
+    slot_events.start(engine)
+
+
+@app.after_request
+def compress(response):
+    """Compress responses for clients that accept gzip or brotli."""
+    return compress_response(response, request.accept_encodings)
+
+
+def send_static(path):
+    """Serve a file from the application directory, precompressed when possible."""
+    return send_precompressed('.', path, request.accept_encodings)
+
+
 @app.teardown_appcontext
 def cleanup(resp_or_exc):
     """Close the database session after each request."""
@@ -74,13 +131,22 @@ def cleanup(resp_or_exc):
 
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    return send_static('index.html')
+
+
+def password_busy_response():
+    """Answer a request turned away by the saturated password hashing pool."""
+    response = jsonify(
+        {"error": "The server is busy. Please try again in a moment."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response
 
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
-        return send_from_directory('.', 'login.html')
+        return send_static('login.html')
 
     if request.method == 'POST':
         session = Session()
@@ -103,27 +169,21 @@ def login():
 
             # Check if user exists and password matches
             if user:
-                password_matches = False
                 try:
-                    if user.password.startswith('$2'):  # Check if it's a bcrypt hash
-                        app.logger.info("Using bcrypt verification")
-                        password_matches = check_password_hash(user.password, password)
-                    elif user.password.startswith('scrypt:'):  # Add this check for scrypt
-                        app.logger.info("Using scrypt verification")
-                        # You'll need to use the appropriate scrypt verification function
-                        # This depends on what library you used to generate the hash
-                        from werkzeug.security import check_password_hash
-                        password_matches = check_password_hash(user.password, password)
-                    else:
-                        app.logger.info("Using plaintext comparison")
-                        password_matches = (user.password == password)
-                    app.logger.info(f"Password match: {password_matches}")
-                except Exception as e:
-                    app.logger.error(f"Password verification error: {str(e)}")
-                    password_matches = (user.password == password)
-                    app.logger.info(f"Fallback password match: {password_matches}")
+                    password_matches = verify_password(user.password, password)
+                except PasswordHashBusy:
+                    return password_busy_response()
+                app.logger.info(f"Password match: {password_matches}")
 
                 if password_matches:
+                    # Upgrade plaintext and outdated hashes while the password is at hand
+                    if needs_rehash(user.password):
+                        try:
+                            user.password = hash_password(password)
+                            session.commit()
+                        except PasswordHashBusy:
+                            app.logger.info("Password rehash deferred, hashing pool is busy")
+
                     login_user(user)
 
                     # Redirect based on user type
@@ -159,7 +219,7 @@ def signup_page():
         else:
             return redirect('/')
 
-    return send_from_directory('.', 'signup.html')
+    return send_static('signup.html')
 
 
 @app.route('/api/signup', methods=['POST'])
@@ -249,7 +309,7 @@ def signup():
             phone_number=phone_number,
             email=data.get('email'),
             username=data.get('username'),
-            password=generate_password_hash(
+            password=hash_password(
                 data.get('password')),  # Hash the password for security
             user_type=data.get('user_type', 'Normal')  # Default to Normal user
         )
@@ -266,6 +326,9 @@ def signup():
             'message': 'Registration successful'
         }), 201
 
+    except PasswordHashBusy:
+        session.rollback()
+        return password_busy_response()
     except Exception as e:
         session.rollback()
         print(f"Error in signup: {str(e)}")
@@ -286,7 +349,7 @@ def logout():
 def admin_dashboard():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'dashboard.html')
+    return send_static('dashboard.html')
 
 
 @app.route('/admin/checkup-types')
@@ -294,7 +357,7 @@ def admin_dashboard():
 def admin_checkup_types():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'checkup_types.html')
+    return send_static('checkup_types.html')
 
 
 @app.route('/admin/specialists')
@@ -302,7 +365,7 @@ def admin_checkup_types():
 def admin_specialists():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'specialists.html')
+    return send_static('specialists.html')
 
 
 @app.route('/admin/health-facts')
@@ -310,7 +373,7 @@ def admin_specialists():
 def admin_health_facts():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'health_facts.html')
+    return send_static('health_facts.html')
 
 
 @app.route('/admin/users')
@@ -318,7 +381,7 @@ def admin_health_facts():
 def admin_users():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'users.html')
+    return send_static('users.html')
 
 
 @app.route('/admin/appointments')
@@ -326,7 +389,7 @@ def admin_users():
 def admin_appointments():
     if not current_user.is_authenticated or current_user.user_type != 'Admin':
         return redirect('/login')
-    return send_from_directory('.', 'appointments.html')
+    return send_static('appointments.html')
 
 
 @app.route('/user/home')
@@ -342,7 +405,7 @@ def user_home():
 def user_specialist():
     if not current_user.is_authenticated:
         return redirect('/login')
-    return send_from_directory('.', 'user_specialist.html')
+    return send_static('user_specialist.html')
 
 
 @app.route('/user/appointment')
@@ -350,7 +413,7 @@ def user_specialist():
 def user_appointment():
     if not current_user.is_authenticated:
         return redirect('/login')
-    return send_from_directory('.', 'user_appointment.html')
+    return send_static('user_appointment.html')
 
 
 @app.route('/user/pregnancy-calculator')
@@ -358,7 +421,7 @@ def user_appointment():
 def user_pregnancy_calculator():
     if not current_user.is_authenticated:
         return redirect('/login')
-    return send_from_directory('.', 'user_pregnancy_calculator.html')
+    return send_static('user_pregnancy_calculator.html')
 
 
 @app.route('/user/view-appointment')
@@ -366,7 +429,7 @@ def user_pregnancy_calculator():
 def user_view_appointment():
     if not current_user.is_authenticated:
         return redirect('/login')
-    return send_from_directory('.', 'user_view_appointment.html')
+    return send_static('user_view_appointment.html')
 
 
 @app.route('/payment')
@@ -374,7 +437,7 @@ def user_view_appointment():
 def payment_page():
     if not current_user.is_authenticated:
         return redirect('/login')
-    return send_from_directory('.', 'payment.html')
+    return send_static('payment.html')
 
 
 @app.route('/uploads/<path:filename>')
@@ -398,14 +461,14 @@ def serve_file(path):
        '/js/' in path or path.startswith('js/') or \
        '/uploads/' in path or path.startswith('uploads/'):
         # This is a static asset, serve it directly
-        return send_from_directory('.', path)
+        return send_static(path)
 
     # Don't serve protected routes through the general handler
     if path.startswith('admin/') or path.startswith('user/'):
         return redirect('/login')
 
     # Standard path handling
-    return send_from_directory('.', path)
+    return send_static(path)
 
 
 # API Routes
@@ -416,19 +479,17 @@ def get_users():
         # Filter by user_type if specified
         user_type = request.args.get('user_type')
 
-        query = session.query(User)
+        # Select only the fields the client asked for
+        try:
+            projection = USER_LIST.select(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query = session.query(*projection.columns)
         if user_type:
             query = query.filter(User.user_type == user_type)
 
-        users = query.all()
-        return jsonify([{
-            'user_id': user.user_id,
-            'user_name': user.user_name,
-            'gender': user.gender,
-            'email': user.email,
-            'username': user.username,
-            'user_type': user.user_type
-        } for user in users])
+        return jsonify([projection.serialize(user) for user in query])
     except Exception as e:
         print(f"Error getting users: {str(e)}")
         return jsonify(
@@ -531,7 +592,7 @@ def create_user():
             phone_number=phone_number,
             email=data.get('email'),
             username=data.get('username'),
-            password=generate_password_hash(data.get('password')),  # Hash the password
+            password=hash_password(data.get('password')),  # Hash the password
             user_type=data.get('user_type', 'Normal'))
 
         session.add(new_user)
@@ -550,6 +611,9 @@ def create_user():
             'message': 'User created successfully'
         }), 201
 
+    except PasswordHashBusy:
+        session.rollback()
+        return password_busy_response()
     except Exception as e:
         session.rollback()
         print(f"Error in create_user: {str(e)}")
@@ -643,7 +707,7 @@ def update_user(user_id):
         if 'user_type' in data and data['user_type']:
             user.user_type = data['user_type']
         if 'password' in data and data['password']:
-            user.password = generate_password_hash(data['password'])
+            user.password = hash_password(data['password'])
         if 'phone_number' in data and data['phone_number']:
             user.phone_number = int(data['phone_number'])
         if 'birthday' in data and data['birthday']:
@@ -652,7 +716,9 @@ def update_user(user_id):
             except ValueError:
                 return jsonify({"error": "Invalid date format for birthday", "field": "birthday"}), 400
 
+        publish_user_change(session, user_id)
         session.commit()
+        user_cache.invalidate(user_id)
 
         # Log successful update
         print(f"User updated successfully: {user.username} (ID: {user.user_id})")
@@ -667,6 +733,9 @@ def update_user(user_id):
             'message': 'User updated successfully'
         })
 
+    except PasswordHashBusy:
+        session.rollback()
+        return password_busy_response()
     except Exception as e:
         session.rollback()
         print(f"Error in update_user: {str(e)}")
@@ -684,8 +753,22 @@ def delete_user(user_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
 
+        # The user's appointments and holds are removed by the cascade, so free their slots
+        slots = [(appt.appointment_date, appt.appointment_time, appt.checkup_id)
+                 for appt in user.appointments]
+        holds = session.query(SlotHold).filter(
+            SlotHold.user_id == user_id,
+            SlotHold.appointment_id.is_(None)).all()
+        slots += [(hold.slot_date, hold.slot_time, hold.checkup_id)
+                  for hold in holds]
+        move_slots(session, release=slots)
+
         session.delete(user)
+        publish_user_change(session, user_id)
         session.commit()
+        user_cache.invalidate(user_id)
+        for slot in slots:
+            invalidate_booked_count(*slot)
 
         return jsonify({'message': 'User deleted successfully'})
 
@@ -700,37 +783,44 @@ def delete_user(user_id):
 def get_appointments():
     session = Session()
     try:
-        # Join with User and CheckupType tables to get more details
-        appointments = session.query(
-            Appointment, User.user_name,
-            CheckupType.name, CheckupType.price).join(
-                User, Appointment.user_id == User.user_id).join(
-                    CheckupType,
-                    Appointment.checkup_id == CheckupType.checkup_id).all()
+        try:
+            limit = int(request.args.get('limit', APPOINTMENTS_PAGE_SIZE))
+        except ValueError:
+            return jsonify({"error": "Invalid limit"}), 400
 
-        return jsonify([{
-            'appointment_id':
-            appt.Appointment.appointment_id,
-            'user_id':
-            appt.Appointment.user_id,
-            'user_name':
-            appt.user_name,
-            'checkup_id':
-            appt.Appointment.checkup_id,
-            'checkup_name':
-            appt.name,
-            'appointment_date':
-            appt.Appointment.appointment_date.isoformat(),
-            'appointment_time':
-            appt.Appointment.appointment_time.isoformat(),
-            'price_paid':
-            float(appt.Appointment.price_paid),
-            'status':
-            appt.Appointment.status,
-            'created_at':
-            appt.Appointment.created_at.isoformat()
-            if appt.Appointment.created_at else None
-        } for appt in appointments])
+        if not 1 <= limit <= MAX_APPOINTMENTS_PAGE_SIZE:
+            return jsonify({
+                "error":
+                f"limit must be between 1 and {MAX_APPOINTMENTS_PAGE_SIZE}"
+            }), 400
+
+        # Select only the fields the client asked for, plus the sort key
+        # the next page's cursor is built from
+        try:
+            projection = APPOINTMENT_LIST.select(
+                request.args.get('fields'),
+                required=('appointment_date', 'appointment_time', 'appointment_id'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Join with User only when the patient name is wanted
+        query = session.query(*projection.columns).select_from(Appointment)
+        if 'user_name' in projection.keys:
+            query = query.join(User, Appointment.user_id == User.user_id)
+
+        # Filter and page on the server; the next page continues after the last row
+        try:
+            query = query.filter(*parse_appointment_filters(request.args))
+            appointments, next_cursor = page_appointments(
+                query, request.args.get('cursor'), limit)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        response = jsonify(
+            [projection.serialize(appt) for appt in appointments])
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     except Exception as e:
         print(f"Error getting appointments: {str(e)}")
         return jsonify(
@@ -740,6 +830,54 @@ def get_appointments():
         session.close()
 
 
+# Appointment export endpoint
+@app.route('/api/appointments/export', methods=['GET'])
+@login_required
+def export_appointments_file():
+    # Only admin can export appointments
+    if current_user.user_type != 'Admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    try:
+        conditions = parse_appointment_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filename = f"appointments-{date.today().strftime('%Y%m%d')}.{export_format}"
+    return Response(
+        export_appointments(session_factory, conditions, export_format),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'X-Accel-Buffering': 'no'
+        })
+
+
+# Admin dashboard statistics endpoint
+@app.route('/api/admin/dashboard-stats', methods=['GET'])
+@login_required
+def get_admin_dashboard_stats():
+    # Only admin can view dashboard statistics
+    if current_user.user_type != 'Admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    session = Session()
+    try:
+        return jsonify(get_dashboard_stats(session))
+    except Exception as e:
+        print(f"Error getting dashboard statistics: {str(e)}")
+        return jsonify({
+            "error":
+            f"Failed to retrieve dashboard statistics. Error: {str(e)}"
+        }), 500
+    finally:
+        session.close()
+
+
 @app.route('/api/appointments/<int:appointment_id>', methods=['GET'])
 def get_appointment(appointment_id):
     session = Session()
@@ -829,18 +967,18 @@ def create_appointment():
             return jsonify({"error": "User not found"}), 400
 
         # Verify the checkup exists
-        checkup = session.query(CheckupType).get(data['checkup_id'])
+        checkup = checkup_catalog.get(session, data['checkup_id'])
         if not checkup:
             return jsonify({"error": "Checkup type not found"}), 400
 
-        # Check if slot is available
-        slot_count = session.query(func.count(
-            Appointment.appointment_id)).filter(
-                Appointment.appointment_date == appointment_date,
-                Appointment.appointment_time == appointment_time,
-                Appointment.checkup_id == data['checkup_id']).scalar()
+        # Take a place in the slot if one is available
+        booked = reserve_slot(session,
+                              appointment_date,
+                              appointment_time,
+                              checkup.checkup_id,
+                              max_slots=checkup.max_slots_per_time)
 
-        if slot_count >= checkup.max_slots_per_time:
+        if booked is None:
             return jsonify({"error":
                             "This time slot is already fully booked"}), 400
 
@@ -856,20 +994,15 @@ def create_appointment():
             price_paid=data.get('price_paid', float(checkup.price)))
 
         session.add(new_appointment)
-        session.commit()
 
-        # Send confirmation email if requested
+        # Queue the confirmation email with the booking; the email worker sends it
         if data.get('send_email', True):
-            email_sent = send_appointment_confirmation(
-                user_email=user.email,
-                user_name=user.user_name,
-                appointment_date=appointment_date,
-                appointment_time=appointment_time,
-                checkup_name=checkup.name)
-            if email_sent:
-                print(f"Confirmation email operation completed for {user.email}")
-            else:
-                print(f"Email operation failed completely for {user.email}")
+            enqueue_appointment_confirmation(session, user, appointment_date,
+                                             appointment_time, checkup.name)
+
+        session.commit()
+        invalidate_booked_count(appointment_date, appointment_time,
+                                new_appointment.checkup_id)
 
         return jsonify({
             'appointment_id':
@@ -924,6 +1057,10 @@ def update_appointment(appointment_id):
                 "You do not have permission to update this appointment"
             }), 403
 
+        # Remember the current slot so the occupancy cache can be updated
+        old_slot = (appointment.appointment_date, appointment.appointment_time,
+                    appointment.checkup_id)
+
         # Update appointment fields
         if 'user_id' in data and is_admin:  # Only admin can change user
             # Validate user exists
@@ -932,83 +1069,62 @@ def update_appointment(appointment_id):
                 return jsonify({"error": "User not found"}), 400
             appointment.user_id = data['user_id']
 
+        checkup_id = appointment.checkup_id
+        checkup = None
         if 'checkup_id' in data and is_admin:  # Only admin can change checkup
             # Validate checkup exists
-            checkup = session.query(CheckupType).get(data['checkup_id'])
+            checkup = checkup_catalog.get(session, data['checkup_id'])
             if not checkup:
                 return jsonify({"error": "Checkup type not found"}), 400
-            appointment.checkup_id = data['checkup_id']
-            appointment.checkup_name = checkup.name  # Update the checkup name as well
+            checkup_id = checkup.checkup_id
 
+        appointment_date = appointment.appointment_date
         if 'appointment_date' in data:
             try:
                 appointment_date = datetime.strptime(data['appointment_date'],
                                                      "%Y-%m-%d").date()
-
-                # If changing date and not admin, check slot availability
-                if appointment_date != appointment.appointment_date and not is_admin:
-                    # Check if the new slot is available
-                    time_str = appointment.appointment_time.strftime(
-                        "%H:%M:%S"
-                    ) if 'appointment_time' not in data else data[
-                        'appointment_time']
-                    time_obj = appointment.appointment_time if 'appointment_time' not in data else datetime.strptime(
-                        time_str, "%H:%M:%S").time()
-
-                    slot_count = session.query(
-                        func.count(Appointment.appointment_id)).filter(
-                            Appointment.appointment_date == appointment_date,
-                            Appointment.appointment_time == time_obj,
-                            Appointment.checkup_id == appointment.checkup_id,
-                            Appointment.appointment_id
-                            != appointment_id).scalar()
-
-                    checkup = session.query(CheckupType).get(
-                        appointment.checkup_id)
-                    if slot_count >= checkup.max_slots_per_time:
-                        return jsonify({
-                            "error":
-                            "The requested time slot is already fully booked"
-                        }), 400
-
-                appointment.appointment_date = appointment_date
             except ValueError:
                 return jsonify({"error": "Invalid date format"}), 400
 
+        appointment_time = appointment.appointment_time
         if 'appointment_time' in data:
             try:
                 appointment_time = datetime.strptime(data['appointment_time'],
                                                      "%H:%M:%S").time()
-
-                # If changing time and not admin, check slot availability
-                if appointment_time != appointment.appointment_time and not is_admin:
-                    # Check if the new slot is available
-                    date_str = appointment.appointment_date.isoformat(
-                    ) if 'appointment_date' not in data else data[
-                        'appointment_date']
-                    date_obj = appointment.appointment_date if 'appointment_date' not in data else datetime.strptime(
-                        date_str, "%Y-%m-%d").date()
-
-                    slot_count = session.query(
-                        func.count(Appointment.appointment_id)).filter(
-                            Appointment.appointment_date == date_obj,
-                            Appointment.appointment_time == appointment_time,
-                            Appointment.checkup_id == appointment.checkup_id,
-                            Appointment.appointment_id
-                            != appointment_id).scalar()
-
-                    checkup = session.query(CheckupType).get(
-                        appointment.checkup_id)
-                    if slot_count >= checkup.max_slots_per_time:
-                        return jsonify({
-                            "error":
-                            "The requested time slot is already fully booked"
-                        }), 400
-
-                appointment.appointment_time = appointment_time
             except ValueError:
                 return jsonify({"error": "Invalid time format"}), 400
 
+        # Move the appointment through the capacity ledger if its slot changes.
+        # The old and new ledger rows are locked together, in order, and the
+        # old places count as given back, so a move to an overlapping slot
+        # does not count against itself. Admins may overbook; patients are
+        # held to the slot capacity.
+        new_slot = (appointment_date, appointment_time, checkup_id)
+        if new_slot != old_slot:
+            slot_checkup = checkup or checkup_catalog.get(session, checkup_id)
+            if not slot_checkup:
+                return jsonify({"error": "Checkup type not found"}), 404
+            max_slots = None
+            if not is_admin:
+                max_slots = slot_checkup.max_slots_per_time
+
+            if move_slots(session, release=[old_slot], reserve=[new_slot],
+                          max_slots=max_slots) is None:
+                session.rollback()
+                return jsonify({
+                    "error":
+                    "The requested time slot is already fully booked"
+                }), 400
+
+            appointment.appointment_date = appointment_date
+            appointment.appointment_time = appointment_time
+            # The reminder, if already sent, was for the old slot
+            appointment.reminder_sent_at = None
+
+        if checkup:
+            appointment.checkup_id = checkup.checkup_id
+            appointment.checkup_name = checkup.name  # Update the checkup name as well
+
         if 'status' in data and is_admin:  # Only admin can change status
             appointment.status = data['status']
 
@@ -1017,8 +1133,12 @@ def update_appointment(appointment_id):
 
         session.commit()
 
+        if new_slot != old_slot:
+            invalidate_booked_count(*old_slot)
+            invalidate_booked_count(*new_slot)
+
         # Get updated appointment details
-        checkup = session.query(CheckupType).get(appointment.checkup_id)
+        checkup = checkup_catalog.get(session, appointment.checkup_id)
         user = session.query(User).get(appointment.user_id)
 
         return jsonify({
@@ -1071,8 +1191,13 @@ def delete_appointment(appointment_id):
                 "You do not have permission to delete this appointment"
             }), 403
 
+        slot = (appointment.appointment_date, appointment.appointment_time,
+                appointment.checkup_id)
+
+        release_slot(session, *slot)
         session.delete(appointment)
         session.commit()
+        invalidate_booked_count(*slot)
 
         return jsonify({'message': 'Appointment deleted successfully'})
 
@@ -1096,34 +1221,11 @@ def get_user_appointments(user_id):
 
     session = Session()
     try:
-        # Join with CheckupType to get more details
-        appointments = session.query(
-            Appointment, CheckupType.name, CheckupType.price).join(
-                CheckupType,
-                Appointment.checkup_id == CheckupType.checkup_id).filter(
-                    Appointment.user_id == user_id).all()
-
-        return jsonify([{
-            'appointment_id':
-            appt.Appointment.appointment_id,
-            'user_id':
-            appt.Appointment.user_id,
-            'checkup_id':
-            appt.Appointment.checkup_id,
-            'checkup_name':
-            appt.name,
-            'appointment_date':
-            appt.Appointment.appointment_date.isoformat(),
-            'appointment_time':
-            appt.Appointment.appointment_time.isoformat(),
-            'status':
-            appt.Appointment.status,
-            'price_paid':
-            float(appt.Appointment.price_paid),
-            'created_at':
-            appt.Appointment.created_at.isoformat()
-            if appt.Appointment.created_at else None
-        } for appt in appointments])
+        appointments = session.query(*USER_APPOINTMENT_LIST.columns).filter(
+            Appointment.user_id == user_id)
+
+        return jsonify(
+            [USER_APPOINTMENT_LIST.serialize(appt) for appt in appointments])
     except Exception as e:
         print(f"Error getting user appointments: {str(e)}")
         return jsonify({
@@ -1134,6 +1236,26 @@ def get_user_appointments(user_id):
         session.close()
 
 
+def sweep_expired_holds():
+    """Release expired checkout holds, at most once per sweep interval."""
+    if not hold_sweep_due():
+        return
+
+    session = session_factory()
+    try:
+        released = release_expired_holds(session)
+        session.commit()
+        for slot in released:
+            invalidate_booked_count(*slot)
+        if released:
+            print(f"Released {len(released)} expired slot hold(s)")
+    except Exception as e:
+        session.rollback()
+        print(f"Error releasing expired slot holds: {str(e)}")
+    finally:
+        session.close()
+
+
 # Stripe payment endpoints
 @app.route('/api/create-checkout-session', methods=['POST'])
 def create_checkout_session():
@@ -1163,28 +1285,38 @@ def create_checkout_session():
         if not appointment_date or not appointment_time or not checkup_id:
             return jsonify({'error': 'Missing appointment information'}), 400
 
+        sweep_expired_holds()
+
         session = Session()
+        hold = None
+        hold_committed = False
         try:
             # Check if checkup exists
-            checkup = session.query(CheckupType).get(int(checkup_id))
+            checkup = checkup_catalog.get(session, checkup_id)
             if not checkup:
                 return jsonify({'error': 'Invalid checkup type'}), 400
 
-            # Check if slot is available
-            slot_count = session.query(func.count(
-                Appointment.appointment_id)).filter(
-                    Appointment.appointment_date == datetime.strptime(
-                        appointment_date, "%Y-%m-%d").date(),
-                    Appointment.appointment_time == datetime.strptime(
-                        appointment_time, "%H:%M:%S").time(),
-                    Appointment.checkup_id == int(checkup_id)).scalar()
-
-            if slot_count >= checkup.max_slots_per_time:
+            # Hold a place in the slot for as long as the checkout session is open
+            checkout_expires_at = datetime.now() + timedelta(
+                minutes=CHECKOUT_SESSION_MINUTES)
+            hold = create_hold(
+                session, current_user.user_id,
+                datetime.strptime(appointment_date, "%Y-%m-%d").date(),
+                datetime.strptime(appointment_time, "%H:%M:%S").time(),
+                checkup.checkup_id, checkup.max_slots_per_time,
+                checkout_expires_at)
+
+            if hold is None:
                 return jsonify({
                     'error':
                     'This time slot is already fully booked. Please choose another time.'
                 }), 400
 
+            session.commit()
+            hold_committed = True
+            invalidate_booked_count(hold.slot_date, hold.slot_time,
+                                    hold.checkup_id)
+
             # Create a checkout session
             checkout_session = stripe.checkout.Session.create(
                 payment_method_types=['card'],
@@ -1205,6 +1337,7 @@ def create_checkout_session():
                     },
                 ],
                 mode='payment',
+                expires_at=int(checkout_expires_at.timestamp()),
                 success_url=
                 f'http://{DOMAIN}/payment-success?session_id={{CHECKOUT_SESSION_ID}}',
                 cancel_url=f'http://{DOMAIN}/user/appointment',
@@ -1213,7 +1346,8 @@ def create_checkout_session():
                     'appointment_date': appointment_date,
                     'appointment_time': appointment_time,
                     'checkup_id': checkup_id,
-                    'price': str(checkup.price)
+                    'price': str(checkup.price),
+                    'hold_token': hold.hold_token
                 })
 
             return jsonify({
@@ -1223,6 +1357,17 @@ def create_checkout_session():
 
         except Exception as inner_e:
             print(f"Error in database operations: {str(inner_e)}")
+            session.rollback()
+            # Give the held place back if the checkout session was not created
+            if hold_committed:
+                try:
+                    slot = (hold.slot_date, hold.slot_time, hold.checkup_id)
+                    release_hold(session, hold)
+                    session.commit()
+                    invalidate_booked_count(*slot)
+                except Exception as release_e:
+                    session.rollback()
+                    print(f"Error releasing slot hold: {str(release_e)}")
             return jsonify({'error': str(inner_e)}), 500
         finally:
             session.close()
@@ -1266,24 +1411,39 @@ def payment_success():
             price = float(metadata['price'])
 
             # Verify the checkup exists
-            checkup = db_session.query(CheckupType).get(checkup_id)
+            checkup = checkup_catalog.get(db_session, checkup_id)
             if not checkup:
                 return render_template('payment_error.html',
                                        error='Invalid checkup type')
 
-            # Check if slot is still available (possible race condition)
-            slot_count = db_session.query(
-                func.count(Appointment.appointment_id)).filter(
-                    Appointment.appointment_date == appointment_date,
-                    Appointment.appointment_time == appointment_time,
-                    Appointment.checkup_id == checkup_id).scalar()
-
-            if slot_count >= checkup.max_slots_per_time:
-                return render_template(
-                    'payment_error.html',
-                    error=
-                    'This time slot is now fully booked. Please contact support.'
-                )
+            # The place taken at checkout is converted into the appointment
+            hold = None
+            if metadata.get('hold_token'):
+                hold = db_session.query(SlotHold).filter(
+                    SlotHold.hold_token ==
+                    metadata['hold_token']).with_for_update().first()
+
+            # Already booked, e.g. the success page was reloaded. Checked after
+            # waiting on the hold, so a concurrent conversion is seen here
+            if db_session.query(Appointment.appointment_id).filter(
+                    Appointment.checkout_session_id == session_id,
+                    Appointment.appointment_date == appointment_date).first():
+                return redirect('/user/view-appointment')
+
+            if not hold:
+                # The hold was swept; take a place if the slot still has one
+                booked = reserve_slot(db_session,
+                                      appointment_date,
+                                      appointment_time,
+                                      checkup_id,
+                                      max_slots=checkup.max_slots_per_time)
+
+                if booked is None:
+                    return render_template(
+                        'payment_error.html',
+                        error=
+                        'This time slot is now fully booked. Please contact support.'
+                    )
 
             # Create new appointment
             new_appointment = Appointment(
@@ -1294,41 +1454,34 @@ def payment_success():
                 appointment_date=appointment_date,
                 appointment_time=appointment_time,
                 status='Confirmed',
-                price_paid=price)
+                price_paid=price,
+                checkout_session_id=session_id)
 
             db_session.add(new_appointment)
-            db_session.commit()
+            if hold:
+                # The appointment now owns the hold's place in the ledger
+                db_session.delete(hold)
 
-            # Get the user information for email notification
+            # Queue the confirmation email with the booking; the email worker sends it
             user = db_session.query(User).get(int(metadata['user_id']))
-
             if user:
-                # Debug information about the user
-                print(f"User authenticated: {current_user.is_authenticated}")
-                print(f"User ID: {current_user.user_id}")
-                print(f"Attempting to send email to: {user.email}")
-
-                # Send confirmation email
-                email_sent = send_appointment_confirmation(
-                    user_email=user.email,
-                    user_name=user.user_name,
-                    appointment_date=appointment_date,
-                    appointment_time=appointment_time,
-                    checkup_name=checkup.name)
-
-                if email_sent:
-                    print(
-                        f"Confirmation email operation completed for {user.email}"
-                    )
-                    # Add a flash message for the user if implementation supports it
-                    # flash("Appointment confirmation email has been sent to your email address", "success")
-                else:
-                    print(f"Email operation failed completely for {user.email}")
-                    # flash("There was an issue sending your confirmation email. Please contact support.", "warning")
+                enqueue_appointment_confirmation(db_session, user,
+                                                 appointment_date,
+                                                 appointment_time,
+                                                 checkup.name)
+
+            db_session.commit()
+            if not hold:
+                invalidate_booked_count(appointment_date, appointment_time,
+                                        checkup_id)
 
             # Redirect to view appointments page
             return redirect('/user/view-appointment')
 
+        except IntegrityError:
+            # A concurrent request booked this checkout session first
+            db_session.rollback()
+            return redirect('/user/view-appointment')
         except Exception as e:
             db_session.rollback()
             print(f"Error saving appointment after payment: {str(e)}")
@@ -1349,39 +1502,63 @@ def payment_error():
     return render_template('payment_error.html', error=error_message)
 
 
+def catalog_response(name, projection, build):
+    """
+    Serve a catalog listing from the per-process cache with a strong ETag
+
+    The listing is only built on a cache miss, so a request whose
+    If-None-Match matches the cached listing is answered with 304 without
+    opening a database session. Each fields= selection is cached as its
+    own listing.
+
+    Args:
+        name: Catalog name
+        projection: Full projection of the catalog listing
+        build: Function taking a database session and the requested
+            projection and returning the listing rows
+
+    Returns:
+        Response: The listing, 304 Not Modified, or 400 for unknown fields
+    """
+    try:
+        selected = projection.select(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    variant = selected.keys if selected is not projection else None
+
+    listing = catalog_listings.get(name, variant)
+    if listing is None:
+        version = catalog_listings.version(name)
+        session = Session()
+        try:
+            body = f"{app.json.dumps(build(session, selected))}\n".encode()
+        finally:
+            session.close()
+        listing = catalog_listings.store(name, version, body, variant)
+
+    response = Response(listing.body, mimetype='application/json')
+    response.set_etag(listing.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 # Checkup Types API endpoints
 @app.route('/api/checkup-types', methods=['GET'])
 def get_checkup_types():
-    session = Session()
+
+    def build(session, projection):
+        return [
+            projection.serialize_object(checkup)
+            for checkup in checkup_catalog.all(session)
+        ]
+
     try:
-        checkups = session.query(CheckupType).all()
-        return jsonify([{
-            'checkup_id':
-            checkup.checkup_id,
-            'name':
-            checkup.name,
-            'description':
-            checkup.description,
-            'price':
-            float(checkup.price),
-            'duration_minutes':
-            checkup.duration_minutes,
-            'max_slots_per_time':
-            checkup.max_slots_per_time,
-            'image_path':
-            checkup.image_path,
-            'is_active':
-            checkup.is_active,
-            'created_at':
-            checkup.created_at.isoformat() if checkup.created_at else None
-        } for checkup in checkups])
+        return catalog_response(CHECKUP_TYPES, CHECKUP_TYPE_LIST, build)
     except Exception as e:
         print(f"Error getting checkup types: {str(e)}")
         return jsonify(
             {"error":
              f"Failed to retrieve checkup types. Error: {str(e)}"}), 500
-    finally:
-        session.close()
 
 
 @app.route('/api/checkup-types/<int:checkup_id>', methods=['GET'])
@@ -1480,7 +1657,9 @@ def create_checkup_type():
             is_active=data.get('is_active', 1))
 
         session.add(new_checkup)
+        publish_catalog_change(session, CHECKUP_TYPES)
         session.commit()
+        invalidate_catalog(CHECKUP_TYPES)
 
         return jsonify({
             'checkup_id': new_checkup.checkup_id,
@@ -1571,14 +1750,26 @@ def update_checkup_type(checkup_id):
             checkup.description = data['description']
         if 'price' in data:
             checkup.price = data['price']
+        duration_changed = False
         if 'duration_minutes' in data:
+            duration_changed = int(
+                data['duration_minutes']) != checkup.duration_minutes
             checkup.duration_minutes = data['duration_minutes']
         if 'max_slots_per_time' in data:
             checkup.max_slots_per_time = data['max_slots_per_time']
         if 'is_active' in data:
             checkup.is_active = data['is_active']
 
+        # A new duration changes which slots each booking overlaps
+        if duration_changed:
+            session.flush()
+            rebuild_slot_ledger(session, checkup.checkup_id, date.today())
+
+        publish_catalog_change(session, CHECKUP_TYPES)
         session.commit()
+        invalidate_catalog(CHECKUP_TYPES)
+        if duration_changed:
+            slot_cache.clear()
 
         return jsonify({
             'checkup_id': checkup.checkup_id,
@@ -1624,7 +1815,9 @@ def delete_checkup_type(checkup_id):
             }), 400
 
         session.delete(checkup)
+        publish_catalog_change(session, CHECKUP_TYPES)
         session.commit()
+        invalidate_catalog(CHECKUP_TYPES)
 
         return jsonify({'message': 'Checkup type deleted successfully'})
 
@@ -1638,34 +1831,20 @@ def delete_checkup_type(checkup_id):
 # Specialists API endpoints
 @app.route('/api/specialists', methods=['GET'])
 def get_specialists():
-    session = Session()
+
+    def build(session, projection):
+        return [
+            projection.serialize(specialist)
+            for specialist in session.query(*projection.columns).order_by(
+                Specialist.specialist_id)
+        ]
+
     try:
-        specialists = session.query(Specialist).all()
-        return jsonify([{
-            'specialist_id':
-            specialist.specialist_id,
-            'name':
-            specialist.name,
-            'title':
-            specialist.title,
-            'specialization':
-            specialist.specialization,
-            'bio':
-            specialist.bio,
-            'image_path':
-            specialist.image_path,
-            'is_active':
-            specialist.is_active,
-            'created_at':
-            specialist.created_at.isoformat()
-            if specialist.created_at else None
-        } for specialist in specialists])
+        return catalog_response(SPECIALISTS, SPECIALIST_LIST, build)
     except Exception as e:
         print(f"Error getting specialists: {str(e)}")
         return jsonify(
             {"error": f"Failed to retrieve specialists. Error: {str(e)}"}), 500
-    finally:
-        session.close()
 
 
 @app.route('/api/specialists/<int:specialist_id>', methods=['GET'])
@@ -1755,7 +1934,9 @@ def create_specialist():
                                     is_active=int(data.get('is_active', 1)))
 
         session.add(new_specialist)
+        publish_catalog_change(session, SPECIALISTS)
         session.commit()
+        invalidate_catalog(SPECIALISTS)
 
         return jsonify({
             'specialist_id': new_specialist.specialist_id,
@@ -1835,7 +2016,9 @@ def update_specialist(specialist_id):
         if 'is_active' in data:
             specialist.is_active = int(data['is_active'])
 
+        publish_catalog_change(session, SPECIALISTS)
         session.commit()
+        invalidate_catalog(SPECIALISTS)
 
         return jsonify({
             'specialist_id': specialist.specialist_id,
@@ -1870,7 +2053,9 @@ def delete_specialist(specialist_id):
             return jsonify({"error": "Specialist not found"}), 404
 
         session.delete(specialist)
+        publish_catalog_change(session, SPECIALISTS)
         session.commit()
+        invalidate_catalog(SPECIALISTS)
 
         return jsonify({'message': 'Specialist deleted successfully'})
 
@@ -1884,32 +2069,21 @@ def delete_specialist(specialist_id):
 # Health Facts API endpoints
 @app.route('/api/health-facts', methods=['GET'])
 def get_health_facts():
-    session = Session()
+
+    def build(session, projection):
+        return [
+            projection.serialize(fact)
+            for fact in session.query(*projection.columns).order_by(
+                HealthFact.fact_id)
+        ]
+
     try:
-        health_facts = session.query(HealthFact).all()
-        return jsonify([{
-            'fact_id':
-            fact.fact_id,
-            'title':
-            fact.title,
-            'content':
-            fact.content,
-            'category':
-            fact.category,
-            'is_featured':
-            fact.is_featured,
-            'is_active':
-            fact.is_active,
-            'created_at':
-            fact.created_at.isoformat() if fact.created_at else None
-        } for fact in health_facts])
+        return catalog_response(HEALTH_FACTS, HEALTH_FACT_LIST, build)
     except Exception as e:
         print(f"Error getting health facts: {str(e)}")
         return jsonify(
             {"error":
              f"Failed to retrieve health facts. Error: {str(e)}"}), 500
-    finally:
-        session.close()
 
 
 @app.route('/api/health-facts/<int:fact_id>', methods=['GET'])
@@ -1973,7 +2147,9 @@ def create_health_fact():
                               is_active=data.get('is_active', 1))
 
         session.add(new_fact)
+        publish_catalog_change(session, HEALTH_FACTS)
         session.commit()
+        invalidate_catalog(HEALTH_FACTS)
 
         return jsonify({
             'fact_id': new_fact.fact_id,
@@ -2022,7 +2198,9 @@ def update_health_fact(fact_id):
         if 'is_active' in data:
             health_fact.is_active = data['is_active']
 
+        publish_catalog_change(session, HEALTH_FACTS)
         session.commit()
+        invalidate_catalog(HEALTH_FACTS)
 
         return jsonify({
             'fact_id': health_fact.fact_id,
@@ -2056,7 +2234,9 @@ def delete_health_fact(fact_id):
             return jsonify({"error": "Health fact not found"}), 404
 
         session.delete(health_fact)
+        publish_catalog_change(session, HEALTH_FACTS)
         session.commit()
+        invalidate_catalog(HEALTH_FACTS)
 
         return jsonify({'message': 'Health fact deleted successfully'})
 
@@ -2070,6 +2250,7 @@ def delete_health_fact(fact_id):
 # Slot availability endpoint
 @app.route('/api/check-slot-availability', methods=['GET'])
 def check_slot_availability():
+    sweep_expired_holds()
     session = Session()
     try:
         # Get parameters
@@ -2088,16 +2269,13 @@ def check_slot_availability():
             return jsonify({"error": "Invalid date or time format"}), 400
 
         # Check if checkup type exists
-        checkup = session.query(CheckupType).get(int(checkup_id))
+        checkup = checkup_catalog.get(session, checkup_id)
         if not checkup:
             return jsonify({"error": "Invalid checkup type"}), 400
 
         # Count existing appointments for this slot
-        slot_count = session.query(func.count(
-            Appointment.appointment_id)).filter(
-                Appointment.appointment_date == appointment_date,
-                Appointment.appointment_time == appointment_time,
-                Appointment.checkup_id == int(checkup_id)).scalar()
+        slot_count = get_booked_count(session, appointment_date,
+                                      appointment_time, checkup_id)
 
         # Check if the slot is available
         is_available = slot_count < checkup.max_slots_per_time
@@ -2122,6 +2300,295 @@ def check_slot_availability():
         session.close()
 
 
+# Slot availability matrix endpoint
+@app.route('/api/slot-availability', methods=['GET'])
+def get_slot_availability():
+    sweep_expired_holds()
+    session = Session()
+    try:
+        # Get parameters
+        start_str = request.args.get('start_date')
+        end_str = request.args.get('end_date')
+        checkup_ids = request.args.get('checkup_ids')
+
+        if not start_str or not end_str:
+            return jsonify({"error": "Missing required parameters"}), 400
+
+        # Parse date range
+        try:
+            start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_str, "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "Invalid date format"}), 400
+
+        if end_date < start_date:
+            return jsonify({"error": "end_date must not be before start_date"}), 400
+
+        if (end_date - start_date).days + 1 > MAX_MATRIX_DAYS:
+            return jsonify({
+                "error":
+                f"Date range cannot exceed {MAX_MATRIX_DAYS} days"
+            }), 400
+
+        # Use the requested checkup types, or all active ones
+        if checkup_ids:
+            try:
+                ids = {int(value) for value in checkup_ids.split(',') if value}
+            except ValueError:
+                return jsonify({"error": "Invalid checkup_ids"}), 400
+            checkups = [
+                checkup for checkup in checkup_catalog.all(session)
+                if checkup.checkup_id in ids
+            ]
+        else:
+            checkups = checkup_catalog.all(session, active_only=True)
+        if checkup_ids and not checkups:
+            return jsonify({"error": "Invalid checkup type"}), 400
+
+        return jsonify({
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'time_slots': [slot.isoformat() for slot in TIME_SLOTS],
+            'checkups': get_availability_matrix(session, start_date, end_date,
+                                                checkups)
+        })
+    except Exception as e:
+        print(f"Error getting slot availability: {str(e)}")
+        return jsonify(
+            {"error":
+             f"Failed to get slot availability. Error: {str(e)}"}), 500
+    finally:
+        session.close()
+
+
+# Next available slots search endpoint
+@app.route('/api/next-available-slots', methods=['GET'])
+def get_next_available_slots():
+    sweep_expired_holds()
+    session = Session()
+    try:
+        # Get parameters
+        from_str = request.args.get('from_date')
+        checkup_id = request.args.get('checkup_id')
+
+        try:
+            limit = int(request.args.get('limit', 10))
+            horizon_days = int(
+                request.args.get('days', NEXT_SLOTS_HORIZON_DAYS))
+            if checkup_id:
+                checkup_id = int(checkup_id)
+        except ValueError:
+            return jsonify({"error": "Invalid limit, days or checkup_id"}), 400
+
+        if not 1 <= limit <= 50:
+            return jsonify({"error": "limit must be between 1 and 50"}), 400
+
+        if not 1 <= horizon_days <= MAX_NEXT_SLOTS_HORIZON_DAYS:
+            return jsonify({
+                "error":
+                f"days must be between 1 and {MAX_NEXT_SLOTS_HORIZON_DAYS}"
+            }), 400
+
+        # Search from the requested date, but never from the past
+        now = datetime.now()
+        from_datetime = now
+        if from_str:
+            try:
+                from_date = datetime.strptime(from_str, "%Y-%m-%d")
+            except ValueError:
+                return jsonify({"error": "Invalid date format"}), 400
+            from_datetime = max(from_date, now)
+
+        return jsonify({
+            'from_date': from_datetime.date().isoformat(),
+            'slots': find_next_available_slots(session,
+                                               from_datetime,
+                                               limit,
+                                               checkup_id=checkup_id or None,
+                                               horizon_days=horizon_days)
+        })
+    except Exception as e:
+        print(f"Error finding next available slots: {str(e)}")
+        return jsonify(
+            {"error":
+             f"Failed to find next available slots. Error: {str(e)}"}), 500
+    finally:
+        session.close()
+
+
+# Live slot availability stream (server-sent events)
+@app.route('/api/slot-availability/stream', methods=['GET'])
+def stream_slot_availability():
+    # Get parameters
+    start_str = request.args.get('start_date')
+    end_str = request.args.get('end_date')
+    checkup_ids = request.args.get('checkup_ids')
+
+    if not start_str or not end_str or not checkup_ids:
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    try:
+        start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_str, "%Y-%m-%d").date()
+        ids = [int(value) for value in checkup_ids.split(',') if value]
+    except ValueError:
+        return jsonify({"error": "Invalid date or checkup_ids format"}), 400
+
+    if (end_date - start_date).days + 1 > MAX_MATRIX_DAYS:
+        return jsonify({
+            "error": f"Date range cannot exceed {MAX_MATRIX_DAYS} days"
+        }), 400
+
+    subscription = slot_events.subscribe(ids, start_date, end_date)
+    if subscription is None:
+        # Streams hold a request thread each; past the cap, clients poll instead
+        response = jsonify({"error": "Too many live availability streams, try again later"})
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER)
+        return response, 503
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            deadline = clock.monotonic() + STREAM_MAX_SECONDS
+            while clock.monotonic() < deadline:
+                try:
+                    event = subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+
+                if event is None:
+                    # Events were dropped; the client reloads the matrix
+                    yield 'event: reload\ndata: {}\n\n'
+                    return
+                yield f'event: slot\ndata: {json.dumps(event)}\n\n'
+        finally:
+            slot_events.unsubscribe(subscription)
+
+    return Response(generate(),
+                    mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    })
+
+
+@app.cli.command('sweep-holds')
+def sweep_holds_command():
+    """Release expired checkout holds (for running from cron)."""
+    session = session_factory()
+    try:
+        released = release_expired_holds(session)
+        session.commit()
+        print(f"Released {len(released)} expired slot hold(s)")
+    finally:
+        session.close()
+
+
+@app.cli.command('backfill-ledger')
+@click.option('--checkup-id', type=int, help='Only backfill this checkup type.')
+def backfill_ledger_command(checkup_id):
+    """Add the upcoming booked slots missing from the capacity ledger (run on deploy)."""
+    session = session_factory()
+    try:
+        backfilled = backfill_slot_ledger(session, date.today(), checkup_id=checkup_id)
+        session.commit()
+        print(f"Backfilled {backfilled} slot capacity ledger row(s)")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = run_migrations(engine)
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.description}")
+    if not applied:
+        print("Schema is up to date")
+    for version, index, used in check_query_plans(engine, applied):
+        if index not in used:
+            print(f"Warning: migration {version} query plan uses "
+                  f"{', '.join(sorted(used)) or 'no index'} instead of {index}")
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the hot queries of every migration and report index use."""
+    for version, index, used in check_query_plans(engine):
+        status = 'ok' if index in used else (
+            f"uses {', '.join(sorted(used))}" if used else 'NOT USED')
+        print(f"{version:>4}  {index:<32} {status}")
+
+
+@app.cli.command('email-worker')
+def email_worker_command():
+    """Deliver queued emails until stopped (run as its own process)."""
+    print("Email worker started")
+    run_email_worker(engine, session_factory)
+
+
+@app.cli.command('drain-emails')
+@click.option('--watch', is_flag=True, help='Keep draining every SPOOL_POLL_SECONDS.')
+@click.option('--workers', default=SPOOL_DRAIN_WORKERS, show_default=True,
+              help='Batches of saved emails sent at the same time.')
+def drain_emails_command(watch, workers):
+    """Send again the emails saved to the emails/ folder."""
+    while True:
+        counts = drain_spool(workers=workers)
+        if counts is None:
+            print("Another drain is already running")
+        else:
+            print(f"Saved emails: {counts['sent']} sent, {counts['failed']} "
+                  f"to retry, {counts['given_up']} given up, "
+                  f"{counts['waiting']} waiting")
+        if not watch:
+            break
+        clock.sleep(SPOOL_POLL_SECONDS)
+
+
+@app.cli.command('send-reminders')
+@click.option('--date', 'reminder_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Day of the appointments to remind (default: tomorrow).')
+@click.option('--workers', default=REMINDER_WORKERS, show_default=True,
+              help='Batches of reminders sent at the same time.')
+def send_reminders_command(reminder_date, workers):
+    """Email reminders for the next day's confirmed appointments (for running from cron)."""
+    counts = send_reminders(engine, session_factory,
+                            reminder_date.date() if reminder_date else None,
+                            workers=workers)
+    if counts is None:
+        print("Reminders are already being sent by another run")
+    else:
+        print(f"Reminders: {counts['sent']} sent, {counts['saved']} saved for later sending"
+              + (f", {counts['errors']} chunk(s) failed" if counts['errors'] else ""))
+
+
+@app.cli.command('maintain-partitions')
+def maintain_partitions_command():
+    """Create appointment partitions for the booking window (for running from cron)."""
+    created = maintain_partitions(engine)
+    for partition in created:
+        print(f"Created appointment partition {partition}")
+    if not created:
+        print("Appointment partitions are up to date")
+
+
+@app.cli.command('archive-appointments')
+@click.option('--keep-months', default=ARCHIVE_AFTER_MONTHS, show_default=True,
+              help='Months before the current one to keep in the live table.')
+def archive_appointments_command(keep_months):
+    """Detach appointment partitions older than the retention period."""
+    archived = archive_partitions(engine, keep_months)
+    for partition in archived:
+        print(f"Archived appointment partition {partition}")
+    if not archived:
+        print("No appointment partitions to archive")
+
+
 # Initialize database with default checkup types if none exist
 def initialize_default_data():
     session = Session()
@@ -2131,14 +2598,14 @@ def initialize_default_data():
             User.username == 'admin').first()
 
         if not admin_user:
-            # Create admin user - using generate_password_hash for secure storage
+            # Create admin user - using hash_password for secure storage
             admin_user = User(user_name='Administrator',
                               gender='Other',
                               birthday=datetime.now().date(),
                               phone_number=1234567890,
                               email='admin@healthassist.com',
                               username='admin',
-                              password=generate_password_hash('admin123'),
+                              password=hash_password('admin123'),
                               user_type='Admin')
 
             session.add(admin_user)
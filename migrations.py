@@ -0,0 +1,526 @@
+"""
+Schema migrations for HealthAssist application
+
+Base.metadata.create_all creates missing tables, but cannot change the
+ones an existing database already has. Migrations evolve the schema in
+place: each one runs once, in version order, and is recorded in the
+schema_migrations table. They run only through flask migrate, as a
+deploy step, never when a worker or command imports the application.
+Statements are SQL strings, functions of the connection for changes SQL
+alone cannot express, ConcurrentIndex for indexes on tables in use, or
+OnlineStep for changes too long to hold one transaction open for.
+They are written to be idempotent, so a fresh database whose tables and
+indexes were just created from the models passes through them
+unchanged.
+
+Index migrations carry the hot queries they serve. check_query_plans
+runs EXPLAIN on those queries and reports whether the planner can use
+the intended index.
+"""
+import json
+import os
+import time as clock
+from datetime import date
+from sqlalchemy import MetaData, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+from models import Appointment
+from partitions import (is_partitioned, ensure_partitions, booking_window,
+                        APPOINTMENTS_TABLE)
+
+# Key of the PostgreSQL advisory lock held while migrating, so deploys
+# running flask migrate together apply each migration exactly once
+MIGRATION_LOCK_KEY = 0x4845414c  # "HEAL"
+
+# Rows copied per transaction when appointments is converted to a partitioned table
+PARTITION_COPY_BATCH_SIZE = int(os.environ.get('PARTITION_COPY_BATCH_SIZE', 5000))
+
+# Seconds the final swap of the converted table waits for its lock, and
+# how many times it tries before giving up
+PARTITION_SWAP_LOCK_TIMEOUT = float(os.environ.get('PARTITION_SWAP_LOCK_TIMEOUT', 5))
+PARTITION_SWAP_ATTEMPTS = int(os.environ.get('PARTITION_SWAP_ATTEMPTS', 20))
+
+# Partitioned copy of appointments, and the trigger keeping it in step, while converting
+PARTITIONED_COPY = f"{APPOINTMENTS_TABLE}_partitioned"
+COPY_TRIGGER = f"{APPOINTMENTS_TABLE}_copy_changes"
+
+# SQLSTATE of lock_timeout expiring
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+class Migration:
+    """One schema change: its statements and the query plans it should enable"""
+
+    def __init__(self, version, description, statements, checks=()):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        # (query, index name) pairs the EXPLAIN check verifies
+        self.checks = checks
+
+
+class ConcurrentIndex:
+    """
+    An index built without blocking writes to its table
+
+    CREATE INDEX CONCURRENTLY cannot run inside a transaction, so the
+    runner builds these on their own, after the other statements of the
+    migration have committed. PostgreSQL cannot build an index on a
+    partitioned table concurrently either: the index is created on the
+    partitioned table alone, then built concurrently on each partition
+    and attached, which makes it valid once every partition has it.
+    """
+
+    def __init__(self, name, table, columns, where=None, unique=False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.unique = unique
+
+    def _definition(self, table):
+        where = f" WHERE {self.where}" if self.where else ''
+        return f"ON {table} ({', '.join(self.columns)}){where}"
+
+    def _build(self, connection, name, table):
+        """Build one index concurrently, replacing an invalid leftover of a failed build"""
+        valid = connection.execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {'name': name}).scalar()
+        if valid:
+            return
+        if valid is not None:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        connection.execute(
+            text(f"CREATE {'UNIQUE ' if self.unique else ''}INDEX CONCURRENTLY "
+                 f"{name} {self._definition(table)}"))
+
+    def build(self, connection):
+        """
+        Build the index
+
+        Args:
+            connection: SQLAlchemy connection in autocommit mode
+        """
+        relkind = connection.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+            {'table': self.table}).scalar()
+        if relkind != 'p':
+            self._build(connection, self.name, self.table)
+            return
+
+        connection.execute(
+            text(f"CREATE {'UNIQUE ' if self.unique else ''}INDEX IF NOT EXISTS "
+                 f"{self.name} {self._definition('ONLY ' + self.table)}"))
+        # Partitions without an index attached to this one yet
+        partitions = connection.execute(
+            text("SELECT c.relname FROM pg_inherits i "
+                 "JOIN pg_class c ON c.oid = i.inhrelid "
+                 "WHERE i.inhparent = to_regclass(:table) AND NOT EXISTS ("
+                 "SELECT 1 FROM pg_inherits x JOIN pg_index ix ON ix.indexrelid = x.inhrelid "
+                 "WHERE x.inhparent = to_regclass(:name) AND ix.indrelid = c.oid) "
+                 "ORDER BY c.relname"),
+            {'table': self.table, 'name': self.name}).scalars().all()
+        for partition in partitions:
+            name = f"{self.name}_{partition.removeprefix(self.table + '_')}"[:63]
+            self._build(connection, name, partition)
+            connection.execute(text(f"ALTER INDEX {self.name} ATTACH PARTITION {name}"))
+
+
+class OnlineStep:
+    """
+    A change too long to run in one transaction, such as copying a table
+
+    Like ConcurrentIndex, it runs after the other statements of the
+    migration have committed, on the autocommit connection holding the
+    migration lock, and opens the short transactions it needs itself.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def build(self, connection):
+        """
+        Run the change
+
+        Args:
+            connection: SQLAlchemy connection in autocommit mode
+        """
+        self.function(connection)
+
+
+def _model_indexes(table, target):
+    """Builders of a model table's indexes on another table, as (final name, ConcurrentIndex)"""
+    dialect = postgresql.dialect()
+    compiler = dialect.statement_compiler(dialect, None)
+    indexes = []
+    for index in table.indexes:
+        where = index.dialect_options['postgresql']['where']
+        if where is not None:
+            where = compiler.process(where, include_table=False, literal_binds=True)
+        indexes.append((index.name, ConcurrentIndex(
+            f"{index.name}_new"[:63], target,
+            [column.name for column in index.columns],
+            where=where, unique=index.unique)))
+    return indexes
+
+
+def _swap_partitioned_copy(connection, indexes):
+    """Replace appointments by its partitioned copy, inside the swap transaction"""
+    connection.execute(
+        text(f"SELECT setval(pg_get_serial_sequence(:table, 'appointment_id'), "
+             f"COALESCE(MAX(appointment_id), 1), MAX(appointment_id) IS NOT NULL) "
+             f"FROM {APPOINTMENTS_TABLE}"),
+        {'table': PARTITIONED_COPY})
+    # Takes the trigger and the old table's sequence and indexes with it
+    connection.execute(text(f"DROP TABLE {APPOINTMENTS_TABLE}"))
+    connection.execute(text(f"DROP FUNCTION {COPY_TRIGGER}()"))
+    connection.execute(text(f"ALTER TABLE {PARTITIONED_COPY} RENAME TO {APPOINTMENTS_TABLE}"))
+
+    # Give the constraints, sequence and indexes the names the model expects
+    constraints = connection.execute(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table)"),
+        {'table': APPOINTMENTS_TABLE}).scalars().all()
+    for name in constraints:
+        if name.startswith(PARTITIONED_COPY + '_'):
+            connection.execute(
+                text(f"ALTER TABLE {APPOINTMENTS_TABLE} RENAME CONSTRAINT {name} "
+                     f"TO {APPOINTMENTS_TABLE}{name.removeprefix(PARTITIONED_COPY)}"))
+    connection.execute(
+        text(f"ALTER SEQUENCE IF EXISTS {PARTITIONED_COPY}_appointment_id_seq "
+             f"RENAME TO {APPOINTMENTS_TABLE}_appointment_id_seq"))
+    for name, index in indexes:
+        connection.execute(text(f"ALTER INDEX {index.name} RENAME TO {name}"))
+
+
+def partition_appointments_table(connection):
+    """
+    Convert an unpartitioned appointments table into a partitioned one, online
+
+    Bookings go on while it runs. The partitioned table is built from the
+    model next to the live one, and a trigger on the live table repeats
+    every change to it. Existing rows are then copied across in batches
+    of PARTITION_COPY_BATCH_SIZE, a transaction each, and the model's
+    indexes are built concurrently. Only the final swap, which drops the
+    old table and renames the copy into place, locks appointments; it
+    waits at most PARTITION_SWAP_LOCK_TIMEOUT seconds for that lock, so
+    it never queues bookings behind a long transaction, and tries again.
+    Does nothing when the table is already partitioned, as it is when
+    create_all made it.
+
+    Args:
+        connection: SQLAlchemy connection in autocommit mode
+    """
+    if is_partitioned(connection):
+        return
+    engine = connection.engine
+    table = Appointment.__table__
+
+    # Start over from whatever an interrupted conversion left behind
+    connection.execute(text(f"DROP TRIGGER IF EXISTS {COPY_TRIGGER} ON {APPOINTMENTS_TABLE}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {PARTITIONED_COPY} CASCADE"))
+    connection.execute(text(f"DROP FUNCTION IF EXISTS {COPY_TRIGGER}()"))
+
+    # Columns added by later migrations are left to their defaults
+    existing = set(connection.execute(
+        text("SELECT column_name FROM information_schema.columns "
+             "WHERE table_schema = current_schema() AND table_name = :table"),
+        {'table': APPOINTMENTS_TABLE}).scalars())
+    names = [column.name for column in table.columns if column.name in existing]
+    columns = ', '.join(names)
+
+    # The copy references the same tables as the model
+    metadata = MetaData()
+    for key in table.foreign_keys:
+        key.column.table.to_metadata(metadata)
+    copy = table.to_metadata(metadata, name=PARTITIONED_COPY)
+
+    with engine.begin() as setup:
+        setup.execute(CreateTable(copy))
+        months = setup.execute(
+            text(f"SELECT DISTINCT date_trunc('month', appointment_date)::date "
+                 f"FROM {APPOINTMENTS_TABLE}")).scalars().all()
+        ensure_partitions(setup, months + booking_window(date.today()),
+                          table=PARTITIONED_COPY)
+        setup.execute(text(
+            f"CREATE FUNCTION {COPY_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN "
+            f"IF TG_OP <> 'INSERT' THEN "
+            f"DELETE FROM {PARTITIONED_COPY} WHERE appointment_id = OLD.appointment_id; "
+            f"END IF; "
+            f"IF TG_OP <> 'DELETE' THEN "
+            f"INSERT INTO {PARTITIONED_COPY} ({columns}) "
+            f"VALUES ({', '.join('NEW.' + name for name in names)}); "
+            f"END IF; "
+            f"RETURN NULL; "
+            f"END $$"))
+        setup.execute(text(
+            f"CREATE TRIGGER {COPY_TRIGGER} AFTER INSERT OR UPDATE OR DELETE "
+            f"ON {APPOINTMENTS_TABLE} FOR EACH ROW EXECUTE FUNCTION {COPY_TRIGGER}()"))
+
+    # Rows written from here on reach the copy through the trigger. Each
+    # batch locks its rows, so a concurrent change lands after it; rows
+    # the trigger already copied are skipped.
+    low, high = connection.execute(
+        text(f"SELECT MIN(appointment_id), MAX(appointment_id) "
+             f"FROM {APPOINTMENTS_TABLE}")).one()
+    copied = 0
+    if low is not None:
+        for start in range(low - 1, high, PARTITION_COPY_BATCH_SIZE):
+            with engine.begin() as batch:
+                copied += batch.execute(
+                    text(f"INSERT INTO {PARTITIONED_COPY} ({columns}) "
+                         f"SELECT {columns} FROM {APPOINTMENTS_TABLE} "
+                         f"WHERE appointment_id > :start AND appointment_id <= :end "
+                         f"FOR SHARE ON CONFLICT DO NOTHING"),
+                    {'start': start, 'end': start + PARTITION_COPY_BATCH_SIZE}).rowcount
+    print(f"Copied {copied} appointment(s) to the partitioned table")
+
+    indexes = _model_indexes(table, PARTITIONED_COPY)
+    for _, index in indexes:
+        index.build(connection)
+
+    for attempt in range(1, PARTITION_SWAP_ATTEMPTS + 1):
+        try:
+            with engine.begin() as swap:
+                swap.execute(text(f"SET LOCAL lock_timeout = "
+                                  f"'{int(PARTITION_SWAP_LOCK_TIMEOUT * 1000)}ms'"))
+                swap.execute(text(f"LOCK TABLE {APPOINTMENTS_TABLE}, {PARTITIONED_COPY} "
+                                  f"IN ACCESS EXCLUSIVE MODE"))
+                _swap_partitioned_copy(swap, indexes)
+            return
+        except OperationalError as e:
+            if (getattr(e.orig, 'pgcode', None) != LOCK_NOT_AVAILABLE
+                    or attempt == PARTITION_SWAP_ATTEMPTS):
+                raise
+            print(f"Appointments table busy, retrying the swap ({attempt}/{PARTITION_SWAP_ATTEMPTS})")
+            clock.sleep(PARTITION_SWAP_LOCK_TIMEOUT)
+
+
+MIGRATIONS = [
+    Migration(1, 'Slot lookup index', [
+        ConcurrentIndex('idx_appointment_slot', APPOINTMENTS_TABLE,
+                        ['appointment_date', 'appointment_time', 'checkup_id']),
+    ], [
+        ("SELECT count(*) FROM appointments WHERE appointment_date = DATE '2030-01-01' "
+         "AND appointment_time = TIME '10:00' AND checkup_id = 1",
+         'idx_appointment_slot'),
+    ]),
+    Migration(2, 'Overlapping bookings per checkup type and day', [
+        ConcurrentIndex('idx_appointment_checkup_day', APPOINTMENTS_TABLE,
+                        ['checkup_id', 'appointment_date', 'appointment_time']),
+    ], [
+        ("SELECT count(*) FROM appointments WHERE checkup_id = 1 "
+         "AND appointment_date = DATE '2030-01-01' "
+         "AND appointment_time > TIME '08:30' AND appointment_time < TIME '11:30'",
+         'idx_appointment_checkup_day'),
+    ]),
+    Migration(3, 'Appointment list paging and filters', [
+        ConcurrentIndex('idx_appointment_keyset', APPOINTMENTS_TABLE,
+                        ['appointment_date', 'appointment_time', 'appointment_id']),
+        ConcurrentIndex('idx_appointment_user_keyset', APPOINTMENTS_TABLE,
+                        ['user_id', 'appointment_date', 'appointment_time', 'appointment_id']),
+        ConcurrentIndex('idx_appointment_status_keyset', APPOINTMENTS_TABLE,
+                        ['status', 'appointment_date', 'appointment_time', 'appointment_id']),
+    ], [
+        ("SELECT appointment_id FROM appointments "
+         "WHERE (appointment_date, appointment_time, appointment_id) > "
+         "(DATE '2030-01-01', TIME '10:00', 1) "
+         "ORDER BY appointment_date, appointment_time, appointment_id LIMIT 101",
+         'idx_appointment_keyset'),
+        ("SELECT appointment_id FROM appointments WHERE user_id = 1 "
+         "ORDER BY appointment_date, appointment_time, appointment_id",
+         'idx_appointment_user_keyset'),
+        ("SELECT appointment_id FROM appointments WHERE status = 'Confirmed' "
+         "ORDER BY appointment_date, appointment_time, appointment_id LIMIT 101",
+         'idx_appointment_status_keyset'),
+    ]),
+    Migration(4, 'Users by type', [
+        ConcurrentIndex('idx_users_user_type', 'users', ['user_type']),
+    ], [
+        ("SELECT user_id FROM users WHERE user_type = 'Normal'",
+         'idx_users_user_type'),
+    ]),
+    Migration(5, 'Slot holds by expiry and by user', [
+        ConcurrentIndex('idx_slot_hold_expiry', 'slot_holds', ['expires_at']),
+        ConcurrentIndex('idx_slot_hold_user', 'slot_holds', ['user_id']),
+    ], [
+        ("SELECT hold_id FROM slot_holds WHERE expires_at < TIMESTAMP '2030-01-01' "
+         "AND appointment_id IS NULL",
+         'idx_slot_hold_expiry'),
+        ("SELECT hold_id FROM slot_holds WHERE user_id = 1 AND appointment_id IS NULL",
+         'idx_slot_hold_user'),
+    ]),
+    Migration(6, 'Partition appointments by month', [
+        OnlineStep(partition_appointments_table),
+    ]),
+    Migration(7, 'Appointment reminders', [
+        "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS reminder_sent_at TIMESTAMP",
+        ConcurrentIndex('idx_appointment_reminder_due', APPOINTMENTS_TABLE,
+                        ['appointment_date', 'appointment_time', 'appointment_id'],
+                        where="status = 'Confirmed' AND reminder_sent_at IS NULL"),
+    ], [
+        ("SELECT appointment_id FROM appointments "
+         "WHERE status = 'Confirmed' AND reminder_sent_at IS NULL "
+         "AND appointment_date = DATE '2030-01-01' "
+         "ORDER BY appointment_time, appointment_id",
+         'idx_appointment_reminder_due'),
+    ]),
+    Migration(8, 'Book each checkout session once', [
+        "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS checkout_session_id VARCHAR(255)",
+        ConcurrentIndex('uq_appointment_checkout_session', APPOINTMENTS_TABLE,
+                        ['checkout_session_id', 'appointment_date'], unique=True),
+    ]),
+]
+
+
+def run_migrations(engine):
+    """
+    Apply the migrations a database has not had yet
+
+    Each migration's statements run in one transaction, so a failing
+    one leaves its changes undone, and its concurrent index builds and
+    online steps run after that commits; it is recorded once all are
+    done. A session advisory lock makes concurrent runs wait for the
+    first to finish.
+
+    Args:
+        engine: SQLAlchemy engine
+
+    Returns:
+        list: Migrations applied by this call
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    applied = []
+    with engine.connect() as lock_connection:
+        # Autocommit, so the lock holder is never idle in a transaction and
+        # can build indexes concurrently
+        lock_connection.execution_options(isolation_level='AUTOCOMMIT')
+        lock_connection.execute(text("SELECT pg_advisory_lock(:key)"),
+                                {'key': MIGRATION_LOCK_KEY})
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                         "version INTEGER PRIMARY KEY, "
+                         "description VARCHAR(255) NOT NULL, "
+                         "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"))
+                done = set(
+                    connection.execute(
+                        text("SELECT version FROM schema_migrations")).scalars())
+
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                if migration.version in done:
+                    continue
+                with engine.begin() as connection:
+                    for statement in migration.statements:
+                        if isinstance(statement, (ConcurrentIndex, OnlineStep)):
+                            continue
+                        if callable(statement):
+                            statement(connection)
+                        else:
+                            connection.execute(text(statement))
+
+                for statement in migration.statements:
+                    if isinstance(statement, (ConcurrentIndex, OnlineStep)):
+                        statement.build(lock_connection)
+
+                with engine.begin() as connection:
+                    connection.execute(
+                        text("INSERT INTO schema_migrations (version, description) "
+                             "VALUES (:version, :description)"),
+                        {'version': migration.version,
+                         'description': migration.description})
+                applied.append(migration)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"),
+                                    {'key': MIGRATION_LOCK_KEY})
+
+    return applied
+
+
+def pending_migrations(engine):
+    """
+    List the migrations a database has not had yet, without applying them
+
+    Args:
+        engine: SQLAlchemy engine
+
+    Returns:
+        list: Pending migrations, in version order
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    with engine.connect() as connection:
+        if connection.execute(
+                text("SELECT to_regclass('schema_migrations')")).scalar() is None:
+            done = set()
+        else:
+            done = set(connection.execute(
+                text("SELECT version FROM schema_migrations")).scalars())
+    return [migration for migration in sorted(MIGRATIONS, key=lambda m: m.version)
+            if migration.version not in done]
+
+
+def _plan_indexes(plan):
+    """Collect the index names used anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= _plan_indexes(child)
+    return names
+
+
+def _parent_index(connection, name):
+    """Follow a partition's index up to the index it was created from on the partitioned table"""
+    while True:
+        parent = connection.execute(
+            text("SELECT p.relname FROM pg_inherits i "
+                 "JOIN pg_class p ON p.oid = i.inhparent "
+                 "WHERE i.inhrelid = to_regclass(:name)"),
+            {'name': name}).scalar()
+        if parent is None:
+            return name
+        name = parent
+
+
+def check_query_plans(engine, migrations=None):
+    """
+    EXPLAIN the hot queries of migrations and check they can use their index
+
+    Sequential scans are disabled for the check, because on small tables
+    the planner rightly prefers them; what matters is whether the index
+    is usable once the table has grown. Without real statistics the
+    planner may still pick another index with the same leading columns,
+    so the indexes it did use are reported alongside. Indexes of
+    partitions are reported under the name of the partitioned table's
+    index they belong to.
+
+    Args:
+        engine: SQLAlchemy engine
+        migrations: Migrations to check, or None for all of them
+
+    Returns:
+        list: (migration version, index name, indexes the plan used) for every check
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    results = []
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for migration in migrations if migrations is not None else MIGRATIONS:
+            for query, index in migration.checks:
+                plan = connection.execute(
+                    text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                used = {_parent_index(connection, name)
+                        for name in _plan_indexes(plan[0]['Plan'])}
+                results.append((migration.version, index, used))
+    return results
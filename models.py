@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Time, ForeignKey, TIMESTAMP, BigInteger, Text, Numeric, func, Index
+from sqlalchemy import Column, Integer, String, Date, Time, ForeignKey, TIMESTAMP, BigInteger, Text, Numeric, JSON, func, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -23,6 +23,11 @@ class User(UserMixin, Base):
     # Relationship with appointments
     appointments = relationship("Appointment", back_populates="user", cascade="all, delete-orphan")
     
+    # Users are listed and counted by type
+    __table_args__ = (
+        Index('idx_users_user_type', 'user_type'),
+    )
+    
     def get_id(self):
         return str(self.user_id)
         
@@ -53,15 +58,22 @@ class CheckupType(Base):
 class Appointment(Base):
     __tablename__ = 'appointments'
     
-    appointment_id = Column(Integer, primary_key=True)
+    # The table is partitioned by month of appointment_date (see partitions.py),
+    # so the date is part of its primary key; rows are still identified by ID alone
+    appointment_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     checkup_id = Column(Integer, ForeignKey('checkup_types.checkup_id'), nullable=False)
     checkup_name = Column(String(100), nullable=False)
-    appointment_date = Column(Date, nullable=False)
+    appointment_date = Column(Date, primary_key=True, nullable=False)
     appointment_time = Column(Time, nullable=False)
     status = Column(String(20), nullable=False, default='Confirmed')
     price_paid = Column(Numeric(10, 2), nullable=False)
     created_at = Column(TIMESTAMP, default=func.now())
+    # When the day-before reminder went out (or was saved for later sending)
+    reminder_sent_at = Column(TIMESTAMP, nullable=True)
+    # Stripe checkout session the appointment was paid through, so the
+    # payment success page books it only once
+    checkout_session_id = Column(String(255), nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="appointments")
@@ -70,12 +82,92 @@ class Appointment(Base):
     # Create an index on date, time, and checkup_id for faster lookups of slot availability
     __table_args__ = (
         Index('idx_appointment_slot', 'appointment_date', 'appointment_time', 'checkup_id'),
+        # Range scans for bookings overlapping a slot of one checkup type on one day
+        Index('idx_appointment_checkup_day', 'checkup_id', 'appointment_date', 'appointment_time'),
+        # Keyset pagination of appointment lists, unfiltered or filtered by user or status
+        Index('idx_appointment_keyset', 'appointment_date', 'appointment_time', 'appointment_id'),
+        Index('idx_appointment_user_keyset', 'user_id', 'appointment_date', 'appointment_time', 'appointment_id'),
+        Index('idx_appointment_status_keyset', 'status', 'appointment_date', 'appointment_time', 'appointment_id'),
+        # One appointment per checkout session (unique indexes of a partitioned
+        # table must include its partition key, which the session fixes anyway)
+        Index('uq_appointment_checkout_session', 'checkout_session_id', 'appointment_date', unique=True),
+        # Confirmed appointments of a day still waiting for their reminder
+        Index('idx_appointment_reminder_due', 'appointment_date', 'appointment_time', 'appointment_id',
+              postgresql_where=text("status = 'Confirmed' AND reminder_sent_at IS NULL")),
+        {'postgresql_partition_by': 'RANGE (appointment_date)'},
     )
+    __mapper_args__ = {'primary_key': [appointment_id]}
     
     def __repr__(self):
         return f"<Appointment(appointment_id={self.appointment_id}, date={self.appointment_date}, time={self.appointment_time})>"
 
 
+class SlotCapacity(Base):
+    __tablename__ = 'slot_capacity'
+    
+    # One ledger row per bookable slot, holding the number of places taken
+    slot_date = Column(Date, primary_key=True)
+    slot_time = Column(Time, primary_key=True)
+    checkup_id = Column(Integer, ForeignKey('checkup_types.checkup_id', ondelete='CASCADE'), primary_key=True)
+    booked = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<SlotCapacity(date={self.slot_date}, time={self.slot_time}, checkup_id={self.checkup_id}, booked={self.booked})>"
+
+
+class SlotHold(Base):
+    __tablename__ = 'slot_holds'
+    
+    # A place taken in the capacity ledger while the patient pays through Stripe
+    hold_id = Column(Integer, primary_key=True)
+    hold_token = Column(String(36), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    checkup_id = Column(Integer, ForeignKey('checkup_types.checkup_id', ondelete='CASCADE'), nullable=False)
+    slot_date = Column(Date, nullable=False)
+    slot_time = Column(Time, nullable=False)
+    expires_at = Column(TIMESTAMP, nullable=False)
+    # Set on holds converted by earlier versions, which kept them; holds are now
+    # deleted on conversion and the sweeper removes the old ones once expired
+    appointment_id = Column(Integer, nullable=True)
+    created_at = Column(TIMESTAMP, default=func.now())
+    
+    # The sweeper looks up expired holds that were never converted, and
+    # deleting a user releases their open holds
+    __table_args__ = (
+        Index('idx_slot_hold_expiry', 'expires_at'),
+        Index('idx_slot_hold_user', 'user_id'),
+    )
+    
+    def __repr__(self):
+        return f"<SlotHold(hold_id={self.hold_id}, date={self.slot_date}, time={self.slot_time}, expires_at={self.expires_at})>"
+
+
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+    
+    # An email written in the same transaction as the change it reports,
+    # delivered afterwards by the email worker (see email_outbox.py)
+    email_id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    recipient = Column(String(100), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(10), nullable=False, default='Pending')  # Pending, Sent or Failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(TIMESTAMP, nullable=False, default=func.now())
+    last_error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP, default=func.now())
+    sent_at = Column(TIMESTAMP, nullable=True)
+    
+    # The worker claims pending emails that are due, oldest first
+    __table_args__ = (
+        Index('idx_email_outbox_due', 'next_attempt_at',
+              postgresql_where=text("status = 'Pending'")),
+    )
+    
+    def __repr__(self):
+        return f"<EmailOutbox(email_id={self.email_id}, kind={self.kind}, status={self.status}, attempts={self.attempts})>"
+
+
 class Specialist(Base):
     __tablename__ = 'specialists'
     
@@ -0,0 +1,267 @@
+"""
+Monthly partitions of the appointments table for HealthAssist application
+
+Appointments are range-partitioned on appointment_date, one partition
+per calendar month, so queries for a booking window only read the
+partitions covering it and old months can be taken out of the live table
+without rewriting it. A default partition catches dates no monthly
+partition exists for yet; when that month's partition is created, its
+rows are moved out of the default partition.
+
+maintain_partitions keeps partitions ready for every month bookings can
+be made in. archive_partitions detaches months older than the retention
+period and moves them to a separate schema, where they stay queryable.
+An existing unpartitioned table is converted by a migration (see
+partition_appointments_table in migrations.py).
+"""
+import os
+import re
+from datetime import date
+from sqlalchemy import text
+
+APPOINTMENTS_TABLE = 'appointments'
+DEFAULT_PARTITION = 'appointments_default'
+
+# Monthly partitions are named appointments_yYYYYmMM
+PARTITION_NAME = re.compile(r'^appointments_y(\d{4})m(\d{2})$')
+
+# Months ahead of the current one that always have a partition; bookings
+# can be made up to a year in advance
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 13))
+
+# Months of appointments kept in the live table before being archived
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', 24))
+
+# Schema detached partitions are moved to
+ARCHIVE_SCHEMA = os.environ.get('APPOINTMENT_ARCHIVE_SCHEMA', 'archive')
+
+# Key of the PostgreSQL advisory lock held while partitions are changed,
+# so concurrent starts and cron runs do not race each other
+PARTITION_LOCK_KEY = 0x41505054  # "APPT"
+
+
+def add_months(month, months):
+    """
+    Get the first day of the month a number of months after another
+
+    Args:
+        month: Any date in the starting month
+        months: Months to move forward (negative to move back)
+
+    Returns:
+        date: First day of the resulting month
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """
+    Get the name of the partition holding a month
+
+    Args:
+        month: Any date in the month
+
+    Returns:
+        str: Partition table name
+    """
+    return f"appointments_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(connection, table=APPOINTMENTS_TABLE):
+    """
+    Check whether the appointments table is partitioned
+
+    Args:
+        connection: SQLAlchemy connection
+        table: Name of the table to check
+
+    Returns:
+        bool: True if the table is a partitioned table
+    """
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {'table': table}).scalar()
+    return relkind == 'p'
+
+
+def partition_months(connection, table=APPOINTMENTS_TABLE):
+    """
+    List the months that have a partition attached to appointments
+
+    Args:
+        connection: SQLAlchemy connection
+        table: Name of the partitioned table
+
+    Returns:
+        list: First day of each partitioned month, in order
+    """
+    names = connection.execute(
+        text("SELECT c.relname FROM pg_inherits i "
+             "JOIN pg_class c ON c.oid = i.inhrelid "
+             "WHERE i.inhparent = to_regclass(:table)"),
+        {'table': table}).scalars()
+
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def _has_default_partition(connection, table):
+    return connection.execute(
+        text("SELECT 1 FROM pg_inherits i "
+             "JOIN pg_class c ON c.oid = i.inhrelid "
+             "WHERE i.inhparent = to_regclass(:table) AND c.relname = :name"),
+        {'table': table, 'name': DEFAULT_PARTITION}).first() is not None
+
+
+def _create_partition(connection, month, table):
+    """
+    Create the partition of one month, moving its rows out of the default partition
+
+    PostgreSQL refuses to create a partition for a range the default
+    partition holds rows for, so those rows are moved across with the
+    default partition detached.
+    """
+    name = partition_name(month)
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    create = (f"CREATE TABLE {name} PARTITION OF {table} "
+              f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')")
+
+    spilled = _has_default_partition(connection, table) and connection.execute(
+        text(f"SELECT 1 FROM {DEFAULT_PARTITION} "
+             "WHERE appointment_date >= :start AND appointment_date < :end LIMIT 1"),
+        bounds).first() is not None
+
+    if not spilled:
+        connection.execute(text(create))
+        return
+
+    connection.execute(
+        text(f"ALTER TABLE {table} DETACH PARTITION {DEFAULT_PARTITION}"))
+    connection.execute(text(create))
+    connection.execute(
+        text(f"INSERT INTO {table} SELECT * FROM {DEFAULT_PARTITION} "
+             "WHERE appointment_date >= :start AND appointment_date < :end"), bounds)
+    connection.execute(
+        text(f"DELETE FROM {DEFAULT_PARTITION} "
+             "WHERE appointment_date >= :start AND appointment_date < :end"), bounds)
+    connection.execute(
+        text(f"ALTER TABLE {table} "
+             f"ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+def ensure_partitions(connection, months, table=APPOINTMENTS_TABLE):
+    """
+    Create the default partition and any missing monthly partitions
+
+    Args:
+        connection: SQLAlchemy connection, inside a transaction
+        months: Iterable of dates, one in each month that needs a partition
+        table: Name of the partitioned table
+
+    Returns:
+        list: Names of the partitions created
+    """
+    created = []
+    if not _has_default_partition(connection, table):
+        connection.execute(
+            text(f"CREATE TABLE {DEFAULT_PARTITION} "
+                 f"PARTITION OF {table} DEFAULT"))
+        created.append(DEFAULT_PARTITION)
+
+    existing = set(partition_months(connection, table))
+    for month in sorted({add_months(month, 0) for month in months}):
+        if month not in existing:
+            _create_partition(connection, month, table)
+            created.append(partition_name(month))
+    return created
+
+
+def booking_window(today):
+    """
+    List the months bookings can currently be made in
+
+    Args:
+        today: Date to count from
+
+    Returns:
+        list: First day of the current month and of the PARTITION_MONTHS_AHEAD after it
+    """
+    current = add_months(today, 0)
+    return [add_months(current, offset) for offset in range(PARTITION_MONTHS_AHEAD + 1)]
+
+
+def maintain_partitions(engine, today=None):
+    """
+    Make sure every month bookings can be made in has a partition
+
+    Args:
+        engine: SQLAlchemy engine
+        today: Date to count from (defaults to today)
+
+    Returns:
+        list: Names of the partitions created
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                           {'key': PARTITION_LOCK_KEY})
+        if not is_partitioned(connection):
+            return []
+        return ensure_partitions(connection, booking_window(today or date.today()))
+
+
+def archive_partitions(engine, keep_months=ARCHIVE_AFTER_MONTHS, today=None):
+    """
+    Detach the partitions of old months and move them to the archive schema
+
+    Archived appointments no longer appear anywhere in the application
+    but stay queryable as ARCHIVE_SCHEMA.appointments_yYYYYmMM. Their
+    foreign keys are dropped, so deleting a user or checkup type is not
+    blocked by history that has left the live table. Old rows still in
+    the default partition are left where they are.
+
+    Args:
+        engine: SQLAlchemy engine
+        keep_months: Months before the current one to keep in the live table
+        today: Date to count from (defaults to today)
+
+    Returns:
+        list: Names of the partitions archived
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    cutoff = add_months(today or date.today(), -keep_months)
+    archived = []
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                           {'key': PARTITION_LOCK_KEY})
+        if not is_partitioned(connection):
+            return []
+
+        old_months = [month for month in partition_months(connection) if month < cutoff]
+        if old_months:
+            connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+
+        for month in old_months:
+            name = partition_name(month)
+            connection.execute(
+                text(f"ALTER TABLE {APPOINTMENTS_TABLE} DETACH PARTITION {name}"))
+            foreign_keys = connection.execute(
+                text("SELECT conname FROM pg_constraint "
+                     "WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+                {'name': name}).scalars().all()
+            for constraint in foreign_keys:
+                connection.execute(
+                    text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+            connection.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            archived.append(name)
+
+    return archived
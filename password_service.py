@@ -0,0 +1,187 @@
+"""
+Password hashing for HealthAssist application
+
+Hashing and verifying passwords is deliberately slow key derivation. It
+runs in a small pool of worker processes rather than in the threads
+serving requests, and only a bounded number of jobs may wait for the
+pool: once it is full, or a job takes longer than PASSWORD_HASH_TIMEOUT,
+callers get PasswordHashBusy and the route answers 503, instead of a
+burst of logins holding every request thread.
+
+Stored passwords are rehashed on login when they were hashed with a
+method other than PASSWORD_HASH_METHOD, which also migrates accounts
+still stored in plaintext.
+"""
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Hash method and cost for new hashes, in werkzeug's full form, e.g.
+# "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# Worker processes hashing passwords, per application process
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+# Jobs allowed to wait for a worker before new ones are rejected
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+
+# Seconds to wait for a hash job before giving up
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 30))
+
+# Seconds clients are asked to wait after a rejection
+PASSWORD_HASH_RETRY_AFTER = 2
+
+# Prefixes of stored passwords that are hashes rather than legacy plaintext
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:', '$2')
+
+
+class PasswordHashBusy(RuntimeError):
+    """Raised when the hashing pool has no room for another job, or a job took too long"""
+
+
+def _verify(stored, password):
+    """Check a password against a stored hash, in a worker process"""
+    try:
+        return check_password_hash(stored, password)
+    except ValueError:
+        # Hashes werkzeug cannot read, such as bcrypt, never match
+        return False
+
+
+class PasswordHashPool:
+    """
+    Process pool for password hashing with a bounded backlog
+
+    Workers come from a forkserver, a clean process started for the
+    purpose, since the application process runs threads (request threads,
+    the slot events listener) that forked children must not inherit. The
+    pool starts on the first job, so commands that never hash a password
+    never start it, and a pool whose worker died is replaced on next use.
+    """
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['werkzeug.security'])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=context)
+            return self._executor
+
+    def run(self, fn, *args):
+        """
+        Run a hashing function in the pool and wait for its result
+
+        Args:
+            fn: Picklable function to run
+            *args: Its arguments
+
+        Returns:
+            The function's result
+
+        Raises:
+            PasswordHashBusy: If the pool and its backlog are full, or the
+                job did not finish within PASSWORD_HASH_TIMEOUT
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashBusy("Password hashing is at capacity")
+        try:
+            future = self._submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A job that timed out keeps its slot until a worker finishes it
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHashBusy("Password hashing timed out")
+        except BrokenProcessPool:
+            self._discard(future.executor)
+            raise
+
+    def _submit(self, fn, *args):
+        """Submit a job, replacing the pool once if a worker of it died"""
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard(executor)
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+        future.executor = executor
+        return future
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
+
+
+def hash_password(password):
+    """
+    Hash a password with the configured method
+
+    Args:
+        password: Plaintext password
+
+    Returns:
+        str: Hash to store
+
+    Raises:
+        PasswordHashBusy: If the hashing pool is saturated
+    """
+    return password_pool.run(generate_password_hash, password,
+                             PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored, password):
+    """
+    Check a password against the stored one
+
+    Accounts created before passwords were hashed still hold plaintext,
+    which is compared directly without using the pool.
+
+    Args:
+        stored: Stored password hash (or legacy plaintext)
+        password: Password given at login
+
+    Returns:
+        bool: True if the password matches
+
+    Raises:
+        PasswordHashBusy: If the hashing pool is saturated
+    """
+    if not stored.startswith(HASH_PREFIXES):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return password_pool.run(_verify, stored, password)
+
+
+def needs_rehash(stored):
+    """
+    Check whether a stored password should be hashed again on login
+
+    Args:
+        stored: Stored password hash (or legacy plaintext)
+
+    Returns:
+        bool: True for plaintext and for hashes made with another method or cost
+    """
+    return stored.split('$', 1)[0] != PASSWORD_HASH_METHOD
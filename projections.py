@@ -0,0 +1,167 @@
+"""
+Column projections and serializers for HealthAssist list endpoints
+
+List endpoints select only the columns they return and build their
+responses from plain rows, instead of loading full ORM entities (with
+password hashes and relationship state) just to copy a few attributes.
+Dates and times are left for the JSON provider (json_provider.py) to
+encode natively. Clients may ask for fewer fields with a fields= query
+parameter, which narrows both the selected columns and the response.
+"""
+from operator import attrgetter
+from sqlalchemy import Numeric
+from models import User, Appointment, CheckupType, Specialist, HealthFact
+
+
+class Projection:
+    """
+    The columns a list endpoint returns and how each is serialized
+
+    Fields are (key, column) pairs; the key is both the row label and the
+    name in the JSON response. Numeric columns are turned into floats
+    here, since a Decimal would otherwise cost a fallback call per value
+    in the JSON encoder; everything else is passed through as selected.
+    """
+
+    def __init__(self, *fields, extra=()):
+        self.fields = fields
+        self.keys = tuple(key for key, _ in fields)
+        # Extra columns are selected after the fields but left out of the response
+        self.columns = tuple(column.label(key) for key, column in fields + tuple(extra))
+        self._numeric = tuple(key for key, column in fields
+                              if isinstance(column.type, Numeric))
+        self._getter = attrgetter(*self.keys)
+        self._subsets = {}
+
+    def select(self, fields, required=()):
+        """
+        Narrow the projection to the fields named in a fields= parameter
+
+        Args:
+            fields: Comma-separated field names, or None/empty for all fields
+            required: Keys that must be selected even if not returned, such
+                as the columns a pagination cursor is built from
+
+        Returns:
+            Projection: Projection returning only the requested fields, in this projection's order
+
+        Raises:
+            ValueError: If a field name is unknown
+        """
+        names = frozenset(name.strip() for name in (fields or '').split(',')
+                          if name.strip())
+        if not names:
+            return self
+
+        unknown = names.difference(self.keys)
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+
+        key = (names, tuple(required))
+        subset = self._subsets.get(key)
+        if subset is None:
+            subset = Projection(
+                *(field for field in self.fields if field[0] in names),
+                extra=[field for field in self.fields
+                       if field[0] in required and field[0] not in names])
+            self._subsets[key] = subset
+        return subset
+
+    def serialize(self, row):
+        """
+        Build the response dict for one selected row
+
+        Args:
+            row: Row selected with this projection's columns
+
+        Returns:
+            dict: JSON-ready values keyed by field
+        """
+        values = dict(zip(self.keys, row))
+        for key in self._numeric:
+            if values[key] is not None:
+                values[key] = float(values[key])
+        return values
+
+    def serialize_object(self, obj):
+        """
+        Build the response dict for an object with the projected attributes
+
+        Args:
+            obj: ORM entity or cached record
+
+        Returns:
+            dict: JSON-ready values keyed by field
+        """
+        values = self._getter(obj)
+        # attrgetter of a single attribute returns the bare value
+        return self.serialize((values,) if len(self.keys) == 1 else values)
+
+
+CHECKUP_TYPE_LIST = Projection(
+    ('checkup_id', CheckupType.checkup_id),
+    ('name', CheckupType.name),
+    ('description', CheckupType.description),
+    ('price', CheckupType.price),
+    ('duration_minutes', CheckupType.duration_minutes),
+    ('max_slots_per_time', CheckupType.max_slots_per_time),
+    ('image_path', CheckupType.image_path),
+    ('is_active', CheckupType.is_active),
+    ('created_at', CheckupType.created_at),
+)
+
+USER_LIST = Projection(
+    ('user_id', User.user_id),
+    ('user_name', User.user_name),
+    ('gender', User.gender),
+    ('email', User.email),
+    ('username', User.username),
+    ('user_type', User.user_type),
+)
+
+# Joined with User for user_name; the checkup name is stored on the appointment
+APPOINTMENT_LIST = Projection(
+    ('appointment_id', Appointment.appointment_id),
+    ('user_id', Appointment.user_id),
+    ('user_name', User.user_name),
+    ('checkup_id', Appointment.checkup_id),
+    ('checkup_name', Appointment.checkup_name),
+    ('appointment_date', Appointment.appointment_date),
+    ('appointment_time', Appointment.appointment_time),
+    ('price_paid', Appointment.price_paid),
+    ('status', Appointment.status),
+    ('created_at', Appointment.created_at),
+)
+
+USER_APPOINTMENT_LIST = Projection(
+    ('appointment_id', Appointment.appointment_id),
+    ('user_id', Appointment.user_id),
+    ('checkup_id', Appointment.checkup_id),
+    ('checkup_name', Appointment.checkup_name),
+    ('appointment_date', Appointment.appointment_date),
+    ('appointment_time', Appointment.appointment_time),
+    ('status', Appointment.status),
+    ('price_paid', Appointment.price_paid),
+    ('created_at', Appointment.created_at),
+)
+
+SPECIALIST_LIST = Projection(
+    ('specialist_id', Specialist.specialist_id),
+    ('name', Specialist.name),
+    ('title', Specialist.title),
+    ('specialization', Specialist.specialization),
+    ('bio', Specialist.bio),
+    ('image_path', Specialist.image_path),
+    ('is_active', Specialist.is_active),
+    ('created_at', Specialist.created_at),
+)
+
+HEALTH_FACT_LIST = Projection(
+    ('fact_id', HealthFact.fact_id),
+    ('title', HealthFact.title),
+    ('content', HealthFact.content),
+    ('category', HealthFact.category),
+    ('is_featured', HealthFact.is_featured),
+    ('is_active', HealthFact.is_active),
+    ('created_at', HealthFact.created_at),
+)
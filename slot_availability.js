@@ -1,16 +1,78 @@
-            // Check slot availability when date, time and checkup type are selected
-            function checkSlotAvailability() {
-                const appointmentDate = document.getElementById("appointment-date").value;
-                const appointmentTime = document.getElementById("appointment-time").value;
-                const checkupId = document.getElementById("appointment-type").value;
-                
-                if (!appointmentDate || !appointmentTime || !checkupId) {
-                    return; // Don't check if any values are missing
+            // Remaining capacity per date and time for the selected checkup type,
+            // loaded for a whole date range at once from /api/slot-availability
+            let slotMatrix = null;
+            let slotStream = null;
+            const SLOT_MATRIX_DAYS = 31;
+            // Milliseconds between reloads while no live stream is available
+            const SLOT_POLL_INTERVAL_MS = 30000;
+
+            // Keep the loaded range up to date from the live availability stream
+            function watchSlotMatrix() {
+                if (slotStream) {
+                    slotStream.close();
                 }
-                
-                const url = `/api/check-slot-availability?date=${appointmentDate}&time=${appointmentTime}&checkup_id=${checkupId}`;
-                
-                fetch(url, {
+                if (!window.EventSource) {
+                    return;
+                }
+
+                const matrix = slotMatrix;
+                const url = `/api/slot-availability/stream?start_date=${matrix.startDate}&end_date=${matrix.endDate}&checkup_ids=${matrix.checkupId}`;
+                slotStream = new EventSource(url, { withCredentials: true });
+
+                slotStream.addEventListener("slot", event => {
+                    const change = JSON.parse(event.data);
+                    const daySlots = matrix.checkup.slots_remaining[change.date];
+                    if (daySlots && change.time in daySlots) {
+                        daySlots[change.time] = Math.max(matrix.checkup.max_slots - change.booked, 0);
+                        applySlotAvailability();
+                    }
+                });
+
+                // The server dropped events for this stream; reload the whole range
+                slotStream.addEventListener("reload", () => {
+                    slotStream.close();
+                    loadSlotMatrix(matrix.checkupId, matrix.startDate)
+                    .then(applySlotAvailability)
+                    .catch(error => {
+                        console.error("Error checking slot availability:", error);
+                    });
+                });
+
+                // The server turned the stream away (it serves a limited number
+                // at once): reload the range a little later, which also tries
+                // streaming again
+                slotStream.addEventListener("error", () => {
+                    if (slotStream.readyState !== EventSource.CLOSED) {
+                        return;
+                    }
+                    setTimeout(() => {
+                        if (slotMatrix !== matrix) {
+                            return;
+                        }
+                        loadSlotMatrix(matrix.checkupId, matrix.startDate)
+                        .then(applySlotAvailability)
+                        .catch(error => {
+                            console.error("Error checking slot availability:", error);
+                        });
+                    }, SLOT_POLL_INTERVAL_MS);
+                });
+            }
+
+            function loadSlotMatrix(checkupId, startDate) {
+                const start = new Date(startDate + "T00:00:00");
+                const end = new Date(start);
+                end.setDate(end.getDate() + SLOT_MATRIX_DAYS - 1);
+                // Local calendar date; toISOString would give the UTC one,
+                // a day early east of UTC
+                const endDate = [
+                    end.getFullYear(),
+                    String(end.getMonth() + 1).padStart(2, "0"),
+                    String(end.getDate()).padStart(2, "0")
+                ].join("-");
+
+                const url = `/api/slot-availability?start_date=${startDate}&end_date=${endDate}&checkup_ids=${checkupId}`;
+
+                return fetch(url, {
                     method: "GET",
                     credentials: "include"
                 })
@@ -23,15 +85,60 @@
                     return response.json();
                 })
                 .then(data => {
-                    if (!data.is_available) {
-                        showError(`This time slot is fully booked. Only ${data.slots_remaining} slots remain out of ${data.max_slots}.`);
-                        document.querySelector(".btn-submit").disabled = true;
-                    } else {
-                        // Clear any error and enable submit button
-                        document.getElementById("error-message").style.display = "none";
-                        document.querySelector(".btn-submit").disabled = false;
-                    }
-                })
+                    slotMatrix = {
+                        checkupId: checkupId,
+                        startDate: data.start_date,
+                        endDate: data.end_date,
+                        checkup: data.checkups[0]
+                    };
+                    watchSlotMatrix();
+                    return slotMatrix;
+                });
+            }
+
+            // Grey out fully booked time slots and check the selected one
+            function applySlotAvailability() {
+                const appointmentDate = document.getElementById("appointment-date").value;
+                const timeSelect = document.getElementById("appointment-time");
+                const daySlots = slotMatrix && slotMatrix.checkup ? slotMatrix.checkup.slots_remaining[appointmentDate] : null;
+
+                for (let i = 1; i < timeSelect.options.length; i++) {
+                    const option = timeSelect.options[i];
+                    option.disabled = daySlots ? daySlots[option.value] === 0 : false;
+                }
+
+                if (!daySlots || !timeSelect.value) {
+                    return;
+                }
+
+                if (daySlots[timeSelect.value] === 0) {
+                    showError("This time slot is fully booked. Please choose another time.");
+                    document.querySelector(".btn-submit").disabled = true;
+                } else {
+                    // Clear any error and enable submit button
+                    document.getElementById("error-message").style.display = "none";
+                    document.querySelector(".btn-submit").disabled = false;
+                }
+            }
+
+            // Check slot availability when date, time and checkup type are selected
+            function checkSlotAvailability() {
+                const appointmentDate = document.getElementById("appointment-date").value;
+                const checkupId = document.getElementById("appointment-type").value;
+                
+                if (!appointmentDate || !checkupId) {
+                    return; // Don't check if any values are missing
+                }
+
+                // Only go back to the server when the cached range does not cover the selection
+                if (slotMatrix && slotMatrix.checkupId === checkupId &&
+                    appointmentDate >= slotMatrix.startDate && appointmentDate <= slotMatrix.endDate) {
+                    applySlotAvailability();
+                    return;
+                }
+
+                loadSlotMatrix(checkupId, appointmentDate)
+                .then(applySlotAvailability)
                 .catch(error => {
                     console.error("Error checking slot availability:", error);
                 });
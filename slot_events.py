@@ -0,0 +1,179 @@
+"""
+Live slot capacity events for HealthAssist application
+
+Ledger changes are published with PostgreSQL NOTIFY inside the booking
+transaction, so they are only delivered once the booking commits. Each
+worker process runs one LISTEN thread that fans the events out to the
+streams it is serving and keeps its slot occupancy cache up to date. The
+same thread drops the catalog and user caches when another worker
+changes them.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time as clock
+from datetime import date, time
+from slot_service import SLOT_CHANNEL, slot_cache
+from catalog_service import CATALOG_CHANNEL, CATALOGS, invalidate_catalog
+from user_cache import USER_CHANNEL, user_cache
+
+# Events buffered per stream before the client is told to reload instead
+STREAM_QUEUE_SIZE = 100
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Seconds before a stream is closed; EventSource reconnects on its own
+STREAM_MAX_SECONDS = int(os.environ.get('SLOT_STREAM_MAX_SECONDS', 300))
+
+# Streams served at once per worker process. Each holds a request thread
+# for its whole life, so this must stay well below the gunicorn thread
+# count or open booking pages starve every other route.
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('SLOT_STREAM_MAX_PER_WORKER', 4))
+
+# Seconds a client turned away at capacity is asked to wait; the booking
+# page polls the availability matrix meanwhile
+STREAM_RETRY_AFTER = 30
+
+
+class Subscription:
+    """Slot events for one stream, filtered by checkup type and date range"""
+
+    def __init__(self, checkup_ids, start_date, end_date):
+        self.checkup_ids = set(checkup_ids)
+        self.start_date = start_date.isoformat()
+        self.end_date = end_date.isoformat()
+        self.events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def matches(self, event):
+        return (event['checkup_id'] in self.checkup_ids
+                and self.start_date <= event['date'] <= self.end_date)
+
+    def put(self, event):
+        """Queue an event; a full queue is replaced by a single reload marker"""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            with self.events.mutex:
+                self.events.queue.clear()
+            self.events.put_nowait(None)
+
+    def get(self, timeout):
+        """Wait for the next event; None means the client should reload"""
+        return self.events.get(timeout=timeout)
+
+
+class SlotEventBroker:
+    """Per-process LISTEN thread and the streams subscribed to it"""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._engine = None
+
+    def start(self, engine):
+        """
+        Start the LISTEN thread for this process if it is not running
+
+        Safe to call on every request: gunicorn workers forked from a
+        preloaded app get their own thread on first use.
+        """
+        if self._pid == os.getpid() or engine.dialect.name != 'postgresql':
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._engine = engine
+            self._subscriptions = set()
+            thread = threading.Thread(target=self._listen,
+                                      name='slot-events',
+                                      daemon=True)
+            thread.start()
+
+    def subscribe(self, checkup_ids, start_date, end_date):
+        """
+        Open a stream subscription
+
+        Returns:
+            Subscription: The subscription, or None if this process already
+                serves STREAM_MAX_SUBSCRIBERS streams
+        """
+        subscription = Subscription(checkup_ids, start_date, end_date)
+        with self._lock:
+            if len(self._subscriptions) >= STREAM_MAX_SUBSCRIBERS:
+                return None
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def dispatch(self, event):
+        """Apply an event to the local cache and fan it out to the streams"""
+        slot_cache.set((date.fromisoformat(event['date']),
+                        time.fromisoformat(event['time']),
+                        event['checkup_id']), event['booked'])
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            connection = None
+            try:
+                # Detach the connection so LISTEN does not tie up a pool slot
+                connection = self._engine.raw_connection()
+                pg_connection = connection.driver_connection
+                connection.detach()
+                pg_connection.autocommit = True
+                with pg_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {SLOT_CHANNEL}")
+                    cursor.execute(f"LISTEN {CATALOG_CHANNEL}")
+                    cursor.execute(f"LISTEN {USER_CHANNEL}")
+                # Changes may have been missed while the listener was down
+                invalidate_catalog()
+                user_cache.invalidate()
+                backoff = 1
+
+                while True:
+                    if select.select([pg_connection], [], [], 30) == ([], [], []):
+                        continue
+                    pg_connection.poll()
+                    while pg_connection.notifies:
+                        notify = pg_connection.notifies.pop(0)
+                        if notify.channel == CATALOG_CHANNEL:
+                            invalidate_catalog(notify.payload
+                                               if notify.payload in CATALOGS
+                                               else None)
+                            continue
+                        if notify.channel == USER_CHANNEL:
+                            user_cache.invalidate(int(notify.payload)
+                                                  if notify.payload.isdigit()
+                                                  else None)
+                            continue
+                        try:
+                            self.dispatch(json.loads(notify.payload))
+                        except (ValueError, KeyError) as e:
+                            print(f"Ignoring malformed slot event: {str(e)}")
+            except Exception as e:
+                print(f"Slot event listener error: {str(e)}")
+                clock.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+slot_events = SlotEventBroker()
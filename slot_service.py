@@ -0,0 +1,733 @@
+"""
+Slot availability utilities for HealthAssist application
+"""
+import json
+import os
+import threading
+import time as clock
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import (func, select, update, delete, literal, union_all,
+                        values, column, cast, and_, true, tuple_, Date, Time)
+from sqlalchemy.dialects.postgresql import insert
+from models import Appointment, SlotCapacity, SlotHold, CheckupType
+from catalog_service import checkup_catalog
+
+# Time slots offered on the booking page (user_appointment.html)
+TIME_SLOTS = [
+    time(9, 0),
+    time(10, 0),
+    time(11, 0),
+    time(13, 0),
+    time(14, 0),
+    time(15, 0),
+    time(16, 0),
+]
+
+# Largest date range a single availability matrix request may cover
+MAX_MATRIX_DAYS = 62
+
+# Seconds a cached slot count is trusted. Each gunicorn worker keeps its own
+# cache, so this bounds how long bookings made in another worker go unseen.
+SLOT_CACHE_TTL = float(os.environ.get('SLOT_CACHE_TTL', 5))
+
+
+class SlotOccupancyCache:
+    """
+    Per-process cache of booked appointment counts
+
+    Entries are keyed by (appointment_date, appointment_time, checkup_id),
+    populated lazily on read, dropped after this worker commits a booking
+    change and refreshed from ledger change events (see slot_events.py).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached count for a slot, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            count, expires_at = entry
+            if expires_at < clock.monotonic():
+                del self._entries[key]
+                return None
+            return count
+
+    def set(self, key, count):
+        """Store the booked count for a slot"""
+        with self._lock:
+            self._entries[key] = (count, clock.monotonic() + self.ttl)
+
+    def invalidate(self, key):
+        """Drop a slot from the cache"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every cached slot"""
+        with self._lock:
+            self._entries.clear()
+
+
+# Minutes a Stripe checkout session stays open. Stripe requires at least 30.
+CHECKOUT_SESSION_MINUTES = int(os.environ.get('CHECKOUT_SESSION_MINUTES', 31))
+
+# Extra minutes a slot hold outlives its checkout session, so a payment made
+# at the last moment still finds its hold in payment_success
+SLOT_HOLD_GRACE_MINUTES = int(os.environ.get('SLOT_HOLD_GRACE_MINUTES', 5))
+
+# Seconds between sweeps for expired slot holds in each worker
+HOLD_SWEEP_INTERVAL = float(os.environ.get('HOLD_SWEEP_INTERVAL', 60))
+
+# PostgreSQL NOTIFY channel carrying ledger changes (see slot_events.py)
+SLOT_CHANNEL = 'slot_changes'
+
+# Days ahead searched for open slots by default, and at most
+NEXT_SLOTS_HORIZON_DAYS = 90
+MAX_NEXT_SLOTS_HORIZON_DAYS = 366
+
+# Ledger rows written per INSERT when backfilling
+BACKFILL_BATCH_SIZE = 500
+
+
+slot_cache = SlotOccupancyCache(SLOT_CACHE_TTL)
+
+
+def slot_keys(appointment_time, duration_minutes):
+    """
+    Get the ledger slots a booking takes a place in
+
+    A booking occupies every offered slot that starts less than one
+    checkup duration before or after it, so a 90 minute checkup at 10:00
+    also counts against 09:00 and 11:00. Off-grid bookings also keep a
+    ledger row at their own start time.
+
+    Args:
+        appointment_time: Start of the booking (time object)
+        duration_minutes: Duration of the checkup type
+
+    Returns:
+        list: Slot start times (time objects) in ascending order
+    """
+    window = duration_minutes * 60
+    start = _seconds(appointment_time)
+    keys = {slot for slot in TIME_SLOTS if abs(_seconds(slot) - start) < window}
+    keys.add(appointment_time)
+    return sorted(keys)
+
+
+def count_overlapping(starts, slot_time, duration_minutes):
+    """
+    Count bookings overlapping a slot from their sorted start times
+
+    Args:
+        starts: Booking start times in seconds since midnight, sorted ascending
+        slot_time: Start of the slot (time object)
+        duration_minutes: Duration of the checkup type
+
+    Returns:
+        int: Number of bookings starting less than one duration from the slot
+    """
+    window = duration_minutes * 60
+    start = _seconds(slot_time)
+    return bisect_left(starts, start + window) - bisect_right(starts, start - window)
+
+
+def _seconds(slot_time):
+    return slot_time.hour * 3600 + slot_time.minute * 60 + slot_time.second
+
+
+def _overlaps(column, slot_time, duration_minutes):
+    """Range condition on a start time column, usable by a btree index"""
+    start = datetime.combine(date.today(), slot_time)
+    window = timedelta(minutes=duration_minutes)
+    conditions = []
+    if (start - window).date() == start.date():
+        conditions.append(column > (start - window).time())
+    if (start + window).date() == start.date():
+        conditions.append(column < (start + window).time())
+    return and_(true(), *conditions)
+
+
+def _duration(session, checkup_id):
+    """Duration of a checkup type in minutes, or None if it no longer exists"""
+    checkup = checkup_catalog.get(session, checkup_id)
+    return checkup.duration_minutes if checkup else None
+
+
+def _overlapping_count(slot_date, slot_time, checkup_id, duration_minutes):
+    """
+    Count appointments and unconverted holds overlapping a slot
+
+    Both counts are range scans over (checkup_id, date, time) indexes.
+    """
+    appointments = select(func.count(Appointment.appointment_id)).where(
+        Appointment.checkup_id == checkup_id,
+        Appointment.appointment_date == slot_date,
+        _overlaps(Appointment.appointment_time, slot_time,
+                  duration_minutes)).scalar_subquery()
+    holds = select(func.count(SlotHold.hold_id)).where(
+        SlotHold.checkup_id == checkup_id, SlotHold.slot_date == slot_date,
+        SlotHold.appointment_id.is_(None),
+        _overlaps(SlotHold.slot_time, slot_time,
+                  duration_minutes)).scalar_subquery()
+    return appointments + holds
+
+
+def get_booked_count(session, appointment_date, appointment_time, checkup_id,
+                     refresh=False):
+    """
+    Get the number of bookings overlapping a slot
+
+    Args:
+        session: Database session
+        appointment_date: Date of the slot (date object)
+        appointment_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+        refresh: Bypass the cache and re-read the count from the database
+
+    Returns:
+        int: Number of places taken in the slot
+    """
+    key = (appointment_date, appointment_time, int(checkup_id))
+    if not refresh:
+        count = slot_cache.get(key)
+        if count is not None:
+            return count
+
+    # The ledger row is authoritative once the slot has been booked through it
+    count = session.query(SlotCapacity.booked).filter(
+        SlotCapacity.slot_date == appointment_date,
+        SlotCapacity.slot_time == appointment_time,
+        SlotCapacity.checkup_id == int(checkup_id)).scalar()
+
+    if count is None:
+        duration = _duration(session, checkup_id)
+        # A deleted checkup type took its appointments and holds with it
+        if duration is None:
+            return 0
+        count = session.execute(
+            select(
+                _overlapping_count(appointment_date, appointment_time,
+                                   int(checkup_id), duration))).scalar()
+
+    slot_cache.set(key, count)
+    return count
+
+
+def publish_slot_change(session, slot_date, slot_time, checkup_id, booked):
+    """
+    Queue a ledger change for delivery when the transaction commits
+
+    Args:
+        session: Database session
+        slot_date: Date of the slot (date object)
+        slot_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+        booked: Places taken in the slot after the change
+    """
+    payload = json.dumps({
+        'date': slot_date.isoformat(),
+        'time': slot_time.isoformat(),
+        'checkup_id': int(checkup_id),
+        'booked': booked
+    })
+    session.execute(select(func.pg_notify(SLOT_CHANNEL, payload)))
+
+
+def _seed_ledger(session, slot_date, keys, checkup_id, duration_minutes):
+    """
+    Create missing ledger rows, seeded from the bookings already on file
+
+    The rows are inserted and committed on a separate connection, so the
+    booking transaction only ever locks existing rows, in slot order.
+    """
+    existing = set(session.execute(
+        select(SlotCapacity.slot_time).where(
+            SlotCapacity.slot_date == slot_date,
+            SlotCapacity.checkup_id == checkup_id,
+            SlotCapacity.slot_time.in_(keys))).scalars())
+    missing = [key for key in keys if key not in existing]
+    if not missing:
+        return
+
+    seed = union_all(*[
+        select(literal(slot_date), literal(key), literal(checkup_id),
+               _overlapping_count(slot_date, key, checkup_id,
+                                  duration_minutes)) for key in missing
+    ])
+    stmt = insert(SlotCapacity).from_select(
+        ['slot_date', 'slot_time', 'checkup_id', 'booked'],
+        seed).on_conflict_do_nothing()
+    with session.get_bind().begin() as connection:
+        connection.execute(stmt)
+
+
+def _lock_ledger(session, ledger_keys):
+    """
+    Lock ledger rows in key order, in a single pass, and return their counts
+
+    Args:
+        session: Database session
+        ledger_keys: (slot_date, slot_time, checkup_id) of the rows to lock
+
+    Returns:
+        dict: Places taken, keyed by (slot_date, slot_time, checkup_id)
+    """
+    key = tuple_(SlotCapacity.slot_date, SlotCapacity.slot_time,
+                 SlotCapacity.checkup_id)
+    rows = session.execute(
+        select(SlotCapacity.slot_date, SlotCapacity.slot_time,
+               SlotCapacity.checkup_id, SlotCapacity.booked).where(
+                   key.in_(sorted(ledger_keys))).order_by(
+                       SlotCapacity.slot_date, SlotCapacity.slot_time,
+                       SlotCapacity.checkup_id).with_for_update()).all()
+    return {(row.slot_date, row.slot_time, row.checkup_id): row.booked
+            for row in rows}
+
+
+def move_slots(session, release=(), reserve=(), max_slots=None):
+    """
+    Give back and take places in several slots under one set of ledger locks
+
+    Every ledger row involved is locked in one pass in key order, so
+    requests moving bookings between the same slots in opposite
+    directions queue up instead of deadlocking. Places given back count
+    before the reserved slots are checked, so a move to an overlapping
+    slot does not count against itself. Releases for a deleted checkup
+    type are skipped, as its ledger rows were deleted with it. Runs in the
+    caller's transaction; rolling it back undoes every change.
+
+    Args:
+        session: Database session
+        release: (date, time, checkup_id) of each booking giving back its places
+        reserve: (date, time, checkup_id) of each booking taking places
+        max_slots: Capacity checked for the reserved slots, or None to book without a limit
+
+    Returns:
+        dict: Places taken afterwards, keyed by (date, time, checkup_id) of
+            every ledger row involved, or None if a reserved slot is full
+            (nothing is changed) or the checkup type of a reserved slot
+            no longer exists
+    """
+    released = {}
+    reserved = {}
+    for bookings, changes in ((release, released), (reserve, reserved)):
+        for slot_date, slot_time, checkup_id in bookings:
+            checkup_id = int(checkup_id)
+            duration = _duration(session, checkup_id)
+            if duration is None:
+                if changes is reserved:
+                    return None
+                continue
+            keys = slot_keys(slot_time, duration)
+            if changes is reserved:
+                _seed_ledger(session, slot_date, keys, checkup_id, duration)
+            for key in keys:
+                ledger_key = (slot_date, key, checkup_id)
+                changes[ledger_key] = changes.get(ledger_key, 0) + 1
+
+    booked = _lock_ledger(session, released.keys() | reserved.keys())
+    after = {ledger_key: max(count - released.get(ledger_key, 0), 0) +
+             reserved.get(ledger_key, 0)
+             for ledger_key, count in booked.items()}
+    if max_slots is not None and any(after[ledger_key] > max_slots
+                                     for ledger_key in reserved
+                                     if ledger_key in after):
+        return None
+
+    for (slot_date, slot_time, checkup_id), count in after.items():
+        if count == booked[(slot_date, slot_time, checkup_id)]:
+            continue
+        session.execute(
+            update(SlotCapacity).where(
+                SlotCapacity.slot_date == slot_date,
+                SlotCapacity.slot_time == slot_time,
+                SlotCapacity.checkup_id == checkup_id).values(booked=count))
+        publish_slot_change(session, slot_date, slot_time, checkup_id, count)
+    return after
+
+
+def reserve_slot(session, appointment_date, appointment_time, checkup_id,
+                 max_slots=None):
+    """
+    Take one place in every slot a booking overlaps through the capacity ledger
+
+    The overlapped ledger rows are locked in slot order, checked and
+    incremented together, so concurrent bookings cannot both see a free
+    place and overlapping bookings queue up instead of deadlocking. Runs
+    in the caller's transaction; rolling it back gives the places back.
+
+    Args:
+        session: Database session
+        appointment_date: Date of the slot (date object)
+        appointment_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+        max_slots: Capacity of the slot, or None to book without a limit
+
+    Returns:
+        int: Places taken in the booked slot afterwards, or None if any
+            overlapped slot is full or the checkup type no longer exists
+    """
+    booking = (appointment_date, appointment_time, int(checkup_id))
+    after = move_slots(session, reserve=[booking], max_slots=max_slots)
+    return None if after is None else after.get(booking)
+
+
+def release_slot(session, appointment_date, appointment_time, checkup_id):
+    """
+    Give back the places a booking took through the capacity ledger
+
+    Args:
+        session: Database session
+        appointment_date: Date of the slot (date object)
+        appointment_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+    """
+    move_slots(session, release=[(appointment_date, appointment_time, checkup_id)])
+
+
+def invalidate_booked_count(appointment_date, appointment_time, checkup_id):
+    """
+    Drop the cached counts of a day after a committed booking change
+
+    Every slot of the day is dropped, since a booking counts against all
+    the slots its checkup overlaps. The new counts arrive with the ledger
+    change events, or are re-read on the next lookup if those events have
+    not been delivered yet.
+
+    Args:
+        appointment_date: Date of the slot (date object)
+        appointment_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+    """
+    for slot in TIME_SLOTS + [appointment_time]:
+        slot_cache.invalidate((appointment_date, slot, int(checkup_id)))
+
+
+def create_hold(session, user_id, appointment_date, appointment_time, checkup_id,
+                max_slots, checkout_expires_at):
+    """
+    Hold a place in a slot while the patient pays
+
+    Args:
+        session: Database session
+        user_id: ID of the user checking out
+        appointment_date: Date of the slot (date object)
+        appointment_time: Time of the slot (time object)
+        checkup_id: ID of the checkup type
+        max_slots: Capacity of the slot
+        checkout_expires_at: When the Stripe checkout session expires (datetime)
+
+    Returns:
+        SlotHold: The new hold, or None if the slot is full
+    """
+    if reserve_slot(session, appointment_date, appointment_time, checkup_id,
+                    max_slots=max_slots) is None:
+        return None
+
+    hold = SlotHold(hold_token=uuid.uuid4().hex,
+                    user_id=user_id,
+                    checkup_id=int(checkup_id),
+                    slot_date=appointment_date,
+                    slot_time=appointment_time,
+                    expires_at=checkout_expires_at +
+                    timedelta(minutes=SLOT_HOLD_GRACE_MINUTES))
+    session.add(hold)
+    session.flush()
+    return hold
+
+
+def release_hold(session, hold):
+    """
+    Delete an unconverted hold and give its place back
+
+    Args:
+        session: Database session
+        hold: SlotHold to release
+    """
+    release_slot(session, hold.slot_date, hold.slot_time, hold.checkup_id)
+    session.delete(hold)
+
+
+def release_expired_holds(session):
+    """
+    Delete expired holds that were never converted and give their places back
+
+    Args:
+        session: Database session
+
+    Returns:
+        list: (date, time, checkup_id) of every released slot
+    """
+    expired = session.execute(
+        delete(SlotHold).where(
+            SlotHold.expires_at < datetime.now(),
+            SlotHold.appointment_id.is_(None)).returning(
+                SlotHold.slot_date, SlotHold.slot_time,
+                SlotHold.checkup_id)).all()
+
+    slots = [tuple(row) for row in expired]
+    move_slots(session, release=slots)
+
+    # Holds converted by earlier versions, which kept them, hold no place
+    session.execute(
+        delete(SlotHold).where(SlotHold.expires_at < datetime.now(),
+                               SlotHold.appointment_id.isnot(None)))
+    return slots
+
+
+_last_hold_sweep = 0.0
+_hold_sweep_lock = threading.Lock()
+
+
+def hold_sweep_due():
+    """
+    Check whether this worker should sweep expired holds now
+
+    Returns:
+        bool: True at most once every HOLD_SWEEP_INTERVAL seconds
+    """
+    global _last_hold_sweep
+    with _hold_sweep_lock:
+        now = clock.monotonic()
+        if now - _last_hold_sweep < HOLD_SWEEP_INTERVAL:
+            return False
+        _last_hold_sweep = now
+        return True
+
+
+def _booking_starts(session, start_date, end_date, checkup_ids):
+    """
+    Collect the sorted start times of bookings per day and checkup type
+
+    Holds count until they are converted or released, as in the ledger,
+    expired or not.
+
+    Returns:
+        dict: (date, checkup_id) -> start times in seconds since midnight, ascending
+    """
+    holds = [
+        SlotHold.slot_date >= start_date,
+        SlotHold.checkup_id.in_(checkup_ids),
+        SlotHold.appointment_id.is_(None)
+    ]
+    appointments = [
+        Appointment.appointment_date >= start_date,
+        Appointment.checkup_id.in_(checkup_ids)
+    ]
+    if end_date is not None:
+        holds.append(SlotHold.slot_date <= end_date)
+        appointments.append(Appointment.appointment_date <= end_date)
+
+    taken = union_all(
+        select(Appointment.appointment_date.label('slot_date'),
+               Appointment.appointment_time.label('slot_time'),
+               Appointment.checkup_id).where(*appointments),
+        select(SlotHold.slot_date, SlotHold.slot_time,
+               SlotHold.checkup_id).where(*holds)).subquery()
+
+    starts = {}
+    for row in session.execute(
+            select(taken).order_by(taken.c.slot_date, taken.c.checkup_id,
+                                   taken.c.slot_time)):
+        starts.setdefault((row.slot_date, row.checkup_id),
+                          []).append(_seconds(row.slot_time))
+    return starts
+
+
+def get_availability_matrix(session, start_date, end_date, checkups):
+    """
+    Build the remaining capacity for every slot in a date range
+
+    Bookings and unconverted slot holds in the range are fetched once in
+    start order; each slot then counts the bookings overlapping it with two
+    binary searches, so a slot costs O(log n) however busy the day is.
+    Holds are counted as the capacity ledger counts them, so the matrix
+    agrees with the booked values of live slot events; expired holds drop
+    out once sweep_expired_holds releases them.
+
+    Args:
+        session: Database session
+        start_date: First date of the range (date object)
+        end_date: Last date of the range, inclusive (date object)
+        checkups: CheckupType or CheckupRecord objects to report on
+
+    Returns:
+        list: One dict per checkup type with the remaining slots per date and time
+    """
+    checkup_ids = [checkup.checkup_id for checkup in checkups]
+    if not checkup_ids:
+        return []
+
+    starts = _booking_starts(session, start_date, end_date, checkup_ids)
+
+    dates = [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+    ]
+
+    matrix = []
+    for checkup in checkups:
+        slots = {}
+        for day in dates:
+            day_starts = starts.get((day, checkup.checkup_id), [])
+            slots[day.isoformat()] = {
+                slot.isoformat():
+                max(checkup.max_slots_per_time -
+                    count_overlapping(day_starts, slot,
+                                      checkup.duration_minutes), 0)
+                for slot in TIME_SLOTS
+            }
+        matrix.append({
+            'checkup_id': checkup.checkup_id,
+            'checkup_name': checkup.name,
+            'max_slots': checkup.max_slots_per_time,
+            'slots_remaining': slots
+        })
+
+    return matrix
+
+
+def backfill_slot_ledger(session, from_date, checkup_id=None):
+    """
+    Create or correct ledger rows for the slots upcoming bookings overlap
+
+    Appointments made before the ledger existed only get rows on their
+    slot's next booking, and rows written before bookings counted their
+    duration only hold exact-time counts. Backfilling upcoming slots lets
+    searches read occupancy from the ledger alone. Existing counts are
+    only ever raised, never lowered.
+
+    Args:
+        session: Database session
+        from_date: First date to backfill (date object)
+        checkup_id: Only backfill this checkup type, or None for all of them
+
+    Returns:
+        int: Number of ledger rows created or corrected
+    """
+    query = session.query(CheckupType.checkup_id, CheckupType.duration_minutes)
+    if checkup_id is not None:
+        query = query.filter(CheckupType.checkup_id == int(checkup_id))
+    durations = dict(query.all())
+    if not durations:
+        return 0
+
+    starts = _booking_starts(session, from_date, None, list(durations))
+
+    rows = []
+    for (day, day_checkup_id), day_starts in starts.items():
+        duration = durations[day_checkup_id]
+        keys = set()
+        for start in set(day_starts):
+            keys.update(slot_keys(_time_of(start), duration))
+        for key in sorted(keys):
+            rows.append({
+                'slot_date': day,
+                'slot_time': key,
+                'checkup_id': day_checkup_id,
+                'booked': count_overlapping(day_starts, key, duration)
+            })
+
+    changed = 0
+    for offset in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        stmt = insert(SlotCapacity).values(rows[offset:offset +
+                                                BACKFILL_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['slot_date', 'slot_time', 'checkup_id'],
+            set_={'booked': stmt.excluded.booked},
+            where=SlotCapacity.booked < stmt.excluded.booked)
+        changed += session.execute(stmt).rowcount
+    return changed
+
+
+def rebuild_slot_ledger(session, checkup_id, from_date):
+    """
+    Recount the upcoming ledger rows of a checkup type
+
+    Needed when its duration changes, since that changes which slots each
+    booking overlaps. Runs in the caller's transaction.
+
+    Args:
+        session: Database session
+        checkup_id: ID of the checkup type
+        from_date: First date to rebuild (date object)
+
+    Returns:
+        int: Number of ledger rows written
+    """
+    session.execute(
+        delete(SlotCapacity).where(SlotCapacity.checkup_id == int(checkup_id),
+                                   SlotCapacity.slot_date >= from_date))
+    return backfill_slot_ledger(session, from_date, checkup_id=checkup_id)
+
+
+def _time_of(seconds):
+    return time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def find_next_available_slots(session, from_datetime, limit, checkup_id=None,
+                              horizon_days=NEXT_SLOTS_HORIZON_DAYS):
+    """
+    Find the earliest open slots from a point in time onward
+
+    Candidate slots (every date in the horizon x TIME_SLOTS x active
+    checkup type) are generated in SQL and anti-joined against the
+    capacity ledger, so the search is a single query that stops at the
+    first `limit` open slots.
+
+    Args:
+        session: Database session
+        from_datetime: Only slots starting after this moment are returned (datetime)
+        limit: Maximum number of slots to return
+        checkup_id: Restrict the search to one checkup type, or None for all active ones
+        horizon_days: Number of days ahead to search
+
+    Returns:
+        list: Dicts with date, time, checkup_id, checkup_name and slots_remaining
+    """
+    start_date = from_datetime.date()
+    end_date = start_date + timedelta(days=horizon_days - 1)
+
+    days = func.generate_series(start_date, end_date,
+                                timedelta(days=1)).table_valued(
+                                    'slot_day').render_derived(name='days')
+    slot_date = cast(days.c.slot_day, Date)
+    times = values(column('slot_time', Time), name='times').data([
+        (slot, ) for slot in TIME_SLOTS
+    ])
+    booked = func.coalesce(SlotCapacity.booked, 0)
+
+    query = select(
+        slot_date.label('slot_date'), times.c.slot_time,
+        CheckupType.checkup_id, CheckupType.name,
+        (CheckupType.max_slots_per_time - booked).label('slots_remaining')
+    ).select_from(days).join(times, true()).join(
+        CheckupType, true()).outerjoin(
+            SlotCapacity,
+            and_(SlotCapacity.slot_date == slot_date,
+                 SlotCapacity.slot_time == times.c.slot_time,
+                 SlotCapacity.checkup_id == CheckupType.checkup_id)).where(
+                     CheckupType.is_active == 1,
+                     booked < CheckupType.max_slots_per_time,
+                     slot_date + times.c.slot_time > from_datetime).order_by(
+                         slot_date, times.c.slot_time,
+                         CheckupType.checkup_id).limit(limit)
+
+    if checkup_id is not None:
+        query = query.where(CheckupType.checkup_id == int(checkup_id))
+
+    return [{
+        'date': row.slot_date.isoformat(),
+        'time': row.slot_time.isoformat(),
+        'checkup_id': row.checkup_id,
+        'checkup_name': row.name,
+        'slots_remaining': row.slots_remaining
+    } for row in session.execute(query)]
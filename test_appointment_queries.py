@@ -0,0 +1,63 @@
+import base64
+import json
+import string
+from datetime import date, time
+import pytest
+from appointment_queries import encode_cursor, decode_cursor, parse_appointment_filters
+
+
+def _cursor(payload):
+    """Encode an arbitrary payload the way encode_cursor does"""
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(date(2025, 12, 31), time(16, 0), 12345)
+    assert decode_cursor(cursor) == (date(2025, 12, 31), time(16, 0), 12345)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(date(2025, 1, 2), time(9, 30, 15), 1)
+    assert set(cursor) <= set(string.ascii_letters + string.digits + '-_')
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor',
+    '!!!!',
+    _cursor(b'\xff\xfe'),
+    _cursor(b'{"a": 1}'),
+    _cursor(b'42'),
+    _cursor(b'null'),
+    _cursor(json.dumps(['2025-01-02', '09:00:00']).encode()),
+    _cursor(json.dumps(['2025-01-02', '09:00:00', 1, 2]).encode()),
+    _cursor(json.dumps(['2025-13-02', '09:00:00', 1]).encode()),
+    _cursor(json.dumps(['2025-01-02', '25:00:00', 1]).encode()),
+    _cursor(json.dumps(['2025-01-02', '09:00:00', 'x']).encode()),
+    _cursor(json.dumps(['2025-01-02', '09:00:00', None]).encode()),
+    _cursor(json.dumps([20250102, '09:00:00', 1]).encode()),
+])
+def test_tampered_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_filters():
+    assert parse_appointment_filters({}) == []
+    conditions = parse_appointment_filters({'start_date': '2025-01-01',
+                                            'end_date': '2025-01-31',
+                                            'status': 'Confirmed',
+                                            'checkup_id': '3',
+                                            'user_id': '7'})
+    assert len(conditions) == 5
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'start_date': '01/02/2025'}, "Invalid date format"),
+    ({'end_date': '2025-02-30'}, "Invalid date format"),
+    ({'checkup_id': 'abc'}, "Invalid checkup_id"),
+    ({'user_id': '1.5'}, "Invalid user_id"),
+])
+def test_malformed_filters_are_rejected(args, message):
+    with pytest.raises(ValueError, match=message):
+        parse_appointment_filters(args)
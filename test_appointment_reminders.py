@@ -0,0 +1,143 @@
+from datetime import date, time
+from types import SimpleNamespace
+import appointment_reminders
+from appointment_reminders import _send_chunk, send_reminders
+from email_service import compile_reminder_template, render_appointment_reminder, SendError
+
+
+class FakePool:
+    """Stands in for smtp_pool, refusing the recipients in failing, and in refused for good"""
+
+    def __init__(self, failing=(), refused=()):
+        self.sent = []
+        self.failing = set(failing)
+        self.refused = set(refused)
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            if message['To'] in self.refused:
+                error = SendError("550 no such user")
+                error.permanent = True
+                results.append(error)
+            elif message['To'] in self.failing:
+                results.append("451 try later")
+            else:
+                self.sent.append(message['To'])
+                results.append(None)
+        return results
+
+
+class FakeConnection:
+
+    def execution_options(self, **options):
+        self.options = options
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeEngine:
+    """Engine of a database without advisory locks"""
+    dialect = SimpleNamespace(name='sqlite')
+
+    def connect(self):
+        return FakeConnection()
+
+
+class FakeSession:
+    """Session whose due reminder query returns the given chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def execute(self, query):
+        return SimpleNamespace(partitions=lambda: iter(self.chunks))
+
+    def close(self):
+        pass
+
+
+def _row(appointment_id, email=None):
+    return SimpleNamespace(appointment_id=appointment_id, appointment_time=time(9, 30),
+                           checkup_name='Blood test', user_name='Sam',
+                           email=email or f"user{appointment_id}@example.com")
+
+
+def test_reminder_is_rendered_and_escaped():
+    template = compile_reminder_template(date(2025, 3, 4))
+    html = render_appointment_reminder(template, '<b>Sam</b>', time(9, 30), 'X & Y')
+    assert '&lt;b&gt;Sam&lt;/b&gt;' in html
+    assert 'X &amp; Y' in html
+    assert '09:30 AM' in html
+    assert "Tuesday, March 04, 2025" in html
+
+
+def test_refused_reminders_are_saved(monkeypatch):
+    saved = []
+    monkeypatch.setattr(appointment_reminders, 'smtp_pool',
+                        FakePool(failing={'user2@example.com', 'user3@example.com'}))
+    monkeypatch.setattr(appointment_reminders, 'save_email_to_file',
+                        lambda to, subject, content: saved.append(to) or to != 'user3@example.com')
+    template = compile_reminder_template(date(2025, 3, 4))
+
+    handled, sent, saved_count = _send_chunk(template, [_row(1), _row(2), _row(3)])
+    # The third could be neither sent nor saved, so it is left for the next run
+    assert handled == [1, 2]
+    assert (sent, saved_count) == (1, 1)
+    assert saved == ['user2@example.com', 'user3@example.com']
+
+
+def test_permanently_refused_reminders_are_not_saved(monkeypatch):
+    saved = []
+    monkeypatch.setattr(appointment_reminders, 'smtp_pool',
+                        FakePool(refused={'user2@example.com'}))
+    monkeypatch.setattr(appointment_reminders, 'save_email_to_file',
+                        lambda to, subject, content: saved.append(to) or True)
+    template = compile_reminder_template(date(2025, 3, 4))
+
+    handled, sent, saved_count = _send_chunk(template, [_row(1), _row(2)])
+    assert handled == [1, 2]
+    assert (sent, saved_count) == (1, 0)
+    assert saved == []
+
+
+def test_unrenderable_reminder_does_not_stop_the_chunk(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(appointment_reminders, 'smtp_pool', pool)
+    template = compile_reminder_template(date(2025, 3, 4))
+    bad = _row(2)
+    bad.appointment_time = None
+
+    handled, sent, saved_count = _send_chunk(template, [_row(1), bad, _row(3)])
+    # The others are sent and marked, so they are not sent again next run
+    assert handled == [1, 3]
+    assert (sent, saved_count) == (2, 0)
+    assert pool.sent == ['user1@example.com', 'user3@example.com']
+
+
+def test_failed_chunk_does_not_stop_the_run(monkeypatch):
+    pool = FakePool()
+    marked = []
+    monkeypatch.setattr(appointment_reminders, 'smtp_pool', pool)
+    monkeypatch.setattr(appointment_reminders, '_mark_reminded',
+                        lambda session_factory, day, ids: marked.extend(ids))
+    chunks = [[_row(1), _row(2)], [_row(3, email='bad')], [_row(4)]]
+    real_send_chunk = appointment_reminders._send_chunk
+
+    def send_chunk(template, rows):
+        if rows[0].email == 'bad':
+            raise RuntimeError("connection lost")
+        return real_send_chunk(template, rows)
+
+    monkeypatch.setattr(appointment_reminders, '_send_chunk', send_chunk)
+
+    counts = send_reminders(FakeEngine(), lambda: FakeSession(chunks),
+                            date(2025, 3, 4), workers=1)
+    assert counts == {'sent': 3, 'saved': 0, 'errors': 1}
+    assert marked == [1, 2, 4]
+    assert pool.sent == ['user1@example.com', 'user2@example.com', 'user4@example.com']
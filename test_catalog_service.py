@@ -0,0 +1,45 @@
+from catalog_service import ListingCache, Listing, CHECKUP_TYPES, SPECIALISTS
+
+
+def test_etag_depends_only_on_body():
+    """Every worker hands out the same strong ETag for the same listing"""
+    assert Listing(b'[{"id": 1}]\n').etag == Listing(b'[{"id": 1}]\n').etag
+    assert Listing(b'[{"id": 1}]\n').etag != Listing(b'[{"id": 2}]\n').etag
+
+
+def test_store_and_get():
+    cache = ListingCache(ttl=60)
+    assert cache.get(CHECKUP_TYPES) is None
+
+    listing = cache.store(CHECKUP_TYPES, cache.version(CHECKUP_TYPES), b'[]')
+    assert cache.get(CHECKUP_TYPES) is listing
+    assert cache.get(CHECKUP_TYPES, ('name',)) is None
+    assert cache.get(SPECIALISTS) is None
+
+
+def test_listing_built_before_invalidation_is_not_kept():
+    cache = ListingCache(ttl=60)
+    version = cache.version(CHECKUP_TYPES)
+    cache.invalidate(CHECKUP_TYPES)
+
+    listing = cache.store(CHECKUP_TYPES, version, b'[]')
+    assert listing.body == b'[]'
+    assert cache.get(CHECKUP_TYPES) is None
+
+
+def test_invalidate_drops_every_variant_of_the_catalog():
+    cache = ListingCache(ttl=60)
+    cache.store(CHECKUP_TYPES, cache.version(CHECKUP_TYPES), b'[]')
+    cache.store(CHECKUP_TYPES, cache.version(CHECKUP_TYPES), b'[]', ('name',))
+    cache.store(SPECIALISTS, cache.version(SPECIALISTS), b'[]')
+
+    cache.invalidate(CHECKUP_TYPES)
+    assert cache.get(CHECKUP_TYPES) is None
+    assert cache.get(CHECKUP_TYPES, ('name',)) is None
+    assert cache.get(SPECIALISTS) is not None
+
+
+def test_expired_listing_is_dropped():
+    cache = ListingCache(ttl=0)
+    cache.store(CHECKUP_TYPES, cache.version(CHECKUP_TYPES), b'[]')
+    assert cache.get(CHECKUP_TYPES) is None
@@ -0,0 +1,36 @@
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+import compression
+from compression import negotiate_encoding
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', object())
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('br, gzip', 'br'),
+    ('gzip, br', 'br'),
+    ('gzip', 'gzip'),
+    ('*', 'br'),
+    ('', None),
+    ('identity', None),
+    # q-values rank the encodings, and q=0 rules one out
+    ('gzip, br;q=0.1', 'gzip'),
+    ('br;q=0.5, gzip;q=0.8', 'gzip'),
+    ('br;q=0.5, gzip;q=0.5', 'br'),
+    ('br;q=0, gzip', 'gzip'),
+    ('br;q=0, gzip;q=0', None),
+    ('gzip;q=0, *', 'br'),
+    ('br;q=0, *;q=0.3', 'gzip'),
+])
+def test_negotiate_encoding(with_brotli, header, expected):
+    assert negotiate_encoding(parse_accept_header(header, Accept)) == expected
+
+
+def test_negotiate_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert negotiate_encoding(parse_accept_header('br, gzip;q=0.5', Accept)) == 'gzip'
+    assert negotiate_encoding(parse_accept_header('br', Accept)) is None
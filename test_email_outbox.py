@@ -0,0 +1,76 @@
+import smtplib
+from datetime import timedelta
+from types import SimpleNamespace
+import pytest
+from email_service import SendError
+from email_outbox import (record_delivery, retry_delay, EMAIL_MAX_ATTEMPTS,
+                          EMAIL_RETRY_BASE_SECONDS, EMAIL_RETRY_MAX_SECONDS)
+
+
+class FakeSession:
+    """Just enough of a session for record_delivery"""
+
+    def __init__(self, email):
+        self.email = email
+        self.commits = 0
+
+    def get(self, model, email_id):
+        return self.email if self.email and self.email.email_id == email_id else None
+
+    def commit(self):
+        self.commits += 1
+
+
+def _pending_email():
+    return SimpleNamespace(email_id=1, status='Pending', sent_at=None,
+                           last_error=None, next_attempt_at=None)
+
+
+@pytest.mark.parametrize('attempts', [1, 2, 5, 30])
+def test_retry_delay_grows_and_is_capped(attempts):
+    delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+    for _ in range(20):
+        assert timedelta(seconds=delay / 2) <= retry_delay(attempts) <= timedelta(seconds=delay)
+
+
+def test_record_sent():
+    session = FakeSession(_pending_email())
+    assert record_delivery(session, 1, 1) == 'Sent'
+    assert session.email.sent_at is not None
+    assert session.commits == 1
+
+
+def test_record_failure_is_retried():
+    session = FakeSession(_pending_email())
+    assert record_delivery(session, 1, 1, "451 try later") == 'Pending'
+    assert session.email.next_attempt_at is not None
+    assert session.email.last_error == "451 try later"
+
+
+def test_record_failure_out_of_attempts():
+    session = FakeSession(_pending_email())
+    assert record_delivery(session, 1, EMAIL_MAX_ATTEMPTS, "451 try later") == 'Failed'
+
+
+def test_record_permanent_failure_is_not_retried():
+    session = FakeSession(_pending_email())
+    assert record_delivery(session, 1, 1, "550 no such user", permanent=True) == 'Failed'
+
+
+def test_record_missing_email():
+    assert record_delivery(FakeSession(None), 1, 1) is None
+
+
+@pytest.mark.parametrize('exception, permanent', [
+    (smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no such user')}), True),
+    (smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no such user'),
+                                    'b@example.com': (451, b'try later')}), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.com': (452, b'mailbox full')}), False),
+    (smtplib.SMTPDataError(554, b'rejected'), False),
+    (smtplib.SMTPServerDisconnected('gone'), False),
+    (UnicodeEncodeError('ascii', 'é', 0, 1, 'ordinal not in range'), False),
+])
+def test_send_error(exception, permanent):
+    error = SendError.from_exception(exception)
+    assert error.permanent is permanent
+    assert error == str(exception)
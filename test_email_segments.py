@@ -0,0 +1,100 @@
+import os
+import pytest
+import email_segments
+from email_segments import (append_email, read_index, read_records, segment_names,
+                            _encode, SEGMENT_LOG_SUFFIX, SEGMENT_INDEX_SUFFIX)
+
+
+@pytest.fixture(autouse=True)
+def no_fsync(monkeypatch):
+    monkeypatch.setattr(email_segments, 'SPOOL_FSYNC', False)
+
+
+def _log_path(spool_dir, segment):
+    return os.path.join(spool_dir, segment + SEGMENT_LOG_SUFFIX)
+
+
+def _recipients(spool_dir, segment):
+    return [email and email['to'] for _, email in read_records(spool_dir, segment)]
+
+
+def test_append_and_read(tmp_path):
+    first = append_email(str(tmp_path), 'a@example.com', 'Hello', '<p>One</p>', saved_at=10)
+    second = append_email(str(tmp_path), 'b@example.com', 'Hello', '<p>Two</p>')
+    assert first == ('segment_00000001', 0)
+    assert second[0] == first[0] and second[1] > 0
+
+    records = list(read_records(str(tmp_path), first[0]))
+    assert [offset for offset, _ in records] == [first[1], second[1]]
+    assert records[0][1] == {'to': 'a@example.com', 'subject': 'Hello',
+                             'content': '<p>One</p>', 'saved_at': 10}
+    assert list(read_records(str(tmp_path), first[0], [second[1]]))[0][1]['to'] == 'b@example.com'
+
+
+def test_missing_folder_has_no_segments(tmp_path):
+    assert segment_names(str(tmp_path / 'missing')) == []
+    assert read_index(str(tmp_path), 'segment_00000001') == []
+
+
+def test_torn_tail_is_cut_off_by_the_next_append(tmp_path):
+    spool_dir = str(tmp_path)
+    segment, _ = append_email(spool_dir, 'a@example.com', 'S', 'one')
+    size = os.path.getsize(_log_path(spool_dir, segment))
+    # A writer died halfway through its record
+    with open(_log_path(spool_dir, segment), 'ab') as log:
+        log.write(_encode({'to': 'torn@example.com'})[:-3])
+
+    _, offset = append_email(spool_dir, 'b@example.com', 'S', 'two')
+    assert offset == size
+    assert _recipients(spool_dir, segment) == ['a@example.com', 'b@example.com']
+
+
+def test_unindexed_record_is_indexed_by_the_next_append(tmp_path):
+    spool_dir = str(tmp_path)
+    segment, _ = append_email(spool_dir, 'a@example.com', 'S', 'one')
+    # A writer died after writing its record but before indexing it
+    with open(_log_path(spool_dir, segment), 'ab') as log:
+        log.write(_encode({'to': 'b@example.com', 'subject': 'S',
+                           'content': 'two', 'saved_at': 0}))
+        log.write(b'\x00\x00')
+
+    append_email(spool_dir, 'c@example.com', 'S', 'three')
+    assert _recipients(spool_dir, segment) == ['a@example.com', 'b@example.com',
+                                               'c@example.com']
+
+
+def test_index_ahead_of_log_is_trimmed(tmp_path):
+    spool_dir = str(tmp_path)
+    segment, _ = append_email(spool_dir, 'a@example.com', 'S', 'one')
+    _, second = append_email(spool_dir, 'b@example.com', 'S', 'two')
+    with open(_log_path(spool_dir, segment), 'r+b') as log:
+        log.truncate(second + 4)
+    with open(os.path.join(spool_dir, segment + SEGMENT_INDEX_SUFFIX), 'ab') as index:
+        index.write(b'\x01')
+
+    append_email(spool_dir, 'c@example.com', 'S', 'three')
+    assert _recipients(spool_dir, segment) == ['a@example.com', 'c@example.com']
+
+
+def test_corrupt_record_reads_as_none(tmp_path):
+    spool_dir = str(tmp_path)
+    segment, _ = append_email(spool_dir, 'a@example.com', 'S', 'one')
+    append_email(spool_dir, 'b@example.com', 'S', 'two')
+    with open(_log_path(spool_dir, segment), 'r+b') as log:
+        log.seek(12)
+        byte = log.read(1)
+        log.seek(12)
+        log.write(bytes([byte[0] ^ 0xff]))
+
+    assert _recipients(spool_dir, segment) == [None, 'b@example.com']
+
+
+def test_segments_rotate_at_the_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(email_segments, 'SPOOL_SEGMENT_BYTES', 1)
+    spool_dir = str(tmp_path)
+    for recipient in ('a@example.com', 'b@example.com', 'c@example.com'):
+        append_email(spool_dir, recipient, 'S', 'content')
+
+    assert segment_names(spool_dir) == ['segment_00000001', 'segment_00000002',
+                                        'segment_00000003']
+    assert _recipients(spool_dir, 'segment_00000003') == ['c@example.com']
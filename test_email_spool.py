@@ -0,0 +1,169 @@
+import fcntl
+import json
+import os
+import pytest
+import email_segments
+import email_spool
+from email_service import SendError
+from email_segments import append_email, read_records, segment_names
+from email_spool import (drain_spool, parse_spool_file, DONE_DIR, FAILED_DIR,
+                         LOCK_FILE, STATE_FILE)
+
+NOW = 1_000_000.0
+
+
+class FakePool:
+    """Stands in for smtp_pool, refusing the recipients in failing, and in refused for good"""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+        self.refused = set()
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            if message['To'] in self.refused:
+                error = SendError("550 no such user")
+                error.permanent = True
+                results.append(error)
+            elif message['To'] in self.failing:
+                results.append("451 try later")
+            else:
+                self.sent.append(message['To'])
+                results.append(None)
+        return results
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(email_segments, 'SPOOL_FSYNC', False)
+    pool = FakePool()
+    monkeypatch.setattr(email_spool, 'smtp_pool', pool)
+    return pool
+
+
+def _state(spool_dir):
+    with open(os.path.join(spool_dir, STATE_FILE)) as f:
+        return json.load(f)
+
+
+def test_drain_sends_every_saved_email(tmp_path, pool):
+    spool_dir = str(tmp_path)
+    for recipient in ('a@example.com', 'b@example.com', 'c@example.com'):
+        append_email(spool_dir, recipient, 'S', 'content')
+
+    assert drain_spool(spool_dir, now=NOW) == {'sent': 3, 'failed': 0,
+                                               'given_up': 0, 'waiting': 0}
+    assert sorted(pool.sent) == ['a@example.com', 'b@example.com', 'c@example.com']
+    # Nothing is sent twice
+    assert drain_spool(spool_dir, now=NOW)['sent'] == 0
+    assert len(pool.sent) == 3
+
+
+def test_failed_email_waits_for_its_retry(tmp_path, pool):
+    spool_dir = str(tmp_path)
+    append_email(spool_dir, 'a@example.com', 'S', 'content')
+    segment, offset = append_email(spool_dir, 'b@example.com', 'S', 'content')
+    pool.failing.add('b@example.com')
+
+    assert drain_spool(spool_dir, now=NOW) == {'sent': 1, 'failed': 1,
+                                               'given_up': 0, 'waiting': 0}
+    retry = _state(spool_dir)[segment]['retries'][str(offset)]
+    assert retry['attempts'] == 1
+    assert retry['last_error'] == "451 try later"
+    assert retry['next_attempt'] > NOW
+
+    # Not due yet
+    pool.failing.clear()
+    assert drain_spool(spool_dir, now=NOW + 1)['waiting'] == 1
+    assert pool.sent == ['a@example.com']
+
+    assert drain_spool(spool_dir, now=retry['next_attempt'])['sent'] == 1
+    assert pool.sent == ['a@example.com', 'b@example.com']
+    assert _state(spool_dir)[segment]['retries'] == {}
+
+
+def test_email_is_given_up_after_max_attempts(tmp_path, pool, monkeypatch):
+    monkeypatch.setattr(email_spool, 'SPOOL_MAX_ATTEMPTS', 2)
+    spool_dir = str(tmp_path)
+    append_email(spool_dir, 'b@example.com', 'S', 'content', saved_at=5)
+    pool.failing.add('b@example.com')
+
+    assert drain_spool(spool_dir, now=NOW)['failed'] == 1
+    assert drain_spool(spool_dir, now=NOW + 10 ** 6)['given_up'] == 1
+    assert drain_spool(spool_dir, now=NOW + 10 ** 7) == {'sent': 0, 'failed': 0,
+                                                         'given_up': 0, 'waiting': 0}
+
+    failed_dir = os.path.join(spool_dir, FAILED_DIR)
+    (segment,) = segment_names(failed_dir)
+    [(_, email)] = read_records(failed_dir, segment)
+    assert email == {'to': 'b@example.com', 'subject': 'S', 'content': 'content',
+                     'saved_at': 5}
+
+
+def test_permanently_refused_email_is_given_up_at_once(tmp_path, pool):
+    spool_dir = str(tmp_path)
+    append_email(spool_dir, 'a@example.com', 'S', 'content')
+    segment, offset = append_email(spool_dir, 'gone@example.com', 'S', 'content')
+    pool.refused.add('gone@example.com')
+
+    assert drain_spool(spool_dir, now=NOW) == {'sent': 1, 'failed': 0,
+                                               'given_up': 1, 'waiting': 0}
+    assert _state(spool_dir)[segment]['retries'] == {}
+    (failed,) = segment_names(os.path.join(spool_dir, FAILED_DIR))
+    [(_, email)] = read_records(os.path.join(spool_dir, FAILED_DIR), failed)
+    assert email['to'] == 'gone@example.com'
+    # Never tried again
+    assert drain_spool(spool_dir, now=NOW + 10 ** 7)['given_up'] == 0
+
+
+def test_drained_segments_move_to_done(tmp_path, pool, monkeypatch):
+    monkeypatch.setattr(email_segments, 'SPOOL_SEGMENT_BYTES', 1)
+    spool_dir = str(tmp_path)
+    for recipient in ('a@example.com', 'b@example.com', 'c@example.com'):
+        append_email(spool_dir, recipient, 'S', 'content')
+    pool.failing.add('b@example.com')
+
+    drain_spool(spool_dir, now=NOW)
+    # The second segment still has an email to retry, and writers still use the third
+    assert segment_names(spool_dir) == ['segment_00000002', 'segment_00000003']
+    assert segment_names(os.path.join(spool_dir, DONE_DIR)) == ['segment_00000001']
+    assert set(_state(spool_dir)) == {'segment_00000002', 'segment_00000003'}
+
+
+def test_legacy_files_are_imported(tmp_path, pool):
+    spool_dir = str(tmp_path)
+    with open(os.path.join(spool_dir, 'email_20250101_a.html'), 'w') as f:
+        f.write('<html><body><p><strong>To:</strong> a@example.com</p>'
+                '<p><strong>Subject:</strong> Hello</p>'
+                '<div class="email-content"><p>Hi</p></div></body></html>')
+    with open(os.path.join(spool_dir, 'email_20250101_b.html'), 'w') as f:
+        f.write('<html>not an email</html>')
+
+    assert drain_spool(spool_dir, now=NOW)['sent'] == 1
+    assert pool.sent == ['a@example.com']
+    assert not os.path.exists(os.path.join(spool_dir, 'email_20250101_a.html'))
+    assert os.path.exists(os.path.join(spool_dir, FAILED_DIR, 'email_20250101_b.html'))
+
+
+def test_only_one_drain_at_a_time(tmp_path, pool):
+    spool_dir = str(tmp_path)
+    append_email(spool_dir, 'a@example.com', 'S', 'content')
+    with open(os.path.join(spool_dir, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert drain_spool(spool_dir, now=NOW) is None
+    assert pool.sent == []
+
+
+def test_missing_folder(tmp_path, pool):
+    assert drain_spool(str(tmp_path / 'missing'), now=NOW)['sent'] == 0
+
+
+def test_parse_spool_file():
+    assert parse_spool_file(
+        '<p><strong>To:</strong> a@example.com </p><p><strong>Subject:</strong> Hi</p>'
+        '<div class="email-content">\n<p>Body</p>\n</div>') == (
+            'a@example.com', 'Hi', '<p>Body</p>')
+    with pytest.raises(ValueError):
+        parse_spool_file('<p>Nothing here</p>')
@@ -0,0 +1,36 @@
+from datetime import date
+import pytest
+from partitions import (add_months, partition_name, booking_window,
+                        PARTITION_NAME, PARTITION_MONTHS_AHEAD)
+
+
+@pytest.mark.parametrize('month, months, expected', [
+    (date(2025, 6, 15), 0, date(2025, 6, 1)),
+    (date(2025, 1, 31), 1, date(2025, 2, 1)),
+    (date(2025, 11, 30), 1, date(2025, 12, 1)),
+    (date(2025, 12, 31), 1, date(2026, 1, 1)),
+    (date(2025, 12, 1), 13, date(2027, 1, 1)),
+    (date(2026, 1, 1), -1, date(2025, 12, 1)),
+    (date(2026, 1, 31), -13, date(2024, 12, 1)),
+    (date(2026, 3, 1), -24, date(2024, 3, 1)),
+    (date(2024, 2, 29), 12, date(2025, 2, 1)),
+])
+def test_add_months(month, months, expected):
+    assert add_months(month, months) == expected
+
+
+def test_partition_name_round_trip():
+    name = partition_name(date(2025, 1, 17))
+    assert name == 'appointments_y2025m01'
+    match = PARTITION_NAME.match(name)
+    assert match and (int(match.group(1)), int(match.group(2))) == (2025, 1)
+    assert not PARTITION_NAME.match('appointments_default')
+
+
+def test_booking_window_crosses_the_year():
+    window = booking_window(date(2025, 12, 20))
+    assert len(window) == PARTITION_MONTHS_AHEAD + 1
+    assert window[0] == date(2025, 12, 1)
+    assert window[1] == date(2026, 1, 1)
+    assert window == sorted(set(window))
+    assert all(month.day == 1 for month in window)
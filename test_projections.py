@@ -0,0 +1,49 @@
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+from projections import APPOINTMENT_LIST, CHECKUP_TYPE_LIST, USER_LIST
+
+
+def test_select_without_fields_returns_the_projection():
+    assert CHECKUP_TYPE_LIST.select(None) is CHECKUP_TYPE_LIST
+    assert CHECKUP_TYPE_LIST.select('') is CHECKUP_TYPE_LIST
+    assert CHECKUP_TYPE_LIST.select(' , ') is CHECKUP_TYPE_LIST
+
+
+def test_select_keeps_projection_order():
+    selected = CHECKUP_TYPE_LIST.select(' price,name ,checkup_id')
+    assert selected.keys == ('checkup_id', 'name', 'price')
+    assert [column.key for column in selected.columns] == ['checkup_id', 'name', 'price']
+
+
+def test_select_is_cached():
+    assert USER_LIST.select('email,user_id') is USER_LIST.select('user_id,email')
+    assert USER_LIST.select('email') is not USER_LIST.select('email', required=('user_id',))
+
+
+def test_select_unknown_field():
+    with pytest.raises(ValueError, match="Unknown field\\(s\\): password, secret"):
+        USER_LIST.select('user_id,secret,password')
+
+
+def test_required_columns_are_selected_but_not_returned():
+    selected = APPOINTMENT_LIST.select(
+        'status', required=('appointment_date', 'appointment_time', 'appointment_id'))
+    assert selected.keys == ('status',)
+    assert [column.key for column in selected.columns] == [
+        'status', 'appointment_id', 'appointment_date', 'appointment_time']
+    assert selected.serialize(('Confirmed', 7, None, None)) == {'status': 'Confirmed'}
+
+
+def test_serialize_turns_numeric_into_float():
+    selected = CHECKUP_TYPE_LIST.select('name,price')
+    assert selected.serialize(('Blood test', Decimal('49.90'))) == {
+        'name': 'Blood test', 'price': 49.9}
+    assert selected.serialize(('Blood test', None)) == {'name': 'Blood test', 'price': None}
+
+
+def test_serialize_object():
+    record = SimpleNamespace(name='Blood test', price=Decimal('10'), checkup_id=3)
+    assert CHECKUP_TYPE_LIST.select('price').serialize_object(record) == {'price': 10.0}
+    assert CHECKUP_TYPE_LIST.select('checkup_id,price').serialize_object(record) == {
+        'checkup_id': 3, 'price': 10.0}
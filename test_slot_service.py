@@ -0,0 +1,92 @@
+from datetime import date, time
+from types import SimpleNamespace
+import pytest
+import slot_service
+from slot_service import (slot_keys, count_overlapping, get_booked_count, move_slots,
+                          TIME_SLOTS)
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+@pytest.mark.parametrize('start, duration, expected', [
+    # A one-hour checkup touches only its own slot; the next one starts as it ends
+    (time(10, 0), 60, [time(10, 0)]),
+    # Longer than the slot spacing: the neighbours on both sides are taken too
+    (time(10, 0), 90, [time(9, 0), time(10, 0), time(11, 0)]),
+    # The lunch gap: 13:00 is two hours after 11:00
+    (time(11, 0), 90, [time(10, 0), time(11, 0)]),
+    # Exactly one duration away does not overlap
+    (time(13, 0), 240, [time(10, 0), time(11, 0), time(13, 0), time(14, 0),
+                        time(15, 0), time(16, 0)]),
+    # Off-grid bookings keep their own start time
+    (time(10, 30), 30, [time(10, 30)]),
+    (time(10, 30), 45, [time(10, 0), time(10, 30), time(11, 0)]),
+    (time(8, 0), 61, [time(8, 0), time(9, 0)]),
+])
+def test_slot_keys(start, duration, expected):
+    assert slot_keys(start, duration) == expected
+
+
+# Bookings at 09:00, 09:30, 10:00, 10:59, 11:00 and 16:00
+BOOKINGS = sorted(_seconds(t) for t in (time(9, 0), time(9, 30), time(10, 0),
+                                        time(10, 59), time(11, 0), time(16, 0)))
+
+
+@pytest.mark.parametrize('slot, duration, expected', [
+    # 09:00 and 11:00 end or start exactly as the 10:00 slot does
+    (time(10, 0), 60, 3),
+    (time(10, 0), 90, 5),
+    (time(13, 0), 60, 0),
+    (time(13, 0), 121, 1),
+    (time(13, 0), 122, 2),
+    (time(16, 0), 60, 1),
+])
+def test_count_overlapping(slot, duration, expected):
+    assert count_overlapping(BOOKINGS, slot, duration) == expected
+
+
+@pytest.mark.parametrize('duration', [15, 30, 60, 90, 120, 240])
+def test_ledger_keys_match_overlap_count(duration):
+    """A booking counts against exactly the ledger slots slot_keys gives it"""
+    bookings = [time(hour, minute) for hour in range(8, 18) for minute in (0, 20, 30, 45)]
+    for booking in bookings:
+        keys = slot_keys(booking, duration)
+        for slot in TIME_SLOTS:
+            overlapping = count_overlapping([_seconds(booking)], slot, duration)
+            assert overlapping == (1 if slot in keys else 0), (booking, slot)
+
+
+class FakeSession:
+    """Session with no ledger rows"""
+
+    def __init__(self):
+        self.statements = []
+
+    def query(self, *entities):
+        return SimpleNamespace(filter=lambda *criteria: SimpleNamespace(scalar=lambda: None))
+
+    def execute(self, statement):
+        self.statements.append(statement)
+        return SimpleNamespace(all=lambda: [])
+
+
+@pytest.fixture
+def deleted_checkup(monkeypatch):
+    monkeypatch.setattr(slot_service, 'checkup_catalog',
+                        SimpleNamespace(get=lambda session, checkup_id: None))
+
+
+def test_deleted_checkup_has_no_bookings(deleted_checkup):
+    assert get_booked_count(FakeSession(), date(2099, 1, 5), time(10, 0), 404) == 0
+
+
+def test_deleted_checkup_slots(deleted_checkup):
+    slot = (date(2099, 1, 5), time(10, 0), 404)
+    # Its ledger rows went with it, so there is nothing to give back
+    assert move_slots(FakeSession(), release=[slot]) == {}
+    # but nothing can be booked for it either
+    session = FakeSession()
+    assert move_slots(session, reserve=[slot], max_slots=5) is None
+    assert session.statements == []
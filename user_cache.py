@@ -0,0 +1,130 @@
+"""
+Cached user loader for HealthAssist application
+
+Flask-Login loads the logged-in user on every authenticated request.
+Each worker process keeps a lightweight, detached copy of recently seen
+users for a short time instead of querying the users table each time.
+Copies are dropped when a user is changed in this process or announced
+as changed by another one through PostgreSQL NOTIFY (see slot_events.py).
+"""
+import os
+import threading
+import time as clock
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import func, select
+from models import User
+
+# PostgreSQL NOTIFY channel announcing user changes
+USER_CHANNEL = 'user_changes'
+
+# Seconds a cached user is trusted if a change announcement is missed
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+
+# Users kept per process; the least recently used are dropped first
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+
+class SessionUser(UserMixin):
+    """Read-only copy of the User columns request handling needs"""
+
+    __slots__ = ('user_id', 'user_name', 'username', 'email', 'user_type')
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            object.__setattr__(self, field, getattr(row, field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"SessionUser is read-only ({name})")
+
+    def get_id(self):
+        return str(self.user_id)
+
+    def __repr__(self):
+        return f"<SessionUser(user_id={self.user_id}, username={self.username}, user_type={self.user_type})>"
+
+
+class UserCache:
+    """
+    Recently loaded users, each kept for a short TTL
+
+    Like the catalog snapshot, the cache has a version bumped on every
+    invalidation, and a user loaded while it moved on is returned but not
+    kept.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session, user_id):
+        """
+        Get a user by ID
+
+        Args:
+            session: Database session, used only on a cache miss
+            user_id: ID of the user (as stored in the login session)
+
+        Returns:
+            SessionUser: The user, or None if it does not exist
+        """
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                user, loaded_at = entry
+                if clock.monotonic() - loaded_at < self.ttl:
+                    self._users.move_to_end(user_id)
+                    return user
+                del self._users[user_id]
+            version = self.version
+
+        row = session.execute(
+            select(*(getattr(User, field) for field in SessionUser.__slots__)
+                   ).where(User.user_id == user_id)).first()
+        if row is None:
+            return None
+        user = SessionUser(row)
+
+        with self._lock:
+            if self.version == version:
+                self._users[user_id] = (user, clock.monotonic())
+                while len(self._users) > self.max_size:
+                    self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        """
+        Drop a cached user
+
+        Args:
+            user_id: ID of the user, or None for every user
+        """
+        with self._lock:
+            self.version += 1
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+
+
+def publish_user_change(session, user_id):
+    """
+    Announce a user change to every worker when the transaction commits
+
+    Args:
+        session: Database session
+        user_id: ID of the changed user
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(select(func.pg_notify(USER_CHANNEL, str(user_id))))